@@ -6,13 +6,13 @@ import numpy as np
 from PIL import Image
 import tempfile
 from typing import Dict
-from pytorchvideo.data.encoded_video import EncodedVideo
 from torch import nn
 from fvcore.common.config import CfgNode
 
 from src.models import create_model
 from src.models.captioning_model_linear_proj import VideoCaptioningModelLinear
-from src.datasets.transformations import get_val_transforms
+from src.datasets.transformations import get_val_transforms, get_num_sampled_frames
+from src.datasets.sampled_decoding import SampledEncodedVideo, sliding_window_clips
 
 DATA_DIR = "data/raw/Charades"
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -60,30 +60,20 @@ class ClsModel:
         return lit_module
 
     def get_clip_tensors(self, video):
-        """Get all clip (chunk) tensors from a video.
-            Each last for 'clip_duration' seconds."""
-        video_duration = float(video._duration)
-        all_clip_tensors = []
-
-        for clip_start_sec in np.arange(0, video_duration, self.clip_duration):
-            clip_end_sec = min(clip_start_sec + self.clip_duration, video_duration)
-            clip_data = video.get_clip(start_sec=clip_start_sec, end_sec=clip_end_sec)
-            if clip_data['video'] is None:
-                continue
-            clip_data = self.transform(clip_data)
-            clip_tensor = clip_data['video']  # (C, T, H, W)
-            all_clip_tensors.append(clip_tensor)
-        return all_clip_tensors
+        """Get all clip (chunk) tensors from a video, (B, C, T, H, W).
+            Each last for 'clip_duration' seconds, the video is decoded once."""
+        return sliding_window_clips(video, self.clip_duration, transform=self.transform)
 
     def get_input(self, vid_path):
         """Read video, split into chunks by clip duration,
              prepare the tensors for inference."""
-        video = EncodedVideo.from_path(vid_path, decode_audio=False)
+        # only decodes the frames the transforms keep
+        video = SampledEncodedVideo.from_path(vid_path, get_num_sampled_frames(self.config))
 
         # concat clip tensors at the time dimension to write to a gif
-        all_clip_tensors = self.get_clip_tensors(video)
+        inp_video_tensors = self.get_clip_tensors(video)  # (B, C, T, H, W)
+        video.close()
         # Prepare video tensor for inference
-        inp_video_tensors = torch.stack(all_clip_tensors, dim=0)  # (B, C, T, H, W)
         inp_video_tensors = inp_video_tensors.permute(0, 2, 1, 3, 4)  # (B, C, T, H, W) -> (B, T, C, H, W)
         return inp_video_tensors
 
@@ -134,7 +124,7 @@ class CapModelLinear(ClsModel):
             inp_video_tensors = inp_video_tensors.to(DEVICE)
             # bs = inp_video_tensors.shape[0]
             inp_video_tensors = inp_video_tensors.reshape(-1, 8, 3, 224, 224)
-            model_output = self.lit_module.encoder(inp_video_tensors)
+            model_output = self.lit_module.encoder(self.lit_module.prepare_input(inp_video_tensors))
             model_output = self.lit_module.head.beam_search(model_output.reshape(-1, 12, 768), 128, 3)
         return model_output
 
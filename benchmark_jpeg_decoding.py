@@ -0,0 +1,86 @@
+"""
+Compare full-size and scaled (DCT-domain) decoding of the Charades JPEG frames: decode time
+per frame, and how far the clips are apart after the validation transforms (resize and
+normalization), i.e. what the model sees:
+
+    python benchmark_jpeg_decoding.py -c src/config/cls_svt_charades_s224_f8_exp0.yaml --num_videos 50
+
+Scaled decoding is what DATA.SCALED_DECODING turns on, frames are decoded to no less than
+DATA.IMG_SIZE on both sides. The files are read before timing, only decoding is measured.
+"""
+import pathlib
+import argparse
+
+import numpy as np
+import torch
+from fvcore.common.config import CfgNode
+from pytorchvideo.data.utils import thwc_to_cthw
+
+from src.datasets.annotation_index import load_annotation_index
+from src.datasets.frame_archive import decode_jpeg, jpeg_size
+from src.datasets.sampled_decoding import uniform_indices
+from src.datasets.transformations import get_val_transforms, get_num_sampled_frames
+from src.utils.async_writer import StageTimer
+
+parser = argparse.ArgumentParser(description="Benchmark scaled JPEG decoding")
+parser.add_argument("-c", "--config", help="The config file",
+                        default="src/config/cls_svt_charades_s224_f8_exp0.yaml")
+parser.add_argument("--split", choices=["train", "val"], default="val")
+parser.add_argument("--num_videos", type=int, default=20)
+parser.add_argument("--repeats", type=int, default=3, help="Decoding passes over the frames, for stabler timings")
+
+def to_clip(frames, transform) -> torch.Tensor:
+    clip = thwc_to_cthw(torch.as_tensor(np.stack(frames))).to(torch.float32)
+    return transform({"video": clip})["video"]
+
+def main(args):
+    config = CfgNode(CfgNode.load_yaml_with_base(args.config))
+    config.DATA.UINT8_CLIPS = False  # compare the normalized float clips
+    size = config.DATA.IMG_SIZE
+    transform = get_val_transforms(config)
+    csv_name = config.DATA.TRAIN_CSV if args.split == "train" else config.DATA.TEST_CSV
+    index = load_annotation_index(str(pathlib.Path(config.DATA.ROOT_PATH) / csv_name),
+                                  config.DATA.get("ANNOTATION_INDEX_DIR", None))
+
+    timer = StageTimer()
+    num_frames, abs_diffs, max_diff, sq_err, sq_ref = 0, [], 0.0, 0.0, 0.0
+    source_size, decoded_size = None, None
+    for video_index in range(min(args.num_videos, len(index))):
+        frame_paths = index.frame_paths(video_index)
+        frame_paths = [frame_paths[i] for i in uniform_indices(len(frame_paths), get_num_sampled_frames(config))]
+        blobs = []
+        for path in frame_paths:
+            with open(path, "rb") as f:
+                blobs.append(f.read())
+        for _ in range(args.repeats):
+            with timer.time("full"):
+                full = [decode_jpeg(data) for data in blobs]
+            with timer.time("scaled"):
+                scaled = [decode_jpeg(data, size) for data in blobs]
+        num_frames += len(blobs) * args.repeats
+        source_size, decoded_size = jpeg_size(blobs[0]), scaled[0].shape[:2]
+
+        with timer.time("full_transform"):
+            full_clip = to_clip(full, transform)
+        with timer.time("scaled_transform"):
+            scaled_clip = to_clip(scaled, transform)
+        diff = (full_clip - scaled_clip).abs()
+        abs_diffs.append(diff.mean().item())
+        max_diff = max(max_diff, diff.max().item())
+        sq_err += diff.pow(2).sum().item()
+        sq_ref += full_clip.pow(2).sum().item()
+
+    if num_frames == 0:
+        raise ValueError("No videos to benchmark")
+    seconds = timer.seconds
+    print(f"{num_frames // args.repeats} frames of {min(args.num_videos, len(index))} videos, "
+          f"{source_size} decoded to {decoded_size} for IMG_SIZE {size}")
+    print(f"decode full   {1000 * seconds['full'] / num_frames:.2f} ms/frame")
+    print(f"decode scaled {1000 * seconds['scaled'] / num_frames:.2f} ms/frame "
+          f"({seconds['full'] / max(seconds['scaled'], 1e-9):.2f}x faster)")
+    print(f"transforms    full {seconds['full_transform']:.2f}s, scaled {seconds['scaled_transform']:.2f}s")
+    print(f"normalized clip difference: mean abs {np.mean(abs_diffs):.4f}, max abs {max_diff:.4f}, "
+          f"relative L2 {np.sqrt(sq_err / max(sq_ref, 1e-12)):.4f}")
+
+if __name__ == '__main__':
+    main(parser.parse_args())
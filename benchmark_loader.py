@@ -0,0 +1,87 @@
+"""
+Measure the clip DataLoader of a config: batches / clips per second and the bytes every
+batch costs to move from the workers to the main process (through shared memory):
+
+    python benchmark_loader.py -c src/config/cls_svt_charades_s224_f8_exp0.yaml
+    python benchmark_loader.py -c src/config/cls_svt_charades_s224_f8_exp0.yaml --uint8_clips
+
+--uint8_clips sets DATA.UINT8_CLIPS. With --device the host to device copy and the
+batched normalization (`BatchTransform`) are part of the timing, as in training.
+"""
+import time
+import argparse
+
+import torch
+from torch.utils.data import DataLoader
+from fvcore.common.config import CfgNode
+
+from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn
+from src.datasets.transformations import get_batch_transform
+from src.utils.async_writer import StageTimer
+
+parser = argparse.ArgumentParser(description="Benchmark the clip DataLoader")
+parser.add_argument("-c", "--config", help="The config file",
+                        default="src/config/cls_svt_charades_s224_f8_exp0.yaml")
+parser.add_argument("--split", choices=["train", "val"], default="train")
+parser.add_argument("--num_batches", type=int, default=50, help="Batches to time, after the warmup")
+parser.add_argument("--warmup", type=int, default=5, help="Batches to skip while the workers start")
+parser.add_argument("--batch_size", type=int, default=None, help="Defaults to TRAIN.BATCH_SIZE")
+parser.add_argument("--num_workers", type=int, default=None, help="Defaults to DATA.NUM_WORKERS")
+parser.add_argument("--uint8_clips", action="store_true", default=False)
+parser.add_argument("--device", default=None, help="e.g. cuda, also time the transfer and normalization")
+
+def batch_nbytes(obj) -> int:
+    """Bytes of all tensors in a (nested) batch."""
+    if isinstance(obj, torch.Tensor):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(batch_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(batch_nbytes(v) for v in obj)
+    return 0
+
+def main(args):
+    config = CfgNode(CfgNode.load_yaml_with_base(args.config))
+    if args.uint8_clips:
+        config.DATA.UINT8_CLIPS = True
+    dataset = create_dataset(config)
+    split_dataset = dataset.get_train_dataset() if args.split == "train" else dataset.get_val_dataset()
+    collate_fn = classification_collate_fn(config) if config.MODEL.TYPE == "classification" \
+        else captioning_collate_fn(config)
+    loader = DataLoader(split_dataset, batch_size=args.batch_size or config.TRAIN.BATCH_SIZE,
+                        num_workers=config.DATA.NUM_WORKERS if args.num_workers is None else args.num_workers,
+                        pin_memory=args.device is not None, drop_last=True, collate_fn=collate_fn)
+    batch_transform = get_batch_transform(config).to(args.device) if args.device else None
+
+    timer = StageTimer()
+    num_batches, num_clips, num_bytes, start = 0, 0, 0, None
+    for i, (X, y) in enumerate(timer.iterate("load", loader)):
+        if i == args.warmup:
+            timer.seconds.clear()  # the warmup doesn't count
+            start = time.perf_counter()
+        if i >= args.warmup:
+            num_batches += 1
+            num_clips += X.shape[0]
+            num_bytes += batch_nbytes((X, y))
+        if batch_transform is not None:
+            with timer.time("device"):
+                X = X.to(args.device, non_blocking=True)
+                if X.dtype == torch.uint8:
+                    X = batch_transform(X, flip=args.split == "train")
+                if X.is_cuda:
+                    torch.cuda.synchronize()
+        if num_batches == args.num_batches:
+            break
+    if num_batches == 0:
+        raise ValueError(f"The loader ran out before {args.warmup} warmup batches")
+    seconds = time.perf_counter() - start
+
+    print(f"clip dtype {'uint8' if args.uint8_clips else 'float32'}, {num_batches} batches in {seconds:.1f}s: "
+          f"{num_batches / seconds:.2f} batches/s, {num_clips / seconds:.1f} clips/s")
+    print(f"{num_bytes / num_batches / 2**20:.1f} MiB per batch from the workers")
+    print(timer.report())
+    if getattr(dataset, "frame_pool", None) is not None:
+        print("frame pool:", dataset.frame_pool.stats())
+
+if __name__ == '__main__':
+    main(parser.parse_args())
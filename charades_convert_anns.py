@@ -1,15 +1,28 @@
 """Use os for IO"""
 import os
+import time
+import argparse
+from multiprocessing import Pool
+
 import pandas as pd
 import numpy as np
 from tqdm.auto import tqdm
-from collections import defaultdict
 
 """
-This script takes charades video annotations from ../Charades/Charades_v1_{train/test}.csv 
+This script takes charades video annotations from ../Charades/Charades_v1_{train/test}.csv
 and frame data from ../Charades/Charades_frames/ and extrapolates per-frame
 annotations with per-frame video labels. The resulting annotations are stored in
 ../Charades/Charades_per-frame_annotations_{train/test}.csv
+
+It also writes ../Charades/Charades_intervals_fps{FINAL_FPS}_{train/test}.csv, one row per
+video with its frame directory, frame count, action intervals and script. The Charades
+datasets read it directly (see src/datasets/annotation_index.py), for both tasks.
+
+Frame directories are listed and labeled by a process pool, labels come from numpy
+interval arithmetic, and the CSVs are written chunk by chunk, so memory does not grow
+with the number of videos:
+
+    python charades_convert_anns.py --num_procs 16 --chunk_size 500
 """
 
 PATH_TO_CHARADES_ROOT = "./data/raw/Charades/"
@@ -22,7 +35,6 @@ DUMMY_2 = -1  # placeholder for frame_id, unused in the implementation
 
 FRAME_SAMPLING_RATE = 16 # out of FRAME_SAMPLING_RATE frames, keep 1 frame
 FINAL_FPS = np.round(FPS / FRAME_SAMPLING_RATE, 3)
-print('Target FPS after sampling:',FINAL_FPS )
 
 SAMPLES = None # Sampling some videos for demo training
 
@@ -30,22 +42,27 @@ SAMPLES = None # Sampling some videos for demo training
 # Save to: .../Charades/Charades_v1_classes_new_map.csv
 ACTION_TXT = f'{PATH_TO_CHARADES_ROOT}/Charades_v1_classes.txt'
 
-action_ids = []
-actions = []
-for row in open(ACTION_TXT):
-    row = row.split(' ')
-    action_ids.append(row[0])
-    actions.append(' '.join(row[1:]).strip())
-    # break
+FRAME_COLUMNS = ['original_vido_id', 'video_id', 'frame_id', 'path']
+INTERVAL_COLUMNS = ['id', 'frame_dir', 'num_frames', 'fps', 'sampling_rate', 'actions', 'script']
 
-action_df = pd.DataFrame({'action_id': action_ids, 'action': actions})
-action_df['label'] = np.arange(len(action_df))
-action_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_v1_classes_new_map.csv', index=False)
+parser = argparse.ArgumentParser(description="Convert the Charades annotations")
+parser.add_argument("--num_procs", type=int, default=os.cpu_count())
+parser.add_argument("--chunk_size", type=int, default=500, help="Videos per written chunk")
 
 
+def create_action_map():
+    """Returns the action code -> integer label dict, after saving the map"""
+    action_ids = []
+    actions = []
+    for row in open(ACTION_TXT):
+        row = row.split(' ')
+        action_ids.append(row[0])
+        actions.append(' '.join(row[1:]).strip())
 
-# Create supporting dict to convert action codes to integer labels
-ACTION_ID_TO_LABEL = action_df.set_index('action_id')['label'].to_dict()
+    action_df = pd.DataFrame({'action_id': action_ids, 'action': actions})
+    action_df['label'] = np.arange(len(action_df))
+    action_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_v1_classes_new_map.csv', index=False)
+    return action_df.set_index('action_id')['label'].to_dict()
 
 
 def get_video_ids(path_to_frame_data):
@@ -55,118 +72,109 @@ def get_video_ids(path_to_frame_data):
             if os.path.isdir(os.path.join(path_to_frame_data, d))]
 
 def get_frame_ids(vid_id, path_to_frame_data):
-    """Returns frame ids from a video of the per-frame rgb data in a list, 
+    """Returns the sorted frame ids from a video of the per-frame rgb data in a list,
             given the path to the data and a video id"""
     video_path = os.path.join(path_to_frame_data, vid_id)
-    return [os.path.splitext(f)[0] for f in os.listdir(video_path)
-            if os.path.isfile(os.path.join(video_path, f))]
-
-def get_labels(str_labels):
-    '''Convert a sequence of (start time, end time, action id) to a sequence of integer labels,
-        mapping by frame id'''
-    label_dicts = defaultdict(list[int])
-
-    if pd.isnull(str_labels):
-        return label_dicts
-
-    for item in str_labels.split(';'):
-        action_id, start_time, end_time = item.split(' ')
-        action_int = ACTION_ID_TO_LABEL[action_id]
-        start_frame = int(float(start_time) * FPS)
-        end_frame = int(float(end_time) * FPS)
-        for fid in range(start_frame, end_frame+1):
-            label_dicts[fid].append(str(action_int))
-
-    return label_dicts
-
-def create_frame_anns(vid_anns, path_to_frame_data):
-    """Returns annotations with the desired frame paths,
-            given the path to the data and the full video ids"""
-    frm_cls_anns = []
-    frm_cap_anns = []
-    for vid_count, anns_row in tqdm(vid_anns.iterrows(), total=len(vid_anns)):
-        vid_id = anns_row['id']
-        frm_ids = get_frame_ids(vid_id, path_to_frame_data)
-        cls_labels = get_labels(anns_row['actions'])
-        caption = anns_row['script']
-
-        for _id, frm_id in enumerate(frm_ids):
-            if _id % FRAME_SAMPLING_RATE != 0:
-                continue
-            # print(_id)
-            frm_path = os.path.join(path_to_frame_data, vid_id, f"{frm_id}.jpg")
-            joined_cls_labels = ",".join(cls_labels[_id])
-            frm_cls_anns.append((vid_id, DUMMY_1, DUMMY_2, frm_path, joined_cls_labels))
-            frm_cap_anns.append((vid_id, DUMMY_1, DUMMY_2, frm_path, caption))
-
-        if SAMPLES:
-            if vid_count > SAMPLES:
-                break
-    return frm_cls_anns, frm_cap_anns
-
-"""
-The following commented lines are strictly intended for demonstration purposes.
-
-
-# Example for action mapping
-print("\nA few mappings from the action to ID supporting dict:")
-print(dict(list(ACTION_ID_TO_LABEL.items())[:5]))
-
-
-print("\nA few action class mappings to integer labels:")
-print(action_df.head())
-
-# Example load and print of video anns
-print("\nFirst few lines of the video annotations:")
-print(video_anns.head())
-
-print("\n A few actions in label format:")
-for i in range(5):
-    out = get_label(video_anns.head()['actions'].iloc[i])
-    print(out if out!="" else "(No action class label found)")
-
-
-# Example crawl of video ids and print
-video_ids = get_video_ids(PATH_TO_FRAME_DATA)
-print("\nA few video ids:")
-print(video_ids[:10])
-
-
-# Example crawl of frame paths and print
-print("\nA few frame ids for a few videos:")
-for video_id in video_ids[:5]:
-    frame_ids = get_frame_ids(video_id, PATH_TO_FRAME_DATA)
-    print(f"Video ID: {video_id}, Frame IDs: {frame_ids[:5]}")
-
-
-# Example per-frame path and annotation creation
-demo_frame_anns = create_frame_anns(video_anns, video_ids[:5], PATH_TO_FRAME_DATA)
-print("\nA few per-frame annotations from head and tail:")
-for annotation in demo_frame_anns[:3]:
-    print(annotation)
-for annotation in demo_frame_anns[-3:]:
-    print(annotation)
-"""
-
-for phase in ['train', 'test']:
+    with os.scandir(video_path) as entries:
+        return sorted(os.path.splitext(e.name)[0] for e in entries if e.is_file())
+
+_ACTION_ID_TO_LABEL = {}
+
+def init_worker(action_id_to_label):
+    _ACTION_ID_TO_LABEL.update(action_id_to_label)
+
+def parse_intervals(str_labels):
+    '''Convert "action_id start end;..." to integer labels, start / end times and the
+        "label start end;..." string of the interval annotations'''
+    if pd.isnull(str_labels) or not str_labels:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), ""
+    items = [item.split(' ') for item in str_labels.split(';')]
+    labels = np.array([_ACTION_ID_TO_LABEL[action_id] for action_id, _, _ in items], dtype=np.int64)
+    times = np.array([[float(start), float(end)] for _, start, end in items]).reshape(-1, 2)
+    intervals = ";".join(f"{label} {start} {end}" for label, (_, start, end) in zip(labels, items))
+    return labels, times[:, 0], times[:, 1], intervals
+
+def get_labels(labels, start_times, end_times, frame_indices):
+    '''Labels of every frame index, in action order: frame f has action a if
+        int(start * FPS) <= f <= int(end * FPS). Returns comma joined strings.'''
+    start_frames = (start_times * FPS).astype(np.int64)
+    end_frames = (end_times * FPS).astype(np.int64)
+    covered = (start_frames <= frame_indices[:, None]) & (frame_indices[:, None] <= end_frames)  # (frames, actions)
+    str_labels = labels.astype(str)
+    return [",".join(str_labels[row]) for row in covered]
+
+def convert_video(job):
+    """Per-frame classification / captioning rows and the interval row of one video"""
+    vid_id, str_labels, caption = job
+    frm_ids = get_frame_ids(vid_id, PATH_TO_FRAME_DATA)
+    labels, start_times, end_times, intervals = parse_intervals(str_labels)
+
+    kept = np.arange(0, len(frm_ids), FRAME_SAMPLING_RATE)
+    frame_labels = get_labels(labels, start_times, end_times, kept)
+    frm_paths = [os.path.join(PATH_TO_FRAME_DATA, vid_id, f"{frm_ids[i]}.jpg") for i in kept]
+    cls_rows = [(vid_id, DUMMY_1, DUMMY_2, path, joined) for path, joined in zip(frm_paths, frame_labels)]
+    cap_rows = [(vid_id, DUMMY_1, DUMMY_2, path, caption) for path in frm_paths]
+    interval_row = (vid_id, os.path.join(PATH_TO_FRAME_DATA, vid_id), len(frm_ids), FPS,
+                    FRAME_SAMPLING_RATE, intervals, caption)
+    return cls_rows, cap_rows, interval_row
+
+class ChunkedCsvWriter:
+    """Appends DataFrame chunks to a CSV, written to a temporary file and moved in place on close"""
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.tmp_path = f"{path}.tmp{os.getpid()}"
+        self.header = True
+        open(self.tmp_path, "w").close()
+
+    def write(self, rows):
+        pd.DataFrame(rows, columns=self.columns).to_csv(self.tmp_path, sep=' ', index=False,
+                                                        header=self.header, mode='a')
+        self.header = False
+
+    def close(self):
+        os.replace(self.tmp_path, self.path)
+
+def convert_phase(phase, action_id_to_label, num_procs, chunk_size):
     # Get video annotations
     video_anns = pd.read_csv(f"{PATH_TO_CHARADES_ROOT}/Charades_v1_{phase}.csv")
-
-    # Finally, it's time to create the true dataframe we will use.
-    print("Creating per-frame annotations (this may take a while)...")
-    frame_cls_anns, frame_cap_anns = create_frame_anns(video_anns, PATH_TO_FRAME_DATA)
-
-    print("Converting to dataframe...")
-    frame_cls_anns_df = pd.DataFrame(frame_cls_anns, columns=['original_vido_id', 'video_id',
-                                                    'frame_id', 'path', 'labels'])
-
-    frame_cap_anns_df = pd.DataFrame(frame_cap_anns, columns=['original_vido_id', 'video_id',
-                                                    'frame_id', 'path', 'caption'])
-
-    print("Saving annotations to csv...")
-    if not SAMPLES:
-        frame_cls_anns_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_action_cls_{phase}.csv', sep=' ', index=False)
-        frame_cap_anns_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_captioning_{phase}.csv', sep=' ', index=False)
-    else:
-        frame_cls_anns_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_action_cls_{phase}_samples.csv', sep=' ', index=False)
-        frame_cap_anns_df.to_csv(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_captioning_{phase}_samples.csv', sep=' ', index=False)
\ No newline at end of file
+    if SAMPLES:
+        video_anns = video_anns.head(SAMPLES)
+    suffix = "" if not SAMPLES else "_samples"
+    writers = [
+        ChunkedCsvWriter(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_action_cls_{phase}{suffix}.csv',
+                         FRAME_COLUMNS + ['labels']),
+        ChunkedCsvWriter(f'{PATH_TO_CHARADES_ROOT}/Charades_per-frame_annotations_fps{FINAL_FPS}_captioning_{phase}{suffix}.csv',
+                         FRAME_COLUMNS + ['caption']),
+        ChunkedCsvWriter(f'{PATH_TO_CHARADES_ROOT}/Charades_intervals_fps{FINAL_FPS}_{phase}{suffix}.csv',
+                         INTERVAL_COLUMNS),
+    ]
+    jobs = ((row.id, row.actions, row.script) for row in video_anns.itertuples())
+
+    start = time.perf_counter()
+    chunk = [[], [], []]
+    with Pool(num_procs, initializer=init_worker, initargs=(action_id_to_label,)) as pool:
+        for vid_count, (cls_rows, cap_rows, interval_row) in enumerate(
+                tqdm(pool.imap(convert_video, jobs, chunksize=16), total=len(video_anns)), 1):
+            chunk[0].extend(cls_rows)
+            chunk[1].extend(cap_rows)
+            chunk[2].append(interval_row)
+            if vid_count % chunk_size == 0 or vid_count == len(video_anns):
+                for writer, rows in zip(writers, chunk):
+                    writer.write(rows)
+                chunk = [[], [], []]
+    for writer in writers:
+        writer.close()
+    seconds = time.perf_counter() - start
+    print(f"{phase}: {len(video_anns)} videos in {seconds:.1f}s "
+          f"({1000 * seconds / max(len(video_anns), 1):.1f}s per 1000 videos)")
+
+def main(args):
+    print('Target FPS after sampling:', FINAL_FPS)
+    # Create supporting dict to convert action codes to integer labels
+    action_id_to_label = create_action_map()
+    for phase in ['train', 'test']:
+        convert_phase(phase, action_id_to_label, args.num_procs, args.chunk_size)
+
+if __name__ == '__main__':
+    main(parser.parse_args())
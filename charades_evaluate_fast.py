@@ -8,7 +8,8 @@ from fvcore.common.config import CfgNode
 from tqdm.auto import tqdm
 
 from src.models.captioning_model import VideoCaptioningModel
-from src.datasets import create_dataset, captioning_collate_fn
+from src.datasets import create_dataset, captioning_collate_fn, FeatureStoreDataset
+from src.datasets.encoding_manifest import get_config_encoding_dir
 from src.utils.general import set_deterministic
 from torchmetrics.functional.text import bleu_score, rouge_score
 
@@ -61,25 +62,22 @@ for WEIGHT in WEIGHTS:
     tokenizer = lit_module.head.tokenizer
 
     class CaptioningDataset(Dataset):
-        def __init__(self, train: bool, mean: torch.tensor, std: torch.tensor, frame_skip: int = 8):
+        def __init__(self, encoding_dir: str, train: bool, mean: torch.tensor, std: torch.tensor, frame_skip: int = 8):
             super().__init__()
             self.mean = torch.tensor(mean)
             self.std = torch.tensor(std)
             self.frame_skip = frame_skip
-            if train:
-                self.x = sorted(glob("data/encodings/inp_64_int/train_x_*.pt"))
-                self.y = sorted(glob("data/encodings/inp_64_int/train_y_*.pt"))
-            else:
-                self.x = sorted(glob("data/encodings/inp_64_int/val_x_*.pt"))
-                self.y = sorted(glob("data/encodings/inp_64_int/val_y_*.pt"))
+            self.data = FeatureStoreDataset(encoding_dir, "train" if train else "val",
+                                            y_fields=["input_ids", "attention_mask"])
             
         def __len__(self):
-            return len(self.x)
+            return len(self.data)
 
         def __getitem__(self, ind):
-            return ((torch.load(self.x[ind])[::self.frame_skip].permute(0,2,3,1)/255 - self.mean)/self.std).permute(0,3,1,2), torch.load(self.y[ind])
+            x, y = self.data[ind]
+            return ((x[::self.frame_skip].permute(0,2,3,1)/255 - self.mean)/self.std).permute(0,3,1,2), y
 
-    val_dataset = CaptioningDataset(False, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
+    val_dataset = CaptioningDataset(get_config_encoding_dir(config), False, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
 
     batch_size = 1
     num_workers = 16
@@ -0,0 +1,118 @@
+"""
+Check that `GenerativeHead.beam_search` (batched beams, cached self-attention keys / values,
+cross-attention keys / values projected once by `CrossAttentionCache`) still finds the same
+captions as the original beam-by-beam search, which runs the whole sequence through the
+language model for every beam at every step:
+
+    python check_beam_search_parity.py --num_models 30
+
+The language models are small random GPT-2s with cross-attention, no weights are
+downloaded. The vocabularies are small and the "stop" token is boosted on some models, so
+beams finish at different steps. Exits with an error if any caption differs.
+"""
+import time
+import argparse
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from src.models.heads.generative_head import GenerativeHead
+
+parser = argparse.ArgumentParser(description="Compare the beam search with the beam-by-beam reference")
+parser.add_argument("--num_models", type=int, default=30, help="Random language models to compare on")
+parser.add_argument("--vocab_sizes", type=int, nargs="+", default=[12, 40, 300])
+parser.add_argument("--searches", default="1:20,3:40,5:30", help="beam_size:max_len pairs, comma separated")
+parser.add_argument("--encoder_tokens", type=int, default=7)
+parser.add_argument("--initializer_range", type=float, default=0.2,
+                    help="Weight init std, GPT-2's 0.02 attends almost uniformly and hides cache mix-ups")
+
+class IdTokenizer:
+    """Token 0 is the start and "stop" token, captions decode to their other token ids."""
+    bos_token_id = eos_token_id = 0
+
+    def decode(self, ids, skip_special_tokens=True) -> Tuple[int, ...]:
+        return tuple(int(i) for i in ids if int(i) != self.eos_token_id)
+
+@torch.no_grad()
+def reference_beam_search(head: GenerativeHead, encoder_hidden_states: torch.Tensor, max_len: int,
+                          beam_size: int):
+    """The beam search before batching: every beam runs its whole sequence, one at a time."""
+    input_ids = [torch.tensor([head.tokenizer.bos_token_id], device=head.device)]
+    beam_logprobs: Optional[List[float]] = None
+
+    def _get_beam_outputs(_input_ids: torch.Tensor) -> Tuple[List[torch.Tensor], torch.Tensor]:
+        outputs = head.language_model(input_ids=_input_ids.unsqueeze(0),
+                                      encoder_hidden_states=encoder_hidden_states)
+        logprobs = F.log_softmax(outputs.logits[0, -1], dim=-1)
+        topk_logprobs = logprobs.topk(k=beam_size)
+        output_ids = [torch.cat([_input_ids, idx.reshape(-1)], dim=0) for idx in topk_logprobs.indices]
+        return output_ids, topk_logprobs.values
+
+    for _ in range(max_len - 1):
+        output_ids: List[torch.Tensor] = []
+        logprobs: List[float] = []
+        beams_done: List[bool] = []
+        for beam_idx, ids in enumerate(input_ids):
+            if beam_logprobs and ids[-1].item() == head.tokenizer.eos_token_id:
+                output_ids.append(ids)
+                logprobs.append(beam_logprobs[beam_idx])
+                beams_done.append(True)
+                continue
+            _output_ids, _logprobs = _get_beam_outputs(ids)
+            if beam_logprobs is not None:
+                _logprobs += beam_logprobs[beam_idx]
+            output_ids += _output_ids
+            logprobs += _logprobs.tolist()
+            beams_done.append(False)
+        if all(beams_done):
+            break
+        indices = torch.tensor(logprobs).topk(k=beam_size).indices
+        input_ids = [output_ids[idx] for idx in indices]
+        beam_logprobs = [logprobs[idx] for idx in indices]
+
+    best_beam_idx: int = torch.tensor(beam_logprobs).argmax().item()  # type: ignore
+    return head.tokenizer.decode(input_ids[best_beam_idx], skip_special_tokens=True)
+
+def make_head(seed: int, vocab_size: int, initializer_range: float) -> GenerativeHead:
+    """A `GenerativeHead` around a random GPT-2, without loading the configured one."""
+    torch.manual_seed(seed)
+    lm_config = GPT2Config(vocab_size=vocab_size, n_embd=64, n_layer=2, n_head=4, n_positions=256,
+                           initializer_range=initializer_range, add_cross_attention=True)
+    language_model = GPT2LMHeadModel(lm_config).eval()
+    with torch.no_grad():  # the "stop" token more likely on some models
+        language_model.lm_head.weight[IdTokenizer.eos_token_id] *= 1 + seed % 4
+    head = GenerativeHead.__new__(GenerativeHead)
+    torch.nn.Module.__init__(head)
+    head.language_model = language_model
+    head.tokenizer = IdTokenizer()
+    head.device = torch.device("cpu")
+    return head
+
+def main(args):
+    searches = [tuple(int(value) for value in search.split(":")) for search in args.searches.split(",")]
+    total, mismatches, reference_seconds, seconds = 0, [], 0.0, 0.0
+    for seed in range(args.num_models):
+        head = make_head(seed, args.vocab_sizes[seed % len(args.vocab_sizes)], args.initializer_range)
+        encoder_hidden_states = torch.randn(1, args.encoder_tokens, head.language_model.config.n_embd)
+        for beam_size, max_len in searches:
+            start = time.perf_counter()
+            expected = reference_beam_search(head, encoder_hidden_states, max_len, beam_size)
+            reference_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            caption = head.beam_search(encoder_hidden_states, max_len, beam_size)
+            seconds += time.perf_counter() - start
+            total += 1
+            if caption != expected:
+                mismatches.append((seed, beam_size, max_len, expected, caption))
+
+    print(f"{total - len(mismatches)}/{total} captions identical, "
+          f"reference {reference_seconds:.2f}s, beam_search {seconds:.2f}s")
+    for seed, beam_size, max_len, expected, caption in mismatches:
+        print(f"model {seed} {beam_size=} {max_len=}: expected {expected}, got {caption}")
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} of {total} captions differ")
+
+if __name__ == '__main__':
+    main(parser.parse_args())
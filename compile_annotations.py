@@ -0,0 +1,34 @@
+"""
+Compile the Charades per-frame annotation CSVs of a config into binary indexes
+(see src/datasets/annotation_index.py):
+
+    python compile_annotations.py --config src/config/cls_svt_charades_s224_f8_exp0.yaml
+
+The datasets compile a missing or outdated index on first use as well, running this
+once up front keeps it out of the first training run.
+"""
+import os
+import time
+import argparse
+
+from fvcore.common.config import CfgNode
+
+from src.datasets.annotation_index import compile_annotation_index, index_dir_for
+
+parser = argparse.ArgumentParser(description="Compile Charades annotation indexes")
+parser.add_argument("-c", "--config", help="The config file, its TRAIN_CSV and TEST_CSV are compiled",
+                        default="src/config/cls_svt_charades_s224_f8_exp0.yaml")
+
+def main(args):
+    config = CfgNode(CfgNode.load_yaml_with_base(args.config))
+    index_root = config.DATA.get("ANNOTATION_INDEX_DIR", None)
+    if index_root:
+        os.makedirs(index_root, exist_ok=True)
+    for csv_name in [config.DATA.TRAIN_CSV, config.DATA.TEST_CSV]:
+        csv_path = os.path.join(config.DATA.ROOT_PATH, csv_name)
+        start = time.perf_counter()
+        index_dir = compile_annotation_index(csv_path, index_dir_for(csv_path, index_root))
+        print(f"{csv_path} -> {index_dir} ({time.perf_counter() - start:.1f}s)")
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -1,122 +1,404 @@
 import os
+import sys
+import socket
+import uuid
 import argparse
+import subprocess
+import threading
+from collections import Counter, defaultdict
 
 import torch
 from torch.utils.data import DataLoader
 from fvcore.common.config import CfgNode
 from tqdm import tqdm
 from src.models import create_model
-from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn
+from src.models.encoders import get_pretrained_path, get_token_pooling_recipe
+from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn, FeatureStore, FeatureStoreWriter
+from src.datasets.feature_store import clip_key, index_path, STORAGE_DTYPES
+from src.datasets.caption_tokens import get_max_tokens
+from src.datasets.label_stats import LabelStats, retain_label_stats, METADATA_KEY as LABEL_STATS_KEY
+from src.datasets.encoding_manifest import (EncodingManifest, encoder_signature, get_encoding_dir,
+                                            get_video_sources, restrict_to_videos)
 from src.utils.general import set_deterministic
+from src.utils.work_queue import FileWorkQueue
+from src.utils.async_writer import AsyncWriter, StageTimer
 
 parser = argparse.ArgumentParser(description="Train a video model")
-parser.add_argument("-c", "--config", help="The config file", 
+parser.add_argument("-c", "--config", help="The config file",
                         default="src/config/cls_svt_ucf101_s224_f8_exp0.yaml")
+parser.add_argument("--videos_per_unit", type=int, default=256,
+                        help="Videos encoded between two manifest checkpoints, a crash loses at most one unit")
+parser.add_argument("--queue", choices=["plan", "work", "merge"], default=None,
+                        help="Parallel encoding: 'plan' splits pending videos into work units, 'work' "
+                             "encodes units until none are left (run as many as you like, on any host "
+                             "sharing the filesystem), 'merge' folds the finished units into the store")
+parser.add_argument("--queue_dir", default=None, help="Work queue directory, default: <store>/queue")
+parser.add_argument("--num_procs", type=int, default=1,
+                        help="With --queue work: number of worker processes to start on this host, "
+                             "each pinned to its own slice of the available cores")
+parser.add_argument("--cpus", default=None, help="Comma separated cores to pin this process to")
+parser.add_argument("--device", default=None, help="Device to run the encoder on, default: cuda if available")
+parser.add_argument("--dtype", choices=STORAGE_DTYPES, default=None,
+                        help="Storage dtype of the features, int8 is quantized per channel. "
+                             "Default: DATA.ENCODING_DTYPE or float32")
+parser.add_argument("--writer_threads", type=int, default=2,
+                        help="Threads that copy encoded batches off the device and write them to the store")
+parser.add_argument("--max_pending", type=int, default=8,
+                        help="Encoded batches waiting for a writer thread before the encoder blocks")
 
 args = parser.parse_args()
-BATCH_SIZE = 16 # How many clip's encoding should be saved in a pth file
+BATCH_SIZE = 16 # How many clips are encoded per forward pass, the store itself is per-clip
 def get_collate_fn(config: CfgNode):
     if config.MODEL.TYPE == 'classification':
         return classification_collate_fn(config)
     elif config.MODEL.TYPE == 'captioning':
-        return captioning_collate_fn(config)
+        # fixed width, the stored label fields of all clips have the same shape
+        return captioning_collate_fn(config, pad_to=get_max_tokens(config))
     else:
         raise ValueError("Invalid model type")
 
-def create_encodings():
+def get_keyed_collate_fn(config: CfgNode):
+    """Same batches as `get_collate_fn`, plus the (video_index, clip_index) of every clip."""
+    collate_fn = get_collate_fn(config)
+    def inner_collate_fn(examples):
+        X, y = collate_fn(examples)
+        return X, y, [(example["video_index"], example["clip_index"]) for example in examples]
+    return inner_collate_fn
 
-    # Load config
-    config = CfgNode.load_yaml_with_base(args.config)
-    config = CfgNode(config)
+def get_storage_dtype(config: CfgNode) -> str:
+    return args.dtype or config.DATA.get("ENCODING_DTYPE", "float32")
 
-    # make reproducible
-    set_deterministic(config.SEED)
+def get_store_metadata(config: CfgNode) -> dict:
+    """Recorded in the store index, so readers know how the features were made."""
+    if config.MODEL.TYPE == "classification":
+        return {"token_pooling": get_token_pooling_recipe(config)}
+    return {}  # captioning stores the raw frames
 
-    # create dataset
-    dataset = create_dataset(config)
-    train_dataset = dataset.get_train_dataset()
-    val_dataset = dataset.get_val_dataset()
+def get_num_classes(config: CfgNode):
+    """Classes to collect label stats for, None when the labels aren't class labels."""
+    if config.MODEL.TYPE == "classification":
+        return config.MODEL.HEAD.NUM_CLASSES
+    return None
+
+def record_ready_event(device: str):
+    """Event the writer threads wait on before reading tensors copied with non_blocking=True."""
+    if torch.device(device).type != "cuda":
+        return None
+    ready = torch.cuda.Event()
+    ready.record()
+    return ready
 
-    # create dataloaders
+def create_encoder_pipeline(config: CfgNode, device: str):
+    """Returns `make_loader(dataset)` and `encode_batch(X, y)`, which turns a batch into
+    the list of per-clip samples to store and an event (or None) that is set once their
+    tensors are on the host."""
     if config.MODEL.TYPE == "classification":
         num_workers = config.DATA.NUM_WORKERS
-        collate_fn = get_collate_fn(config)
-        train_loader = DataLoader(train_dataset,batch_size=BATCH_SIZE,
+        collate_fn = get_keyed_collate_fn(config)
+        make_loader = lambda ds: DataLoader(ds,batch_size=BATCH_SIZE,
                                     shuffle=False,pin_memory=True,num_workers=num_workers,collate_fn=collate_fn,prefetch_factor=4)
-        valid_loader = DataLoader(val_dataset,batch_size=BATCH_SIZE,
-                                    num_workers=num_workers,
-                                    pin_memory=True,
-                                    shuffle=False,
-                                    collate_fn=collate_fn,prefetch_factor=4)
         # crete model
         lit_module = create_model(config)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
         lit_module = lit_module.to(device).eval()
 
-        # callbacks
-        output_dir = config.DATA.ENCODING_DIR
-        if os.path.exists(output_dir):
-            raise IOError('Warning: {output_dir} already exists. Please remove it if you want to continue')
-        os.makedirs(output_dir, exist_ok=True)
-        print(f'Creating the video encoded features at {output_dir}...')
-
-        with torch.no_grad():
-            for i, (X, y) in tqdm(enumerate(train_loader)):
-                X = X.to(device)
-                enc = lit_module.encoder(X)
-                torch.save(enc.cpu().detach(), os.path.join(output_dir, f"train_x_{i}.pt"))
-                torch.save(y, os.path.join(output_dir, f"train_y_{i}.pt"))
-
-        with torch.no_grad():
-            for i, (X, y) in tqdm(enumerate(valid_loader)):
-                X = X.to(device)
-                enc = lit_module.encoder(X)
-                torch.save(enc.cpu().detach(), os.path.join(output_dir, f"val_x_{i}.pt"))
-                torch.save(y, os.path.join(output_dir, f"val_y_{i}.pt"))
+        def encode_batch(X, y):
+            enc = lit_module.encoder(lit_module.prepare_input(X.to(device, non_blocking=True)))
+            # queued behind the forward into pinned memory, the next batch doesn't wait for it
+            enc = enc.to("cpu", non_blocking=True)
+            return [{"x": enc[j], "y": y[j]} for j in range(len(enc))], record_ready_event(device)
 
     elif config.MODEL.TYPE == "captioning":
         batch_size = 1
         num_workers = config.DATA.NUM_WORKERS
-        collate_fn = get_collate_fn(config)
-        train_loader = DataLoader(train_dataset,batch_size=batch_size,
+        collate_fn = get_keyed_collate_fn(config)
+        make_loader = lambda ds: DataLoader(ds,batch_size=batch_size,
                                     shuffle=False,
                                     # pin_memory=True,
                                     num_workers=num_workers,
                                     collate_fn=collate_fn,
                                     prefetch_factor=8)
-        valid_loader = DataLoader(val_dataset,batch_size=batch_size,
-                                    num_workers=num_workers,
-                                    # pin_memory=True,
-                                    shuffle=False,
-                                    collate_fn=collate_fn,
-                                    prefetch_factor=8)
         # crete model
         # lit_module = create_model(config)
         # lit_module = lit_module.to("cuda").eval()
 
-        # callbacks
-        output_dir = os.path.join("data/inp_64_int/")
-        os.makedirs(output_dir, exist_ok=True)
-
-
-        with torch.no_grad():
-            for i, (X, y) in tqdm(enumerate(train_loader)):
-                # X = X.reshape((batch_size * config.DATA.NUM_SAMPLED_FRAMES_MULT, config.DATA.NUM_SAMPLED_FRAMES, *X.shape[2:]))
-                # X = X.to("cuda")
-                # enc = lit_module.encoder(X)
-                # torch.save(enc.cpu().detach().squeeze(), os.path.join(output_dir, f"train_x_{i}.pt"))
-                # torch.save(y, os.path.join(output_dir, f"train_y_{i}.pt"))
-                torch.save(X[0].to(torch.uint8), os.path.join(output_dir, f"train_x_{i}.pt"))
-                torch.save(y, os.path.join(output_dir, f"train_y_{i}.pt"))
-
-            for i, (X, y) in tqdm(enumerate(valid_loader)):
-                # X = X.reshape((batch_size * config.DATA.NUM_SAMPLED_FRAMES_MULT, config.DATA.NUM_SAMPLED_FRAMES, *X.shape[2:]))
-                # X = X.to("cuda")
-                # enc = lit_module.encoder(X)
-                # torch.save(enc.cpu().detach().squeeze(), os.path.join(output_dir, f"val_x_{i}.pt"))
-                # torch.save(y, os.path.join(output_dir, f"val_y_{i}.pt"))
-                torch.save(X[0].to(torch.uint8), os.path.join(output_dir, f"val_x_{i}.pt"))
-                torch.save(y, os.path.join(output_dir, f"val_y_{i}.pt"))
+        def encode_batch(X, y):
+            # X = X.reshape((batch_size * config.DATA.NUM_SAMPLED_FRAMES_MULT, config.DATA.NUM_SAMPLED_FRAMES, *X.shape[2:]))
+            # X = X.to("cuda")
+            # enc = lit_module.encoder(X).cpu().detach().squeeze()
+            # labels keep their (1, MAX_TOKENS) per-clip shape, as the readers expect
+            return [{"x": X[0].to(torch.uint8),
+                     "input_ids": y["input_ids"][:1],
+                     "attention_mask": y["attention_mask"][:1]}], None
+    else:
+        raise ValueError("Invalid model type")
+
+    return make_loader, encode_batch
+
+def encode_unit(dataset, unit, sources, writer, make_loader, encode_batch, desc, timer,
+                label_stats=None) -> Counter:
+    """Encode all clips of the videos `unit` (indices into `sources`), returns clips per video.
+    The labels of the written clips are added to `label_stats`, if given. The caller
+    flushes the writer.
+
+    Loading, the forward pass and writing overlap: batches go through a bounded queue to
+    `args.writer_threads` threads, and the encoder only blocks when `args.max_pending`
+    batches are waiting.
+    """
+    loader = make_loader(restrict_to_videos(dataset, unit))
+    num_clips = Counter()
+    # quantization runs on all writer threads, the batches are appended one at a time and
+    # in submission order, so the store has the same clip order whatever the scheduling
+    turn = threading.Condition()
+    next_batch = [0]
+    failed = [False]
+
+    def write_batch(item):
+        batch_index, samples, keys, ready = item
+        prepared = None
+        try:
+            if ready is not None:
+                with timer.time("transfer"):
+                    ready.synchronize()
+            with timer.time("quantize"):
+                prepared = [writer.prepare(sample) for sample in samples]
+        except BaseException:
+            failed[0] = True
+            raise
+        finally:
+            with turn:
+                # after a failure later batches are dropped, don't wait for them
+                turn.wait_for(lambda: next_batch[0] == batch_index or failed[0])
+                try:
+                    if prepared is not None and not failed[0]:
+                        with timer.time("write"):
+                            for tensors, sample, (video_index, clip_index) in zip(prepared, samples, keys):
+                                writer.write_prepared(tensors, key=clip_key(sources[video_index][0], clip_index))
+                                num_clips[video_index] += 1
+                                if label_stats is not None:  # per clip, so the stats always match the index
+                                    label_stats.update(sample["y"].unsqueeze(0))
+                finally:
+                    next_batch[0] += 1
+                    turn.notify_all()
+
+    with torch.no_grad(), AsyncWriter(write_batch, args.writer_threads, args.max_pending, timer) as async_writer:
+        for batch_index, (X, y, keys) in enumerate(tqdm(timer.iterate("load", loader), desc=desc)):
+            with timer.time("forward"):
+                samples, ready = encode_batch(X, y)
+            async_writer.submit((batch_index, samples, keys, ready))
+    return num_clips
+
+def prepare_split(dataset, split, output_dir, manifest, num_classes):
+    """Drop clips of changed, removed or half-encoded videos from the store, its label
+    stats and the manifest, returns the video sources and the indices of the videos left
+    to encode."""
+    sources = get_video_sources(dataset)
+    done = manifest.up_to_date(split, sources)
+    pending = manifest.pending(split, sources)
+    print(f'{split}: {len(done)} videos already encoded, {len(pending)} to encode')
+
+    with FeatureStoreWriter(output_dir, split, append=True) as writer:
+        if num_classes is not None and writer.samples:
+            stats = retain_label_stats(FeatureStore(output_dir, split), done, num_classes)
+            writer.metadata[LABEL_STATS_KEY] = stats.to_dict()
+        writer.retain_videos(done)
+    manifest.retain(split, done)
+    manifest.set_complete(split, not pending)
+    manifest.save()
+    return sources, pending
+
+def encode_split(dataset, split, output_dir, manifest, make_loader, encode_batch, quantize, metadata,
+                 num_classes):
+    """Encode the videos of one split that are not in the manifest yet.
+
+    Videos are processed in units of `args.videos_per_unit`; after each unit the store
+    index, its label stats and the manifest are written, so an interrupted run resumes
+    from there.
+    """
+    sources, pending = prepare_split(dataset, split, output_dir, manifest, num_classes)
+    timer = StageTimer()
+    with FeatureStoreWriter(output_dir, split, append=True, quantize=quantize) as writer:
+        writer.metadata.update(metadata)
+        label_stats = LabelStats.from_metadata(writer.metadata, num_classes) if num_classes is not None else None
+        for start in range(0, len(pending), args.videos_per_unit):
+            unit = pending[start:start + args.videos_per_unit]
+            try:
+                num_clips = encode_unit(dataset, unit, sources, writer, make_loader, encode_batch,
+                                        desc=f'{split} {start}/{len(pending)}', timer=timer, label_stats=label_stats)
+            finally:
+                # also on errors: the writer flushes the clips written so far when it closes
+                if label_stats is not None:
+                    writer.metadata[LABEL_STATS_KEY] = label_stats.to_dict()
+            writer.flush()
+            for video_index in unit:
+                manifest.mark_done(split, *sources[video_index], num_clips[video_index])
+            manifest.save()
+            print(f'{split} time per stage: {timer.report()}')
+    manifest.set_complete(split, True)
+    manifest.save()
+
+def plan_queue(queue, datasets, output_dir, manifest, num_classes):
+    """Split the pending videos of every split into work units."""
+    if queue.done():
+        raise RuntimeError(f'{queue.root} has finished units that are not merged yet, run --queue merge first')
+    # the videos of unfinished units are still pending in the manifest and planned again below
+    dropped = queue.drop_claimed()
+    if dropped:
+        print(f'Dropped {dropped} units claimed by workers that did not finish, their videos are planned again')
+    for name in os.listdir(queue.todo_dir):
+        os.remove(os.path.join(queue.todo_dir, name))
+
+    for split, dataset in datasets.items():
+        sources, pending = prepare_split(dataset, split, output_dir, manifest, num_classes)
+        for start in range(0, len(pending), args.videos_per_unit):
+            unit = pending[start:start + args.videos_per_unit]
+            queue.put(f'{split}_{start:07d}', {"split": split, "videos": [[i, sources[i][0]] for i in unit]})
+    print(f'Planned {queue.num_todo()} work units in {queue.root}')
+
+def run_worker(queue, datasets, output_dir, make_loader, encode_batch, quantize, metadata, num_classes):
+    """Claim and encode work units until the queue is empty. Every worker writes its own
+    tagged shards and index, `merge_queue` combines them afterwards. The label stats of
+    each unit go into its result, so only merged units are counted."""
+    # unique per run: PIDs repeat after a restart, and a reused tag would truncate the
+    # shards of an earlier worker whose units are not merged yet
+    tag = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    sources = {split: get_video_sources(dataset) for split, dataset in datasets.items()}
+    writers = {}
+    timer = StageTimer()
+    try:
+        while (claimed := queue.claim(tag)) is not None:
+            name, unit = claimed
+            split = unit["split"]
+            for video_index, key in unit["videos"]:
+                if sources[split][video_index][0] != key:
+                    raise RuntimeError(f'Video {video_index} of {split} is {sources[split][video_index][0]}, '
+                                       f'the plan expected {key}. Re-run --queue plan.')
+            if split not in writers:
+                writers[split] = FeatureStoreWriter(output_dir, split, tag=tag, quantize=quantize)
+                writers[split].metadata.update(metadata)
+            video_indices = [video_index for video_index, _ in unit["videos"]]
+            label_stats = LabelStats(num_classes) if num_classes is not None else None
+            num_clips = encode_unit(datasets[split], video_indices, sources[split], writers[split],
+                                    make_loader, encode_batch, desc=f'{tag} {name}', timer=timer,
+                                    label_stats=label_stats)
+            writers[split].flush()
+            result = {"videos": [[*sources[split][i], num_clips[i]] for i in video_indices]}
+            if label_stats is not None:
+                result["label_stats"] = label_stats.to_dict()
+            queue.complete(name, tag, result)
+            print(f'{tag} time per stage: {timer.report()}')
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+def merge_queue(queue, output_dir, manifest):
+    """Fold the finished work units into the main index and manifest."""
+    if queue.num_todo() or queue.num_claimed():
+        print(f'Warning: {queue.num_todo()} units are not started and {queue.num_claimed()} not finished, '
+              'merging the finished ones only')
+    done_units = queue.done()
+    running = queue.claimed_workers()  # they flush their index again, keep it
+    videos = defaultdict(lambda: defaultdict(list))  # split -> worker tag -> [(key, fingerprint, num_clips)]
+    label_stats = defaultdict(list)  # split -> label stats of its units
+    for done in done_units:
+        videos[done["unit"]["split"]][done["worker"]] += done["result"]["videos"]
+        if "label_stats" in done["result"]:
+            label_stats[done["unit"]["split"]].append(LabelStats.from_dict(done["result"]["label_stats"]))
+
+    for split, by_worker in videos.items():
+        with FeatureStoreWriter(output_dir, split, append=True) as writer:
+            for tag, worker_videos in by_worker.items():
+                writer.extend(FeatureStore(output_dir, split, tag=tag),
+                              video_keys={key for key, _, _ in worker_videos})
+                for key, fingerprint, num_clips in worker_videos:
+                    manifest.mark_done(split, key, fingerprint, num_clips)
+            if label_stats[split]:
+                stats = LabelStats.from_metadata(writer.metadata, label_stats[split][0].num_classes)
+                for unit_stats in label_stats[split]:
+                    stats.merge(unit_stats)
+                writer.metadata[LABEL_STATS_KEY] = stats.to_dict()
+        manifest.save()
+        for tag in by_worker:
+            if tag not in running:
+                os.remove(index_path(output_dir, split, tag))
+        print(f'{split}: merged {sum(len(v) for v in by_worker.values())} videos from {len(by_worker)} workers')
+
+    for name in os.listdir(queue.done_dir):
+        os.remove(os.path.join(queue.done_dir, name))
+    if not queue.num_todo() and not queue.num_claimed():
+        for split in manifest.data["splits"]:
+            manifest.set_complete(split, True)
+        manifest.save()
+
+def launch_workers(num_procs: int):
+    """Start `num_procs` queue workers on this host, each pinned to its own slice of cores."""
+    cpus = sorted(os.sched_getaffinity(0))
+    per_proc = max(1, len(cpus) // num_procs)
+    procs = []
+    for i in range(num_procs):
+        cpu_slice = cpus[i * per_proc:(i + 1) * per_proc] or cpus
+        cmd = [sys.executable, os.path.abspath(__file__), "-c", args.config, "--queue", "work",
+               "--videos_per_unit", str(args.videos_per_unit), "--cpus", ",".join(map(str, cpu_slice))]
+        if args.queue_dir:
+            cmd += ["--queue_dir", args.queue_dir]
+        if args.device:
+            cmd += ["--device", args.device]
+        if args.dtype:
+            cmd += ["--dtype", args.dtype]
+        cmd += ["--writer_threads", str(args.writer_threads), "--max_pending", str(args.max_pending)]
+        procs.append(subprocess.Popen(cmd))
+    failed = [p.args for p in procs if p.wait() != 0]
+    if failed:
+        raise RuntimeError(f'{len(failed)} encoding workers failed, re-run --queue plan to re-queue their units')
+
+def create_encodings():
+
+    if args.queue == "work" and args.num_procs > 1:
+        return launch_workers(args.num_procs)
+    if args.cpus:
+        cpus = [int(c) for c in args.cpus.split(",")]
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+
+    # Load config
+    config = CfgNode.load_yaml_with_base(args.config)
+    config = CfgNode(config)
+
+    # make reproducible
+    set_deterministic(config.SEED)
+
+    storage_dtype = get_storage_dtype(config)
+    signature = encoder_signature(config, get_pretrained_path(config), storage_dtype)
+    # captioning stores the sampled frames, train_fast.py and charades_evaluate_fast.py
+    # find them with `get_config_encoding_dir`
+    output_dir = get_encoding_dir(config, signature)
+    os.makedirs(output_dir, exist_ok=True)
+    print(f'Creating the video encoded features at {output_dir}...')
+    manifest = EncodingManifest(output_dir, signature)
+    queue = FileWorkQueue(args.queue_dir or os.path.join(output_dir, "queue")) if args.queue else None
+
+    if args.queue == "merge":
+        return merge_queue(queue, output_dir, manifest)
+
+    # create dataset
+    dataset = create_dataset(config)
+    datasets = {"train": dataset.get_train_dataset(), "val": dataset.get_val_dataset()}
+
+    if args.queue == "plan":
+        return plan_queue(queue, datasets, output_dir, manifest, get_num_classes(config))
+
+    # create dataloaders and model
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    make_loader, encode_batch = create_encoder_pipeline(config, device)
+    quantize = {"x": storage_dtype}
+    metadata = get_store_metadata(config)
+    num_classes = get_num_classes(config)
+
+    if args.queue == "work":
+        return run_worker(queue, datasets, output_dir, make_loader, encode_batch, quantize, metadata, num_classes)
+
+    for split, split_dataset in datasets.items():
+        encode_split(split_dataset, split, output_dir, manifest, make_loader, encode_batch, quantize, metadata,
+                     num_classes)
 
 if __name__ == '__main__':
     create_encodings()
@@ -8,7 +8,7 @@ from fvcore.common.config import CfgNode
 from tqdm.auto import tqdm
 
 from src.models.captioning_model import VideoCaptioningModel
-from src.datasets import create_dataset, captioning_collate_fn
+from src.datasets import create_dataset, captioning_collate_fn, FeatureStoreDataset
 from src.utils.general import set_deterministic
 from torchmetrics.functional.text import bleu_score, rouge_score
 
@@ -45,21 +45,14 @@ lit_module = VideoCaptioningModelHead.load_from_checkpoint(WEIGHT, map_location=
 lit_module = lit_module.to("cuda").eval()
 tokenizer = lit_module.head.tokenizer
 
-class CaptioningDataset(Dataset):
+class CaptioningDataset(FeatureStoreDataset):
     def __init__(self, train: bool):
-        super().__init__()
-        if train:
-            self.x = sorted(glob.glob("data/encodings/train_x_*.pt"))
-            self.y = sorted(glob.glob("data/encodings/train_y_*.pt"))
-        else:
-            self.x = sorted(glob.glob("data/encodings/val_x_*.pt"))
-            self.y = sorted(glob.glob("data/encodings/val_y_*.pt"))
-        
-    def __len__(self):
-        return len(self.x)
+        super().__init__("data/encodings", "train" if train else "val",
+                         y_fields=["input_ids", "attention_mask"])
 
     def __getitem__(self, ind):
-        return torch.load(self.x[ind]).squeeze(), torch.load(self.y[ind])
+        x, y = super().__getitem__(ind)
+        return x.squeeze(), y
 
 val_dataset = CaptioningDataset(False)
 
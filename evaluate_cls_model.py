@@ -9,10 +9,11 @@ import torch
 from torch.utils.data import Dataset
 
 from fvcore.common.config import CfgNode
-from pytorchvideo.data.encoded_video import EncodedVideo
 
 from src.utils.visualizations import investigate_video, display_gif
-from src.datasets.transformations import get_val_transforms
+from src.datasets.transformations import get_val_transforms, get_num_sampled_frames
+from src.datasets.sampled_decoding import SampledEncodedVideo, sliding_window_clips
+from src.datasets.proxy_videos import get_proxy_map
 
 from src.models import create_model
 from src.utils.metrics import compute_multilabel_mAP
@@ -36,6 +37,7 @@ VIDEO_DIRS = f"{DATA_DIR}/videos"
 CSV_PATH = f"{DATA_DIR}/Charades_v1_test.csv"
 ASSET_DIR = "assets"
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+PROXY_MAP = get_proxy_map(config)  # DATA.PROXY_DIR, see make_proxies.py
 STRIDE = 3 # None means to use the stride = clip duration, i.e. no overlap. Else, set to an integer value.
 
 NUM_PROCESSES = min(multiprocessing.cpu_count(), config.DATA.NUM_WORKERS)  # Define the number of tasks you want to run in parallel
@@ -71,22 +73,10 @@ clip_duration = config.DATA.CLIP_DURATION
 num_labels = config.MODEL.HEAD.NUM_CLASSES
 
 def get_clip_tensors(video):
-    """Get all clip (chunk) tensors from a video.
-        Each last for 'clip_duration' seconds."""
-    video_duration = float(video._duration)
-    all_clip_tensors = []
-
-    stride = STRIDE if STRIDE is not None else clip_duration
-
-    for clip_start_sec in np.arange(0, video_duration, stride):
-        clip_end_sec = min(clip_start_sec + clip_duration, video_duration)
-        clip_data = video.get_clip(start_sec=clip_start_sec, end_sec=clip_end_sec)
-        if clip_data['video'] is None:
-            continue
-        clip_data = transform(clip_data)
-        clip_tensor = clip_data['video']  # (C, T, H, W)
-        all_clip_tensors.append(clip_tensor)
-    return all_clip_tensors
+    """Get all clip (chunk) tensors from a video, (B, C, T, H, W).
+        Each last for 'clip_duration' seconds, one every STRIDE seconds.
+        The video is decoded once for all overlapping clips."""
+    return sliding_window_clips(video, clip_duration, STRIDE, transform)
 
 def get_true_label_array(sample):
     '''Get the ground truth label array for a sample.'''
@@ -109,13 +99,16 @@ class InferDataset(Dataset):
     def __getitem__(self, idx):
         sample = self.df.iloc[idx]
         vid_path = f"{VIDEO_DIRS}/{sample['id']}.mp4"
-        video = EncodedVideo.from_path(vid_path, decode_audio=False)
+        if PROXY_MAP is not None:
+            vid_path = PROXY_MAP.resolve(vid_path)
+        # only decodes the frames the transforms keep
+        video = SampledEncodedVideo.from_path(vid_path, get_num_sampled_frames(config))
         ground_truth = get_true_label_array(sample)
 
         # concat clip tensors at the time dimension to write to a gif
-        all_clip_tensors = get_clip_tensors(video)
+        inp_video_tensors = get_clip_tensors(video)  # (B, C, T, H, W)
+        video.close()
         # Prepare video tensor for inference
-        inp_video_tensors = torch.stack(all_clip_tensors, dim=0)  # (B, C, T, H, W)
         inp_video_tensors = inp_video_tensors.permute(0, 2, 1, 3, 4)  # (B, C, T, H, W) -> (B, T, C, H, W)
 
         return inp_video_tensors, ground_truth
@@ -0,0 +1,110 @@
+"""
+Compare head metrics on float32 encodings with the same encodings stored in reduced
+precision (see `create_encoding.py --dtype`). Every val clip of a float32 feature store is
+quantized and dequantized exactly like the store would do it, so all rows are computed
+on the same split with the same trained head.
+
+    python evaluate_encoding_precision.py --config src/config/cls_svt_charades_s224_f8_exp0.yaml --weight <head ckpt>
+"""
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+from fvcore.common.config import CfgNode
+from tqdm.auto import tqdm
+from torchmetrics.functional.text import bleu_score
+
+from src.datasets import FeatureStore
+from src.datasets.feature_store import quantize, dequantize
+from src.datasets.encoding_manifest import encoder_signature, get_encoding_dir
+from src.models.classification_model import VideoClassificationModel
+from src.models.captioning_model import VideoCaptioningModel
+from src.models.encoders import get_pretrained_path
+from src.utils.metrics import compute_multilabel_mAP
+from src.utils.general import set_deterministic
+
+parser = argparse.ArgumentParser(description="Report mAP / BLEU of reduced-precision encodings against float32")
+parser.add_argument("--config", help="The config file",
+                        default="src/config/cls_svt_charades_s224_f8_exp0.yaml")
+parser.add_argument("--weight", help="The path to the trained head weight .ckpt file", required=True)
+parser.add_argument("--encoding_dir", help="float32 feature store, default: the store create_encoding.py "
+                        "makes for the config (classification) or data/encodings (captioning)", default=None)
+parser.add_argument("--dtypes", nargs="+", default=["float16", "bfloat16", "int8"])
+parser.add_argument("--max_samples", type=int, default=None,
+                        help="Only use the first N val clips (beam search for BLEU is slow)")
+parser.add_argument("--batch_size", type=int, default=256)
+
+args = parser.parse_args()
+
+class VideoClassificationModelHead(VideoClassificationModel):
+    def create_encoder(self):
+        return nn.Identity()
+
+class VideoCaptioningModelHead(VideoCaptioningModel):
+    def create_encoder(self):
+        return nn.Identity()
+
+def round_trip(x: torch.Tensor, dtype: str) -> torch.Tensor:
+    if dtype == "float32":
+        return x
+    stored, scale = quantize(x, dtype)
+    return dequantize(stored, scale, x.dtype)
+
+def bytes_per_clip(x: torch.Tensor, dtype: str) -> int:
+    if dtype == "float32":
+        return x.numel() * x.element_size()
+    stored, scale = quantize(x, dtype)
+    return stored.numel() * stored.element_size() + (scale.numel() * scale.element_size() if scale is not None else 0)
+
+def evaluate_classification(lit_module, store, indices, dtype, device):
+    all_probas, all_labels = [], []
+    for start in tqdm(range(0, len(indices), args.batch_size), desc=dtype):
+        batch = indices[start:start + args.batch_size]
+        X = torch.stack([round_trip(store.get_field(i, "x").float(), dtype) for i in batch]).to(device)
+        with torch.no_grad():
+            all_probas.append(lit_module(X).sigmoid().cpu().numpy())
+        all_labels.append(torch.stack([store.get_field(i, "y") for i in batch]).int().numpy())
+    return {"mAP": compute_multilabel_mAP(np.concatenate(all_labels), np.concatenate(all_probas),
+                                          config.MODEL.HEAD.NUM_CLASSES)}
+
+def evaluate_captioning(lit_module, store, indices, dtype, device):
+    tokenizer = lit_module.head.tokenizer
+    true_cap, pred_cap = [], []
+    for i in tqdm(indices, desc=dtype):
+        X = round_trip(store.get_field(i, "x").float(), dtype).squeeze().unsqueeze(0).to(device)
+        pred_cap.append(lit_module.generate(X, max_len=128, beam_size=3))
+        true_cap.append(tokenizer.decode(store.get_field(i, "input_ids").squeeze(), skip_special_tokens=True))
+    return {f"BLEU_{n}": float(bleu_score(pred_cap, true_cap, n)) for n in range(1, 5)}
+
+# Load config
+config = CfgNode.load_yaml_with_base(args.config)
+config = CfgNode(config)
+set_deterministic(config.SEED)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+if config.MODEL.TYPE == "classification":
+    encoding_dir = args.encoding_dir or get_encoding_dir(config, encoder_signature(config, get_pretrained_path(config)))
+    lit_module = VideoClassificationModelHead.load_from_checkpoint(args.weight, map_location=device)
+    evaluate = evaluate_classification
+else:
+    encoding_dir = args.encoding_dir or "data/encodings"
+    lit_module = VideoCaptioningModelHead.load_from_checkpoint(args.weight, map_location=device)
+    evaluate = evaluate_captioning
+lit_module = lit_module.to(device).eval()
+
+store = FeatureStore(encoding_dir, "val")
+if store.fields["x"]["dtype"] != "float32":
+    raise ValueError(f"{encoding_dir} is stored as {store.fields['x']['dtype']}, the reference has to be float32")
+indices = list(range(len(store)))[:args.max_samples]
+
+x0 = store.get_field(0, "x")
+reference = evaluate(lit_module, store, indices, "float32", device)
+rows = [("float32", bytes_per_clip(x0, "float32"), reference)]
+for dtype in args.dtypes:
+    rows.append((dtype, bytes_per_clip(x0, dtype), evaluate(lit_module, store, indices, dtype, device)))
+
+print(f"\n{len(indices)} val clips from {encoding_dir}")
+for dtype, nbytes, metrics in rows:
+    text = "  ".join(f"{k}: {v:.4f} ({v - reference[k]:+.4f})" for k, v in metrics.items())
+    print(f"{dtype:>9} | {nbytes / 1024:9.1f} KiB/clip | {text}")
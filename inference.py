@@ -9,10 +9,10 @@ from fvcore.common.config import CfgNode
 from lightning import Trainer
 from lightning.pytorch.loggers import WandbLogger
 from lightning.pytorch.callbacks import LearningRateMonitor, ModelCheckpoint
-from pytorchvideo.data.encoded_video import EncodedVideo
 
 from src.utils.visualizations import investigate_video, display_gif
-from src.datasets.transformations import get_train_transforms, get_val_transforms
+from src.datasets.transformations import get_train_transforms, get_val_transforms, get_num_sampled_frames
+from src.datasets.sampled_decoding import SampledEncodedVideo, sliding_window_clips
 
 from src.models import create_model
 from src.utils.general import set_deterministic
@@ -60,7 +60,7 @@ lit_module.to(device)
 
 # Load video
 VID_PATH = f"{VIDEO_DIRS}/{sample['id']}.mp4"
-video = EncodedVideo.from_path(VID_PATH)
+video = SampledEncodedVideo.from_path(VID_PATH, get_num_sampled_frames(config))
 
 actions = sample.actions.split(";")
 
@@ -73,28 +73,16 @@ for gt_action in actions:
     current_action = action_id2text[current_action]
     print(f"Ground truth action: {current_action}. Start time: {start_time}. End time: {end_time}")
 
-video_duration = float(video._duration)
-
-all_clip_tensors = []
-
-for clip_start_sec in np.arange(0, video_duration, config.DATA.CLIP_DURATION):
-    clip_duration = config.DATA.CLIP_DURATION
-    clip_end_sec = min(clip_start_sec + clip_duration, video_duration)
-
-    clip_data = video.get_clip(start_sec=clip_start_sec, end_sec=clip_start_sec + clip_duration)
-    clip_data = transform(clip_data)
-    clip_tensor = clip_data['video']  # (C, T, H, W)
-
-    all_clip_tensors.append(clip_tensor)
+# all clips from one decoding pass, (B, C, T, H, W)
+all_clip_tensors = sliding_window_clips(video, config.DATA.CLIP_DURATION, transform=transform)
 
 # concat clip tensors at the time dimension to write to a gif
-whole_video_tensor = torch.cat(all_clip_tensors, dim=1)
+whole_video_tensor = torch.cat(list(all_clip_tensors), dim=1)
 gif_save_path = "assets/charades_test_model.gif"
 display_gif(whole_video_tensor, gif_save_path, config.DATA.MEAN, config.DATA.STD, gif_duration=10)
 
 # Prepare video tensor for inference
-inp_video_tensors = torch.stack(all_clip_tensors, dim=0)  # (B, C, T, H, W)
-inp_video_tensors = inp_video_tensors.permute(0, 2, 1, 3, 4)  # (B, C, T, H, W) -> (B, T, C, H, W)
+inp_video_tensors = all_clip_tensors.permute(0, 2, 1, 3, 4)  # (B, C, T, H, W) -> (B, T, C, H, W)
 
 print()
 with torch.no_grad():
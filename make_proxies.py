@@ -0,0 +1,123 @@
+"""
+Transcode the videos of a dataset into low-resolution proxies (see src/datasets/proxy_videos.py):
+short side 256 (never upscaled), the config's DATA.FPS if it has one, no audio, H.264:
+
+    python make_proxies.py -c src/config/cls_svt_ucf101_s224_f8_exp0.yaml --out_dir data/proxies/ucf101
+    python make_proxies.py -c src/config/cls_svt_charades_s224_f8_exp0.yaml --out_dir data/proxies/charades
+
+Then set DATA.PROXY_DIR to the output directory: UCF101 / HMDB51 training and
+evaluate_cls_model.py (Charades mp4s) read the proxies instead of the originals.
+The videos come from the video manifests of the splits, for Charades from
+<ROOT_PATH>/videos/*.mp4. Re-running only transcodes new or changed videos. Needs the
+ffmpeg binary.
+"""
+import os
+import glob
+import time
+import argparse
+import subprocess
+from multiprocessing import Pool
+
+from fvcore.common.config import CfgNode
+from tqdm import tqdm
+
+from src.datasets.proxy_videos import proxy_key, read_proxy_manifest, write_proxy_manifest
+
+parser = argparse.ArgumentParser(description="Transcode low-resolution proxy videos")
+parser.add_argument("-c", "--config", help="The config file, the videos of its dataset are transcoded",
+                        default="src/config/cls_svt_ucf101_s224_f8_exp0.yaml")
+parser.add_argument("--out_dir", required=True, help="Directory for the proxies (DATA.PROXY_DIR)")
+parser.add_argument("--short_side", type=int, default=256)
+parser.add_argument("--fps", type=float, default=None, help="Defaults to DATA.FPS, the source frame rate if unset")
+parser.add_argument("--crf", type=int, default=20, help="x264 quality, lower is better")
+parser.add_argument("--num_procs", type=int, default=os.cpu_count())
+parser.add_argument("--save_every", type=int, default=200, help="Videos between manifest checkpoints")
+parser.add_argument("--overwrite", action="store_true", default=False)
+
+def get_source_videos(config: CfgNode):
+    """Encoded videos of the dataset of `config`, as proxy manifest keys."""
+    if config.DATA.DATASET.startswith("charades"):
+        return sorted(proxy_key(path) for path in glob.glob(os.path.join(config.DATA.ROOT_PATH, "videos", "*.mp4")))
+    from src.datasets import create_dataset
+    dataset = create_dataset(config)
+    paths = set()
+    for split in ["train", "val", "test"]:
+        manifest = dataset.get_video_manifest(split)
+        if manifest is not None:
+            paths.update(proxy_key(path) for path in manifest.video_paths())
+    return sorted(paths)
+
+def ffmpeg_command(source: str, out_path: str, short_side: int, fps, crf: int):
+    # scale the short side down to short_side, keep the aspect ratio (even sizes for x264)
+    scale = f"scale='if(gt(iw,ih),-2,min(iw,{short_side}))':'if(gt(iw,ih),min(ih,{short_side}),-2)'"
+    video_filter = scale + (f",fps={fps}" if fps else "")
+    return ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source, "-vf", video_filter, "-an",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf), "-pix_fmt", "yuv420p", out_path]
+
+def transcode(job):
+    """Returns the source, its mtime, the sizes before / after, or the error."""
+    source, out_path, short_side, fps, crf = job
+    mtime_ns = os.stat(source).st_mtime_ns
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.tmp{os.getpid()}.mp4"
+    result = subprocess.run(ffmpeg_command(source, tmp_path, short_side, fps, crf), capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return source, None, 0, 0, result.stderr.strip()
+    os.replace(tmp_path, out_path)
+    return source, mtime_ns, os.path.getsize(source), os.path.getsize(out_path), None
+
+def main(args):
+    config = CfgNode(CfgNode.load_yaml_with_base(args.config))
+    fps = args.fps if args.fps is not None else config.DATA.get("FPS", None)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    manifest = read_proxy_manifest(args.out_dir)
+    settings = {"short_side": args.short_side, "fps": fps}
+    if manifest["videos"] and any(manifest[key] != value for key, value in settings.items()):
+        if not args.overwrite:
+            raise ValueError(f"{args.out_dir} holds proxies with {manifest['short_side']=} {manifest['fps']=}, "
+                             "use another --out_dir or --overwrite")
+        manifest["videos"] = {}
+    manifest.update(settings)
+
+    sources = get_source_videos(config)
+    if not sources:
+        raise ValueError(f"No videos found for {config.DATA.DATASET} in {config.DATA.ROOT_PATH}")
+    root = os.path.commonpath([os.path.dirname(path) for path in sources])
+    jobs = []
+    for source in sources:
+        relative = os.path.splitext(os.path.relpath(source, root))[0] + ".mp4"
+        entry = manifest["videos"].get(source)
+        if (not args.overwrite and entry is not None and entry["mtime_ns"] == os.stat(source).st_mtime_ns
+                and os.path.exists(os.path.join(args.out_dir, entry["proxy"]))):
+            continue
+        jobs.append((source, os.path.join(args.out_dir, relative), args.short_side, fps, args.crf))
+    print(f"Transcoding {len(jobs)} of {len(sources)} videos into {args.out_dir} "
+          f"(short side {args.short_side}, fps {fps or 'of the source'})")
+
+    start = time.perf_counter()
+    source_bytes, proxy_bytes, failed = 0, 0, []
+    with Pool(args.num_procs) as pool:
+        results = pool.imap_unordered(transcode, jobs, chunksize=1)
+        for count, (source, mtime_ns, in_size, out_size, error) in enumerate(tqdm(results, total=len(jobs)), 1):
+            if error is not None:
+                failed.append((source, error))
+            else:
+                relative = os.path.splitext(os.path.relpath(source, root))[0] + ".mp4"
+                manifest["videos"][source] = {"proxy": relative, "mtime_ns": mtime_ns}
+                source_bytes += in_size
+                proxy_bytes += out_size
+            if count % args.save_every == 0:  # an interrupted run resumes from here
+                write_proxy_manifest(args.out_dir, manifest)
+    write_proxy_manifest(args.out_dir, manifest)
+
+    seconds = time.perf_counter() - start
+    print(f"{len(jobs) - len(failed)} videos in {seconds:.1f}s: "
+          f"{source_bytes / 2**30:.2f} GiB -> {proxy_bytes / 2**30:.2f} GiB")
+    for source, error in failed:
+        print(f"failed: {source}: {error}")
+
+if __name__ == '__main__':
+    main(parser.parse_args())
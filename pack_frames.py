@@ -0,0 +1,61 @@
+"""
+Pack the Charades frames listed in the train and test annotation CSVs of a config into
+one archive per video (see src/datasets/frame_archive.py):
+
+    python pack_frames.py --config src/config/cls_svt_charades_s224_f8_exp0.yaml --out_dir data/raw/Charades_packed
+
+Then set DATA.FRAME_ARCHIVE_DIR to the output directory. Videos without an archive keep
+being read from their JPEG files. Existing archives are skipped unless --overwrite is given.
+"""
+import os
+import argparse
+from multiprocessing import Pool
+
+from fvcore.common.config import CfgNode
+from tqdm import tqdm
+
+from src.datasets.frame_archive import ARCHIVE_FORMATS, archive_path, pack_frames
+from src.datasets.annotation_index import load_annotation_index
+
+parser = argparse.ArgumentParser(description="Pack per-video frame archives")
+parser.add_argument("-c", "--config", help="The config file, its TRAIN_CSV and TEST_CSV are packed",
+                        default="src/config/cls_svt_charades_s224_f8_exp0.yaml")
+parser.add_argument("--out_dir", required=True, help="Directory for the archives (DATA.FRAME_ARCHIVE_DIR)")
+parser.add_argument("--format", choices=ARCHIVE_FORMATS, default="jpeg",
+                        help="jpeg: original JPEG bytes plus an offset table; raw: decoded uint8 frames "
+                             "(no decoding when reading, ~10x larger)")
+parser.add_argument("--num_procs", type=int, default=os.cpu_count())
+parser.add_argument("--overwrite", action="store_true", default=False)
+
+def read_frame_paths(csv_path: str, index_root: str = None):
+    """Frame paths per video, in the order the Charades datasets read them."""
+    index = load_annotation_index(csv_path, index_root)
+    return [index.frame_paths(i) for i in range(len(index))]
+
+def pack_video(job):
+    frame_paths, out_path, archive_format = job
+    pack_frames(frame_paths, out_path, archive_format)
+    return sum(os.path.getsize(p) for p in frame_paths), os.path.getsize(out_path)
+
+def main(args):
+    config = CfgNode(CfgNode.load_yaml_with_base(args.config))
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    jobs = {}
+    for csv_name in [config.DATA.TRAIN_CSV, config.DATA.TEST_CSV]:
+        csv_path = os.path.join(config.DATA.ROOT_PATH, csv_name)
+        for frame_paths in read_frame_paths(csv_path, config.DATA.get("ANNOTATION_INDEX_DIR", None)):
+            out_path = archive_path(args.out_dir, frame_paths)
+            if args.overwrite or not os.path.exists(out_path):
+                jobs[out_path] = (frame_paths, out_path, args.format)
+    print(f"Packing {len(jobs)} videos into {args.out_dir}")
+
+    frames_bytes, archive_bytes = 0, 0
+    with Pool(args.num_procs) as pool:
+        for in_size, out_size in tqdm(pool.imap_unordered(pack_video, jobs.values(), chunksize=4), total=len(jobs)):
+            frames_bytes += in_size
+            archive_bytes += out_size
+    print(f"{frames_bytes / 2**30:.2f} GiB of frames -> {archive_bytes / 2**30:.2f} GiB of archives")
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -1,2 +1,3 @@
 from ._factory import create_dataset
-from .collate_functions import classification_collate_fn, captioning_collate_fn
\ No newline at end of file
+from .collate_functions import classification_collate_fn, captioning_collate_fn
+from .feature_store import FeatureStore, FeatureStoreWriter, FeatureStoreDataset, InMemoryFeatureBatches
@@ -0,0 +1,325 @@
+"""
+Compiled annotation index of a Charades annotation CSV.
+
+Two kinds of CSVs, both space separated and written by `charades_convert_anns.py`:
+    - per-frame: one row per kept frame, `original_vido_id video_id frame_id path labels|caption`
+    - intervals: one row per video, `id frame_dir num_frames fps sampling_rate actions script`,
+      actions as `label start end;...` in seconds. Serves classification and captioning.
+
+Parsing them builds hundreds of thousands of Python strings and lists, in every
+DataLoader worker. `compile_annotation_index` does it once and writes a directory of
+.npy arrays next to the CSV (or into DATA.ANNOTATION_INDEX_DIR):
+
+    meta.json        csv size / mtime, kind, video names, number of classes
+    path_blob        utf-8 frame paths, back to back        path_offsets   (frames + 1,)
+    video_offsets    (videos + 1,) first frame of every video
+    label_values     frame labels in csv order               label_offsets  (frames + 1,)   [labels]
+    label_bits       (frames, ceil(classes / 8)) uint8 bitsets, bit order little           [labels]
+    caption_blob     utf-8 captions, one per video           caption_offsets (videos + 1,)  [caption, intervals]
+    frame_dir_blob   utf-8 frame directories                 frame_dir_offsets (videos + 1,)  [intervals]
+    sampling_rate    (videos,) one kept frame out of sampling_rate                            [intervals]
+    interval_offsets (videos + 1,) first action of every video                                [intervals]
+    interval_class, interval_first, interval_last   label and first / last kept frame of every action
+
+Interval labels are resolved to kept frames exactly like the per-frame expansion does
+(source frame k is labeled if int(start * fps) <= k <= int(end * fps)), clip labels are
+then an overlap test over the actions of the video.
+
+`CharadesAnnotationIndex` memory-maps the arrays, so loading takes milliseconds and the
+pages are shared by all workers through the page cache. The index is recompiled when the
+CSV changes size or mtime.
+"""
+import os
+import csv
+import json
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from iopath.common.file_io import g_pathmgr
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index"
+ARRAYS = {
+    "labels": ["path_blob", "path_offsets", "video_offsets", "label_values", "label_offsets", "label_bits"],
+    "caption": ["path_blob", "path_offsets", "video_offsets", "caption_blob", "caption_offsets"],
+    "intervals": ["video_offsets", "frame_dir_blob", "frame_dir_offsets", "sampling_rate", "interval_offsets",
+                  "interval_class", "interval_first", "interval_last", "caption_blob", "caption_offsets"],
+}
+# Charades_v1_rgb frame files, numbered from 1
+FRAME_NAME = "{video}-{frame:06d}.jpg"
+
+
+def index_dir_for(csv_path: str, index_root: Optional[str] = None) -> str:
+    """`<csv>.index`, or `<index_root>/<csv name>.index`."""
+    csv_path = str(csv_path)
+    if index_root:
+        return os.path.join(index_root, os.path.basename(csv_path) + INDEX_SUFFIX)
+    return csv_path + INDEX_SUFFIX
+
+
+def _csv_stamp(csv_path: str) -> Dict[str, int]:
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _pack_strings(strings: List[str]):
+    """utf-8 blob and (n + 1,) offsets"""
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets
+
+
+def parse_actions(actions: str) -> List[Tuple[int, float, float]]:
+    """`label start end;...` to (label, start, end) tuples, in order."""
+    if not actions:
+        return []
+    parsed = []
+    for item in actions.split(";"):
+        label, start, end = item.split(" ")
+        parsed.append((int(label), float(start), float(end)))
+    return parsed
+
+
+def build_interval_arrays(rows: List[Dict[str, str]]) -> Dict[str, Any]:
+    num_frames = np.array([int(row["num_frames"]) for row in rows], dtype=np.int64)
+    sampling_rate = np.array([int(row["sampling_rate"]) for row in rows], dtype=np.int32)
+    fps = np.array([float(row["fps"]) for row in rows])
+    actions = [parse_actions(row["actions"]) for row in rows]
+
+    arrays = {"sampling_rate": sampling_rate}
+    arrays["video_offsets"] = np.zeros(len(rows) + 1, dtype=np.int64)
+    arrays["video_offsets"][1:] = np.cumsum(-(-num_frames // sampling_rate))  # kept frames 0, rate, 2 rate, ...
+    arrays["frame_dir_blob"], arrays["frame_dir_offsets"] = _pack_strings([row["frame_dir"] for row in rows])
+    arrays["caption_blob"], arrays["caption_offsets"] = _pack_strings([row["script"] for row in rows])
+    arrays["interval_offsets"] = np.zeros(len(rows) + 1, dtype=np.int64)
+    arrays["interval_offsets"][1:] = np.cumsum([len(a) for a in actions])
+
+    video_of_action = np.repeat(np.arange(len(rows)), [len(a) for a in actions])
+    flat = np.array([a for video_actions in actions for a in video_actions], dtype=np.float64).reshape(-1, 3)
+    rate, video_fps = sampling_rate[video_of_action], fps[video_of_action]
+    # source frames int(start * fps) .. int(end * fps), of which the kept ones are multiples of rate
+    first_source, last_source = (flat[:, 1] * video_fps).astype(np.int64), (flat[:, 2] * video_fps).astype(np.int64)
+    arrays["interval_class"] = flat[:, 0].astype(np.int16)
+    arrays["interval_first"] = (-(-first_source // rate)).astype(np.int32)
+    arrays["interval_last"] = (last_source // rate).astype(np.int32)
+    return arrays
+
+
+def build_annotation_arrays(csv_path: str) -> Dict[str, Any]:
+    """Parse an annotation CSV (per-frame the way pytorchvideo's Charades reader does, or
+    intervals) into arrays. Returns the arrays plus a 'meta' dict."""
+    with g_pathmgr.open(str(csv_path), "r") as f:
+        csv_reader = csv.DictReader(f, delimiter=" ")
+        fieldnames = csv_reader.fieldnames
+        rows = list(csv_reader)
+
+    if "actions" in fieldnames:
+        arrays = build_interval_arrays(rows)
+        num_classes = int(arrays["interval_class"].max(initial=-1)) + 1
+        arrays["meta"] = {
+            "version": INDEX_VERSION,
+            "kind": "intervals",
+            "csv": _csv_stamp(str(csv_path)),
+            "video_names": [row["id"] for row in rows],
+            "num_classes": num_classes,
+        }
+        return arrays
+
+    # Space separated CSV with format: original_vido_id video_id frame_id path labels|caption
+    kind = "labels" if "labels" in fieldnames else "caption"
+    video_frames: Dict[str, List[Dict[str, str]]] = {}
+    for row in rows:
+        assert len(row) == 5
+        video_frames.setdefault(row["original_vido_id"], []).append(row)
+
+    video_names = list(video_frames.keys())
+    rows = [row for name in video_names for row in video_frames[name]]
+    arrays = {}
+    arrays["path_blob"], arrays["path_offsets"] = _pack_strings([row["path"] for row in rows])
+    arrays["video_offsets"] = np.zeros(len(video_names) + 1, dtype=np.int64)
+    arrays["video_offsets"][1:] = np.cumsum([len(video_frames[name]) for name in video_names])
+
+    num_classes = 0
+    if kind == "labels":
+        frame_labels = []
+        for row in rows:
+            labels = row["labels"].replace('"', "")
+            frame_labels.append([int(x) for x in labels.split(",")] if labels else [])
+        label_values = [label for labels in frame_labels for label in labels]
+        num_classes = max(label_values, default=-1) + 1
+        arrays["label_values"] = np.asarray(label_values, dtype=np.int16)
+        arrays["label_offsets"] = np.zeros(len(rows) + 1, dtype=np.int64)
+        arrays["label_offsets"][1:] = np.cumsum([len(labels) for labels in frame_labels])
+        dense = np.zeros((len(rows), num_classes), dtype=bool)
+        frame_of_label = np.repeat(np.arange(len(rows)), np.diff(arrays["label_offsets"]))
+        dense[frame_of_label, arrays["label_values"]] = True
+        arrays["label_bits"] = np.packbits(dense, axis=1, bitorder="little")
+    else:
+        # all rows of a video repeat the same script, keep the first
+        captions = [video_frames[name][0]["caption"] for name in video_names]
+        arrays["caption_blob"], arrays["caption_offsets"] = _pack_strings(captions)
+
+    arrays["meta"] = {
+        "version": INDEX_VERSION,
+        "kind": kind,
+        "csv": _csv_stamp(str(csv_path)),
+        "video_names": video_names,
+        "num_classes": num_classes,
+    }
+    return arrays
+
+
+def compile_annotation_index(csv_path: str, index_dir: Optional[str] = None) -> str:
+    """Write the index of `csv_path` (replacing a stale one) and return its directory."""
+    index_dir = index_dir or index_dir_for(csv_path)
+    arrays = build_annotation_arrays(csv_path)
+    tmp_dir = f"{index_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in ARRAYS[arrays["meta"]["kind"]]:
+        np.save(os.path.join(tmp_dir, name + ".npy"), arrays[name])
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(arrays["meta"], f)
+    _swap_in_directory(tmp_dir, index_dir)
+    return index_dir
+
+
+def _swap_in_directory(tmp_dir: str, target_dir: str):
+    """Move a freshly written `tmp_dir` to `target_dir`. The version it replaces is renamed
+    aside instead of deleted, other processes may be loading it right now; versions set
+    aside by earlier swaps are removed."""
+    parent, name = os.path.split(os.path.abspath(target_dir))
+    for entry in os.listdir(parent):
+        if entry.startswith(f"{name}.old"):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+    try:
+        if os.path.exists(target_dir):
+            os.rename(target_dir, f"{target_dir}.old{os.getpid()}-{time.time_ns()}")
+        os.rename(tmp_dir, target_dir)
+    except OSError:  # another process swapped in its version meanwhile
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _is_current(index_dir: str, csv_path: str) -> bool:
+    try:
+        with open(os.path.join(index_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("version") == INDEX_VERSION and meta["csv"] == _csv_stamp(str(csv_path))
+
+
+class CharadesAnnotationIndex:
+    """Read access to a compiled index, from memory-mapped arrays (`path`) or from
+    in-memory ones (`arrays`, when the index can't be written)."""
+    def __init__(self, path: Optional[str] = None, arrays: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        if arrays is None:
+            with open(os.path.join(path, "meta.json"), "r") as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                      for name in ARRAYS[meta["kind"]]}
+            arrays["meta"] = meta
+        self._arrays = arrays
+        self.meta: Dict[str, Any] = arrays["meta"]
+        self.kind: str = self.meta["kind"]
+        self.video_names: List[str] = self.meta["video_names"]
+        self.num_classes: int = self.meta["num_classes"]
+        for name in ARRAYS[self.kind]:
+            setattr(self, name, arrays[name])
+
+    def __getstate__(self):
+        # workers started with spawn reopen the mmaps instead of receiving copies
+        return {"path": self.path, "arrays": None if self.path else self._arrays}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self) -> int:
+        return len(self.video_names)
+
+    def num_frames(self, video_index: int) -> int:
+        return int(self.video_offsets[video_index + 1] - self.video_offsets[video_index])
+
+    def frame_paths(self, video_index: int, prefix: str = "") -> List[str]:
+        if self.kind == "intervals":
+            start, end = self.frame_dir_offsets[video_index], self.frame_dir_offsets[video_index + 1]
+            frame_dir = os.path.join(prefix, bytes(self.frame_dir_blob[start:end]).decode())
+            rate, video = int(self.sampling_rate[video_index]), self.video_names[video_index]
+            return [os.path.join(frame_dir, FRAME_NAME.format(video=video, frame=j * rate + 1))
+                    for j in range(self.num_frames(video_index))]
+        first, last = self.video_offsets[video_index], self.video_offsets[video_index + 1]
+        offsets = self.path_offsets[first:last + 1]
+        blob = bytes(self.path_blob[offsets[0]:offsets[-1]])
+        ends = (offsets - offsets[0]).tolist()
+        paths = [blob[ends[i]:ends[i + 1]].decode() for i in range(len(ends) - 1)]
+        return [os.path.join(prefix, p) for p in paths] if prefix else paths
+
+    def _intervals(self, video_index: int):
+        start, end = self.interval_offsets[video_index], self.interval_offsets[video_index + 1]
+        return self.interval_class[start:end], self.interval_first[start:end], self.interval_last[start:end]
+
+    def frame_labels(self, video_index: int, start: int = 0, stop: Optional[int] = None) -> List[List[int]]:
+        """Label lists of frames [start, stop) of a video, in csv order."""
+        stop = self.num_frames(video_index) if stop is None else stop
+        if self.kind == "intervals":
+            classes, firsts, lasts = self._intervals(video_index)
+            frames = np.arange(start, stop)[:, None]
+            covered = (firsts <= frames) & (frames <= lasts)  # (frames, actions)
+            return [classes[row].tolist() for row in covered]
+        first = int(self.video_offsets[video_index])
+        offsets = self.label_offsets[first + start:first + stop + 1]
+        values = self.label_values[offsets[0]:offsets[-1]].tolist()
+        ends = (offsets - offsets[0]).tolist()
+        return [values[ends[i]:ends[i + 1]] for i in range(len(ends) - 1)]
+
+    def clip_labels(self, video_index: int, start: int = 0, stop: Optional[int] = None) -> List[int]:
+        """Sorted union of the labels of frames [start, stop), one OR over the bitsets, or
+        the actions overlapping the frames for interval annotations."""
+        stop = self.num_frames(video_index) if stop is None else stop
+        if self.kind == "intervals":
+            classes, firsts, lasts = self._intervals(video_index)
+            return np.unique(classes[(firsts < stop) & (lasts >= start)]).tolist()
+        first = int(self.video_offsets[video_index])
+        union = np.bitwise_or.reduce(self.label_bits[first + start:first + stop], axis=0)
+        return np.flatnonzero(np.unpackbits(union, bitorder="little")).tolist()
+
+    def caption(self, video_index: int) -> str:
+        start, end = self.caption_offsets[video_index], self.caption_offsets[video_index + 1]
+        return bytes(self.caption_blob[start:end]).decode()
+
+
+def load_annotation_index(csv_path: str, index_root: Optional[str] = None) -> CharadesAnnotationIndex:
+    """The index of `csv_path`, compiled first if it is missing or older than the CSV.
+    Built in memory if the index directory is not writable."""
+    index_dir = index_dir_for(csv_path, index_root)
+    if not _is_current(index_dir, csv_path):
+        try:
+            if index_root:
+                os.makedirs(index_root, exist_ok=True)
+            compile_annotation_index(csv_path, index_dir)
+        except OSError:
+            return CharadesAnnotationIndex(arrays=build_annotation_arrays(csv_path))
+    return CharadesAnnotationIndex(index_dir)
+
+
+class IndexedList(Sequence):
+    """Read-only list whose items are computed from an index on access, e.g. the
+    `_path_to_videos` of the Charades datasets."""
+    def __init__(self, get_item, length: int) -> None:
+        self._get_item = get_item
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get_item(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._get_item(i)
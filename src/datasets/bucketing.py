@@ -0,0 +1,116 @@
+"""
+Length-bucketed batches for caption training.
+
+Padded batches cost as much as their longest caption. `BucketBatchSampler` groups samples
+whose captions fall between the same boundaries, shuffles inside every bucket, cuts the
+buckets into batches and shuffles the order of the batches, e.g. with boundaries
+[16, 32, 64]: lengths < 16, 16 - 31, 32 - 63 and >= 64 are never batched together.
+Combined with padding to the longest caption of the batch (`trim_caption_collate_fn`)
+this removes most of the pad tokens the language model processes.
+"""
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from fvcore.common.config import CfgNode
+from torch.utils.data import Sampler
+from torch.utils.data.dataloader import default_collate
+
+from .feature_store import FeatureStore
+
+DEFAULT_BUCKET_BOUNDARIES = [16, 24, 32, 48, 64, 96]
+
+
+def get_bucket_boundaries(config: CfgNode) -> List[int]:
+    """TRAIN.BUCKET_BOUNDARIES, [] for a single bucket (plain shuffling)."""
+    return list(config.TRAIN.get("BUCKET_BOUNDARIES", DEFAULT_BUCKET_BOUNDARIES))
+
+
+def caption_lengths(store: FeatureStore, mask_field: str = "attention_mask") -> np.ndarray:
+    """Number of caption tokens of every sample of a store, from its attention masks."""
+    masks = store.stack_raw_field(mask_field)
+    return masks.reshape(len(store), -1).sum(dim=1).numpy()
+
+
+def padding_ratio(lengths: np.ndarray, batches: Sequence[Sequence[int]]) -> float:
+    """Fraction of pad tokens when every batch is padded to its longest caption."""
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches if len(batch))
+    return 1.0 - float(lengths.sum()) / max(padded, 1)
+
+
+class BucketBatchSampler(Sampler[List[int]]):
+    """Batches of indices with similar lengths, reshuffled every epoch.
+
+    Args:
+        lengths: caption length of every sample
+        batch_size: samples per batch
+        boundaries: increasing bucket boundaries, [] for one bucket
+        shuffle: shuffle inside the buckets and the batch order (else sorted, deterministic)
+        drop_last: drop the last incomplete batch of every bucket
+        seed: the shuffles of epoch e use seed + e
+    """
+    def __init__(self, lengths: Sequence[int], batch_size: int, boundaries: Optional[Sequence[int]] = None,
+                 shuffle: bool = True, drop_last: bool = False, seed: int = 0) -> None:
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.boundaries = list(DEFAULT_BUCKET_BOUNDARIES if boundaries is None else boundaries)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        bucket_of = np.searchsorted(self.boundaries, self.lengths, side="right")
+        self.buckets = [np.flatnonzero(bucket_of == b) for b in range(len(self.boundaries) + 1)]
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _batches(self, epoch: int) -> List[List[int]]:
+        rng = np.random.default_rng(self.seed + epoch)
+        batches = []
+        for bucket in self.buckets:
+            bucket = rng.permutation(bucket) if self.shuffle else bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                if len(batch) == self.batch_size or (len(batch) and not self.drop_last):
+                    batches.append(batch.tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._batches(self.epoch)
+        self.epoch += 1  # without set_epoch calls, every epoch still gets new shuffles
+        return iter(batches)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return sum(len(bucket) // self.batch_size for bucket in self.buckets)
+        return sum(-(-len(bucket) // self.batch_size) for bucket in self.buckets)
+
+    def padding_ratio(self) -> float:
+        """Pad token fraction of one epoch of these batches."""
+        return padding_ratio(self.lengths, self._batches(self.epoch))
+
+
+def trim_caption_collate_fn(mask_field: str = "attention_mask"):
+    """`default_collate` for feature store batches of (x, {'input_ids', 'attention_mask'}),
+    with the stored fixed-width captions cut to the longest caption of the batch.
+
+    Stores written before captions ended in their own EOS token hold it only as padding
+    (the pad token of GPT-2 is EOS), which the loss masks out. For those captions the
+    first pad position is kept and unmasked, so every caption still has an EOS target."""
+    def inner_collate_fn(examples):
+        X, y = default_collate(examples)
+        input_ids, mask = y["input_ids"], y[mask_field]
+        stored_width = mask.shape[-1]
+        lengths = mask.sum(dim=-1, keepdim=True)
+        # a caption with its own EOS ends in the pad token, one without ends in a word
+        last_token = input_ids.gather(-1, (lengths - 1).clamp(min=0))
+        pad_token = input_ids.gather(-1, lengths.clamp(max=stored_width - 1))
+        adds_eos = (lengths > 0) & (lengths < stored_width) & (last_token != pad_token)
+        positions = torch.arange(stored_width, device=mask.device)
+        mask = torch.where((positions == lengths) & adds_eos, torch.ones_like(mask), mask)
+        y = {**y, mask_field: mask}
+        width = max(1, int(mask.reshape(-1, stored_width).sum(dim=-1).max()))
+        return X, {field: value[..., :width] for field, value in y.items()}
+    return inner_collate_fn
@@ -0,0 +1,101 @@
+"""
+Caption token ids, tokenized once per annotation index instead of once per clip.
+
+`load_caption_tokens` tokenizes the caption of every video of a `CharadesAnnotationIndex`
+(truncated to `max_tokens` including a closing EOS token, no padding) and keeps the ids in
+the index directory:
+
+    tokens_<tokenizer>_<max_tokens>/ids.npy       int32 token ids, back to back
+    tokens_<tokenizer>_<max_tokens>/offsets.npy   (videos + 1,) start of every caption
+
+The cache goes away with the index when the CSV changes. Batches are padded to their
+longest caption by `captioning_collate_fn`. The pad token of GPT-2 is EOS and padding is
+masked out of the loss, so the explicit EOS is what teaches the model to stop.
+"""
+import os
+import json
+import shutil
+from typing import Dict
+
+import numpy as np
+import torch
+from fvcore.common.config import CfgNode
+
+from .annotation_index import CharadesAnnotationIndex
+
+DEFAULT_MAX_TOKENS = 128
+TOKENIZE_BATCH_SIZE = 1024
+
+
+def get_max_tokens(config: CfgNode) -> int:
+    """MODEL.HEAD.MAX_TOKENS, captions are truncated to it."""
+    return config.MODEL.HEAD.get("MAX_TOKENS", DEFAULT_MAX_TOKENS)
+
+
+class CaptionTokens:
+    """Token ids of the caption of every video, by video index."""
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, pad_token_id: int) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.pad_token_id = pad_token_id
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> np.ndarray:
+        """Number of tokens of every caption."""
+        return np.diff(self.offsets)
+
+    def encode(self, video_index: int) -> Dict[str, torch.Tensor]:
+        """Unpadded (1, length) input_ids and attention_mask, like the tokenizer returns them."""
+        start, end = self.offsets[video_index], self.offsets[video_index + 1]
+        input_ids = torch.from_numpy(np.array(self.ids[start:end], dtype=np.int64)).unsqueeze(0)
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids),
+                "pad_token_id": self.pad_token_id}
+
+
+def tokenize_captions(index: CharadesAnnotationIndex, tokenizer, max_tokens: int):
+    """ids and offsets of all captions of `index`, each ending in `tokenizer.eos_token_id`."""
+    lengths, chunks = [], []
+    for start in range(0, len(index), TOKENIZE_BATCH_SIZE):
+        captions = [index.caption(i) for i in range(start, min(start + TOKENIZE_BATCH_SIZE, len(index)))]
+        for ids in tokenizer(captions, max_length=max_tokens - 1, truncation=True)["input_ids"]:
+            ids = ids + [tokenizer.eos_token_id]
+            lengths.append(len(ids))
+            chunks.append(np.asarray(ids, dtype=np.int32))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    return ids, offsets
+
+
+def load_caption_tokens(index: CharadesAnnotationIndex, tokenizer, max_tokens: int = DEFAULT_MAX_TOKENS) -> CaptionTokens:
+    """The token table of `index` for `tokenizer`, from its cache or tokenized (and cached) now."""
+    meta = {"tokenizer": tokenizer.name_or_path, "vocab_size": len(tokenizer), "max_tokens": max_tokens,
+            "eos": tokenizer.eos_token_id}
+    cache_dir = None
+    if index.path:
+        name = tokenizer.name_or_path.strip("/").replace("/", "_")
+        cache_dir = os.path.join(index.path, f"tokens_{name}_{max_tokens}")
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r") as f:
+            if json.load(f) == meta:
+                return CaptionTokens(np.load(os.path.join(cache_dir, "ids.npy"), mmap_mode="r"),
+                                     np.load(os.path.join(cache_dir, "offsets.npy")), tokenizer.pad_token_id)
+    except (OSError, TypeError, ValueError):
+        pass
+
+    ids, offsets = tokenize_captions(index, tokenizer, max_tokens)
+    if cache_dir is not None:
+        tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+            np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.rename(tmp_dir, cache_dir)
+        except OSError:  # read-only index or another process cached it meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return CaptionTokens(ids, offsets, tokenizer.pad_token_id)
@@ -7,32 +7,108 @@ from fvcore.common.config import CfgNode
 import pytorchvideo.data
 import pandas as pd
 
-import csv
 import functools
-import itertools
 import os
-from collections import defaultdict
-from typing import Any, Callable, List, Optional, Tuple, Type
+from typing import Any, Callable, List, Optional, Type
 
 import torch
 import torch.utils.data
 
-from iopath.common.file_io import g_pathmgr
-
 from transformers import AutoTokenizer
 
 from pytorchvideo.data import Charades
-from pytorchvideo.data.clip_sampling import ClipSampler
-from pytorchvideo.data.frame_video import FrameVideo
+from pytorchvideo.data.clip_sampling import ClipSampler, RandomClipSampler
 from pytorchvideo.data.utils import MultiProcessSampler
 
 
 from .dataset_abstract import DatasetAbstract
-from .transformations import get_train_transforms, get_val_transforms
+from .frame_archive import open_frame_video
+from .frame_pool import FramePool, get_frame_pool
+from .annotation_index import IndexedList, load_annotation_index
+from .video_manifest import VideoManifest, manifest_from_annotation_index
+from .caption_tokens import get_max_tokens, load_caption_tokens
+from .transformations import get_train_transforms, get_val_transforms, get_num_sampled_frames, get_decode_size
+from .sampled_decoding import uniform_frame_filter
+
+
+class CharadesFrameVideos(Charades):
+    """Charades videos read from the compiled annotation index (see annotation_index.py):
+    frames come from the frame pool or the packed archives if set, else from the JPEG
+    files, decoded at `_decode_size`. Subclasses set these attributes in `__init__` and
+    build the samples in `_make_sample`, `CharadesClipDataset` relies on the same
+    interface."""
+    def restrict_to_videos(self, video_indices) -> None:
+        """Yield only the clips of these videos, in this order. The videos are still
+        split across DataLoader workers by `MultiProcessSampler`."""
+        self._video_sampler = list(video_indices)
+        self._video_sampler_iter = None
+        self._loaded_video = None
+        self._loaded_clip = None
+        self._next_clip_start_time = 0.0
+
+    def __next__(self) -> dict:
+        """
+        Retrieves the next clip based on the clip sampling strategy and video sampler.
+
+        Returns:
+            A dictionary with the following format.
+
+            .. code-block:: text
+
+                {
+                    'video': <video_tensor>,
+                    'label': <index_label>,
+                    'video_label': <index_label>
+                    'video_index': <video_index>,
+                    'clip_index': <clip_index>,
+                    'aug_index': <aug_index>,
+                }
+        """
+        if not self._video_sampler_iter:
+            # Setup MultiProcessSampler here - after PyTorch DataLoader workers are spawned.
+            self._video_sampler_iter = iter(MultiProcessSampler(self._video_sampler))
 
+        if self._loaded_video:
+            video, video_index = self._loaded_video
+        else:
+            video_index = next(self._video_sampler_iter)
+            video = self._open_video(video_index)
+            self._loaded_video = (video, video_index)
+
+        clip_start, clip_end, clip_index, aug_index, is_last_clip = self._clip_sampler(
+            self._next_clip_start_time, video.duration, {}
+        )
+        # Only load the clip once and reuse previously stored clip if there are multiple
+        # views for augmentations to perform on the same clip.
+        if aug_index == 0:
+            self._loaded_clip = video.get_clip(clip_start, clip_end, self._frame_filter)
+        self._next_clip_start_time = clip_end
+
+        if is_last_clip:
+            self._loaded_video = None
+            self._next_clip_start_time = 0.0
+
+        return self._make_sample(self._loaded_clip, video_index, clip_index, aug_index)
+
+    def _open_video(self, video_index: int):
+        frame_paths = self._path_to_videos[video_index]
+        if self._frame_pool is not None:
+            return self._frame_pool.open_video(
+                os.path.dirname(frame_paths[0]), self.fps,
+                lambda: open_frame_video(frame_paths, fps=self.fps, archive_dir=self._frame_archive_dir,
+                                         min_size=self._decode_size))
+        return open_frame_video(frame_paths, fps=self.fps, archive_dir=self._frame_archive_dir,
+                                min_size=self._decode_size)
+
+    def _video_duration(self, video_index: int) -> float:
+        """Duration of a video without opening it, as FrameVideo computes it."""
+        return self._index.num_frames(video_index) / self.fps
+
+    def _make_sample(self, clip: dict, video_index: int, clip_index: int, aug_index: int) -> dict:
+        raise NotImplementedError
 
 # Just in case we want to customize the Charades dataset, now not needed
-class CustomCharadesForCaptioning(Charades):
+class CustomCharadesForCaptioning(CharadesFrameVideos):
     def __init__(self,
         data_path: str,
         clip_sampler: ClipSampler,
@@ -41,7 +117,11 @@ class CustomCharadesForCaptioning(Charades):
         video_path_prefix: str = "",
         frames_per_clip: Optional[int] = None,
         tokenizer: AutoTokenizer = None,
-        max_tokens=128) -> None:
+        max_tokens=128,
+        frame_archive_dir: Optional[str] = None,
+        annotation_index_dir: Optional[str] = None,
+        frame_pool: Optional[FramePool] = None,
+        decode_size: Optional[int] = None) -> None:
         """
         Args:
             data_path (str): Path to the data file. This file must be a space
@@ -64,27 +144,28 @@ class CustomCharadesForCaptioning(Charades):
             frames_per_clip (Optional[int]): The number of frames per clip to sample.
             tokenizer (transformers.Tokenizer): a tokenizer to encode text into list of tokens
             max_tokens (int): max number of tokens, truncate if exceeds
+            frame_archive_dir (str): directory of packed frame archives (see pack_frames.py),
+                videos without an archive are read from their JPEG files
+            annotation_index_dir (str): where the compiled index of data_path is kept,
+                next to the csv if None (see annotation_index.py)
+            frame_pool (FramePool): decoded frames shared by the workers, see frame_pool.py
+            decode_size (int): decode JPEG frames downscaled to no less than decode_size on
+                both sides (see frame_archive.py), full size if None
         """
 
         torch._C._log_api_usage_once("PYTORCHVIDEO.dataset.Charades.__init__")
 
         self._transform = transform
         self._clip_sampler = clip_sampler
-        (
-            self._path_to_videos,
-            self._labels,
-            self._video_labels,
-        ) = self._read_video_paths_and_labels(data_path, prefix=video_path_prefix)
+        self._index = load_annotation_index(data_path, annotation_index_dir)
+        self._path_to_videos = IndexedList(functools.partial(self._index.frame_paths, prefix=video_path_prefix),
+                                           len(self._index))
+        self._labels = IndexedList(self._index.caption, len(self._index))
+        self._video_labels = self._labels
         self._video_sampler = video_sampler(self._path_to_videos)
         self._video_sampler_iter = None  # Initialized on first call to self.__next__()
-        self._frame_filter = (
-            functools.partial(
-                Charades._sample_clip_frames,
-                frames_per_clip=frames_per_clip,
-            )
-            if frames_per_clip is not None
-            else None
-        )
+        # only the frames UniformTemporalSubsample keeps are decoded
+        self._frame_filter = uniform_frame_filter(frames_per_clip) if frames_per_clip is not None else None
 
         # Depending on the clip sampler type, we may want to sample multiple clips
         # from one video. In that case, we keep the store video, label and previous sampled
@@ -95,65 +176,21 @@ class CustomCharadesForCaptioning(Charades):
 
         self.tokenizer = tokenizer
         self.max_tokens = max_tokens
+        # every caption is tokenized once, clips look their ids up by video
+        self._caption_tokens = load_caption_tokens(self._index, tokenizer, max_tokens)
+        self.fps = 30.0
+        self._frame_archive_dir = frame_archive_dir
+        self._frame_pool = frame_pool
+        self._decode_size = decode_size
 
     @property
     def video_sampler(self) -> torch.utils.data.Sampler:
         return self._video_sampler
 
-    def __next__(self) -> dict:
-        """
-        Retrieves the next clip based on the clip sampling strategy and video sampler.
-
-        Returns:
-            A dictionary with the following format.
-
-            .. code-block:: text
-
-                {
-                    'video': <video_tensor>,
-                    'label': <index_label>,
-                    'video_label': <index_label>
-                    'video_index': <video_index>,
-                    'clip_index': <clip_index>,
-                    'aug_index': <aug_index>,
-                }
-        """
-        if not self._video_sampler_iter:
-            # Setup MultiProcessSampler here - after PyTorch DataLoader workers are spawned.
-            self._video_sampler_iter = iter(MultiProcessSampler(self._video_sampler))
-
-        if self._loaded_video:
-            video, video_index = self._loaded_video
-            
-        else:
-            video_index = next(self._video_sampler_iter)
-            path_to_video_frames = self._path_to_videos[video_index]
-            video = FrameVideo.from_frame_paths(path_to_video_frames)
-            self._loaded_video = (video, video_index)
-            
-        clip_start, clip_end, clip_index, aug_index, is_last_clip = self._clip_sampler(
-            self._next_clip_start_time, video.duration, {}
-        )
-        # Only load the clip once and reuse previously stored clip if there are multiple
-        # views for augmentations to perform on the same clip.
-        if aug_index == 0:
-            self._loaded_clip = video.get_clip(clip_start, clip_end, self._frame_filter)
-
-        frames, frame_indices = (
-            self._loaded_clip["video"],
-            self._loaded_clip["frame_indices"],
-        )
-        self._next_clip_start_time = clip_end
-
-        if is_last_clip:
-            self._loaded_video = None
-            self._next_clip_start_time = 0.0
-
-        # Merge unique labels from each frame into clip label.
-       
-        label = self._labels[video_index]
-        encoded_label = self.tokenizer(label, max_length=self.max_tokens, padding='max_length', 
-                                              truncation=True, return_tensors='pt')
+    def _make_sample(self, clip: dict, video_index: int, clip_index: int, aug_index: int) -> dict:
+        frames = clip["video"]
+        # unpadded, captioning_collate_fn pads the batch to its longest caption
+        encoded_label = self._caption_tokens.encode(video_index)
 
         sample_dict = {
             "video": frames,
@@ -169,43 +206,7 @@ class CustomCharadesForCaptioning(Charades):
 
         return sample_dict
 
-    def _read_video_paths_and_labels(self,
-        video_path_label_file: List[str], prefix: str = ""
-    ) -> Tuple[List[str], List[int]]:
-        """
-        Args:
-            video_path_label_file (List[str]): a file that contains frame paths for each
-                video and the corresponding frame label. The file must be a space separated
-                csv of the format:
-                    `original_vido_id video_id frame_id path labels`
-
-            prefix (str): prefix path to add to all paths from video_path_label_file.
-
-        """
-        image_paths = defaultdict(list)
-        labels = defaultdict(set)
-        with g_pathmgr.open(video_path_label_file, "r") as f:
-
-            # Space separated CSV with format: original_vido_id video_id frame_id path labels
-            csv_reader = csv.DictReader(f, delimiter=" ")
-            for row in csv_reader:
-                assert len(row) == 5
-                video_name = row["original_vido_id"]
-                path = os.path.join(prefix, row["path"])
-                image_paths[video_name].append(path)
-                frame_cap = row["caption"]
-                labels[video_name].add(frame_cap)
-
-        # Extract image paths from dictionary and return paths and labels as list.
-        video_names = image_paths.keys()
-        image_paths = [image_paths[key] for key in video_names]
-        labels = [list(labels[key])[0] for key in video_names]
-        # print(video_names[0])
-        # Aggregate labels from all frames to form video-level labels.
-        # video_labels = [list(set(itertools.chain(*label_list))) for label_list in labels]
-        return image_paths, labels, labels
-
-class CustomCharadesForActionClassification(Charades):
+class CustomCharadesForActionClassification(CharadesFrameVideos):
     def __init__(self,
         data_path: str,
         clip_sampler: ClipSampler,
@@ -213,7 +214,11 @@ class CustomCharadesForActionClassification(Charades):
         transform: Optional[Callable[[dict], Any]] = None,
         video_path_prefix: str = "",
         frames_per_clip: Optional[int] = None,
-        fps:float=1.5) -> None:
+        fps:float=1.5,
+        frame_archive_dir: Optional[str] = None,
+        annotation_index_dir: Optional[str] = None,
+        frame_pool: Optional[FramePool] = None,
+        decode_size: Optional[int] = None) -> None:
         """
         Args:
             data_path (str): Path to the data file. This file must be a space
@@ -233,72 +238,47 @@ class CustomCharadesForActionClassification(Charades):
 
             video_path_prefix (str): prefix path to add to all paths from data_path.
 
-            frames_per_clip (Optional[int]): The number of frames per clip to sample.
+            frames_per_clip (Optional[int]): The number of frames per clip to sample, only these
+                frames are decoded.
             fps: video's frame per second
+            frame_archive_dir (str): directory of packed frame archives (see pack_frames.py),
+                videos without an archive are read from their JPEG files
+            annotation_index_dir (str): where the compiled index of data_path is kept,
+                next to the csv if None (see annotation_index.py)
+            frame_pool (FramePool): decoded frames shared by the workers, see frame_pool.py
+            decode_size (int): decode JPEG frames downscaled to no less than decode_size on
+                both sides (see frame_archive.py), full size if None
         """
 
-        super().__init__(data_path,
-                        clip_sampler,
-                        video_sampler,
-                        transform,
-                        video_path_prefix,
-                        frames_per_clip)
-        self.fps = fps
-
-    def __next__(self) -> dict:
-        """
-        Retrieves the next clip based on the clip sampling strategy and video sampler.
-
-        Returns:
-            A dictionary with the following format.
-
-            .. code-block:: text
-
-                {
-                    'video': <video_tensor>,
-                    'label': <index_label>,
-                    'video_label': <index_label>
-                    'video_index': <video_index>,
-                    'clip_index': <clip_index>,
-                    'aug_index': <aug_index>,
-                }
-        """
-        if not self._video_sampler_iter:
-            # Setup MultiProcessSampler here - after PyTorch DataLoader workers are spawned.
-            self._video_sampler_iter = iter(MultiProcessSampler(self._video_sampler))
-
-        if self._loaded_video:
-            video, video_index = self._loaded_video
-        else:
-            video_index = next(self._video_sampler_iter)
-            path_to_video_frames = self._path_to_videos[video_index]
-            video = FrameVideo.from_frame_paths(path_to_video_frames, fps=self.fps)
-            self._loaded_video = (video, video_index)
-
-        clip_start, clip_end, clip_index, aug_index, is_last_clip = self._clip_sampler(
-            self._next_clip_start_time, video.duration, {}
-        )
-        # Only load the clip once and reuse previously stored clip if there are multiple
-        # views for augmentations to perform on the same clip.
-        if aug_index == 0:
-            self._loaded_clip = video.get_clip(clip_start, clip_end, self._frame_filter)
+        torch._C._log_api_usage_once("PYTORCHVIDEO.dataset.Charades.__init__")
 
-        frames, frame_indices = (
-            self._loaded_clip["video"],
-            self._loaded_clip["frame_indices"],
-        )
-        self._next_clip_start_time = clip_end
+        self._transform = transform
+        self._clip_sampler = clip_sampler
+        # the compiled index instead of parsing the per-frame csv (Charades.__init__)
+        self._index = load_annotation_index(data_path, annotation_index_dir)
+        self._path_to_videos = IndexedList(functools.partial(self._index.frame_paths, prefix=video_path_prefix),
+                                           len(self._index))
+        self._labels = IndexedList(self._index.frame_labels, len(self._index))
+        self._video_labels = IndexedList(self._index.clip_labels, len(self._index))
+        self._video_sampler = video_sampler(self._path_to_videos)
+        self._video_sampler_iter = None  # Initialized on first call to self.__next__()
+        self._loaded_video = None
+        self._loaded_clip = None
+        self._next_clip_start_time = 0.0
+        # only the frames UniformTemporalSubsample keeps are decoded
+        self._frame_filter = uniform_frame_filter(frames_per_clip) if frames_per_clip is not None else None
+        self.fps = fps
+        self._frame_archive_dir = frame_archive_dir
+        self._frame_pool = frame_pool
+        self._decode_size = decode_size
 
-        if is_last_clip:
-            self._loaded_video = None
-            self._next_clip_start_time = 0.0
+    def _make_sample(self, clip: dict, video_index: int, clip_index: int, aug_index: int) -> dict:
+        frames, frame_indices = clip["video"], clip["frame_indices"]
 
         # Merge unique labels from each frame into clip label.
-        labels_by_frame = [
-            self._labels[video_index][i]
-            for i in range(min(frame_indices), max(frame_indices) + 1)
-        ]
-        clip_label = list(set(itertools.chain.from_iterable(labels_by_frame)))
+        first_frame, last_frame = min(frame_indices), max(frame_indices)
+        labels_by_frame = self._index.frame_labels(video_index, first_frame, last_frame + 1)
+        clip_label = self._index.clip_labels(video_index, first_frame, last_frame + 1)
         sample_dict = {
             "video": frames,
             "label": labels_by_frame,
@@ -314,6 +294,77 @@ class CustomCharadesForActionClassification(Charades):
 
         return sample_dict
 
+
+class CharadesClipDataset(Dataset):
+    """Map-style view of the clips of a Charades dataset above.
+
+    The clip sampler of `source` is run over every video once, without decoding, giving an
+    index of (video_index, clip_index, aug_index, clip_start, clip_end) entries. Clips can then
+    be fetched in any order: a `RandomSampler` shuffles clips across all videos, a
+    `DistributedSampler` splits them evenly over ranks and workers, `len()` is known and a
+    resumed epoch can skip to any clip. A random clip sampler yields one entry per video and
+    draws its window again every time the entry is fetched, as the iterable dataset does.
+
+    Args:
+        source: a CustomCharadesForCaptioning / CustomCharadesForActionClassification, only its
+            index, clip sampler, transform and sample building are used
+    """
+    def __init__(self, source: CharadesFrameVideos) -> None:
+        self.source = source
+        self._random_clips = isinstance(source._clip_sampler, RandomClipSampler)
+        self._last_video = None  # consecutive clips of one video reuse the opened video
+        self._build_clip_index(range(len(source._path_to_videos)))
+
+    def _build_clip_index(self, video_indices) -> None:
+        clip_sampler = self.source._clip_sampler
+        self._clips = []
+        for video_index in video_indices:
+            duration = self.source._video_duration(video_index)
+            clip_sampler.reset()
+            clip_end, is_last_clip = 0.0, False
+            while not is_last_clip:
+                clip_start, clip_end, clip_index, aug_index, is_last_clip = clip_sampler(clip_end, duration, {})
+                self._clips.append((video_index, clip_index, aug_index, clip_start, clip_end))
+        clip_sampler.reset()
+
+    def restrict_to_videos(self, video_indices) -> None:
+        """Keep only the clips of these videos, in this order."""
+        self._build_clip_index(video_indices)
+
+    @property
+    def _path_to_videos(self):
+        return self.source._path_to_videos
+
+    @property
+    def _labels(self):
+        return self.source._labels
+
+    @property
+    def video_indices(self) -> List[int]:
+        """The video of every clip, by clip index."""
+        return [clip[0] for clip in self._clips]
+
+    def __len__(self) -> int:
+        return len(self._clips)
+
+    def __getitem__(self, index: int) -> dict:
+        video_index, clip_index, aug_index, clip_start, clip_end = self._clips[index]
+        if self._last_video is not None and self._last_video[0] == video_index:
+            video = self._last_video[1]
+        else:
+            video = self.source._open_video(video_index)
+            self._last_video = (video_index, video)
+        if self._random_clips:
+            clip_start, clip_end, *_ = self.source._clip_sampler(0.0, video.duration, {})
+        clip = video.get_clip(clip_start, clip_end, self.source._frame_filter)
+        return self.source._make_sample(clip, video_index, clip_index, aug_index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_last_video"] = None
+        return state
+
+
 class CharadesCaptionDataset(DatasetAbstract):
     def __init__(self, config: CfgNode) -> None:
         super().__init__()
@@ -323,6 +374,11 @@ class CharadesCaptionDataset(DatasetAbstract):
         self.test_csv_path = self.dataset_root_path / config.DATA.TEST_CSV
 
         self.clip_duration = config.DATA.CLIP_DURATION
+        self.frame_archive_dir = config.DATA.get("FRAME_ARCHIVE_DIR", None)
+        self.annotation_index_dir = config.DATA.get("ANNOTATION_INDEX_DIR", None)
+
+        self.map_style = config.DATA.get("MAP_STYLE", False)
+        self.frame_pool = get_frame_pool(config)
 
         self.train_transforms = get_train_transforms(config)
         self.val_transforms = get_val_transforms(config)
@@ -336,8 +392,14 @@ class CharadesCaptionDataset(DatasetAbstract):
                             data_path=self.train_csv_path, 
                             clip_sampler=clip_sampler,
                             transform=self.train_transforms,
-                            tokenizer=self.tokenizer)
-        return train_dataset
+                            tokenizer=self.tokenizer,
+                            max_tokens=get_max_tokens(self.config),
+                            frames_per_clip=get_num_sampled_frames(self.config),
+                            frame_archive_dir=self.frame_archive_dir,
+                            annotation_index_dir=self.annotation_index_dir,
+                            frame_pool=self.frame_pool,
+                            decode_size=get_decode_size(self.config))
+        return CharadesClipDataset(train_dataset) if self.map_style else train_dataset
 
     def get_val_dataset(self) -> Dataset:
         clip_sampler = pytorchvideo.data.make_clip_sampler("uniform", self.clip_duration)
@@ -345,8 +407,19 @@ class CharadesCaptionDataset(DatasetAbstract):
                             data_path=self.test_csv_path, 
                             clip_sampler=clip_sampler,
                             transform=self.val_transforms,
-                            tokenizer=self.tokenizer)
-        return val_dataset
+                            tokenizer=self.tokenizer,
+                            max_tokens=get_max_tokens(self.config),
+                            frames_per_clip=get_num_sampled_frames(self.config),
+                            frame_archive_dir=self.frame_archive_dir,
+                            annotation_index_dir=self.annotation_index_dir,
+                            frame_pool=self.frame_pool,
+                            decode_size=get_decode_size(self.config))
+        return CharadesClipDataset(val_dataset) if self.map_style else val_dataset
+
+    def get_video_manifest(self, split: str) -> VideoManifest:
+        csv_path = self.train_csv_path if split == "train" else self.test_csv_path
+        # frames are read at 30 fps, as CustomCharadesForCaptioning does
+        return manifest_from_annotation_index(load_annotation_index(str(csv_path), self.annotation_index_dir), 30.0)
 
 
 class CharadesActionClassification(DatasetAbstract):
@@ -364,6 +437,10 @@ class CharadesActionClassification(DatasetAbstract):
 
         self.clip_duration = config.DATA.CLIP_DURATION
         self.fps = config.DATA.FPS
+        self.frame_archive_dir = config.DATA.get("FRAME_ARCHIVE_DIR", None)
+        self.annotation_index_dir = config.DATA.get("ANNOTATION_INDEX_DIR", None)
+        self.map_style = config.DATA.get("MAP_STYLE", False)
+        self.frame_pool = get_frame_pool(config)
 
         self.train_transforms = get_train_transforms(config)
         self.val_transforms = get_val_transforms(config)
@@ -373,18 +450,32 @@ class CharadesActionClassification(DatasetAbstract):
             data_path=str(self.train_csv_path),
             clip_sampler=pytorchvideo.data.make_clip_sampler("uniform", self.clip_duration),
             transform=self.train_transforms,
-            fps=self.fps
+            fps=self.fps,
+            frames_per_clip=get_num_sampled_frames(self.config),
+            frame_archive_dir=self.frame_archive_dir,
+            annotation_index_dir=self.annotation_index_dir,
+            frame_pool=self.frame_pool,
+            decode_size=get_decode_size(self.config)
         )
-        return train_dataset
+        return CharadesClipDataset(train_dataset) if self.map_style else train_dataset
 
     def get_val_dataset(self) -> Dataset:
         val_dataset = CustomCharadesForActionClassification(
             data_path=str(self.test_csv_path),
             clip_sampler=pytorchvideo.data.make_clip_sampler("uniform", self.clip_duration),
             transform=self.val_transforms,
-            fps=self.fps
+            fps=self.fps,
+            frames_per_clip=get_num_sampled_frames(self.config),
+            frame_archive_dir=self.frame_archive_dir,
+            annotation_index_dir=self.annotation_index_dir,
+            frame_pool=self.frame_pool,
+            decode_size=get_decode_size(self.config)
         )
-        return val_dataset
+        return CharadesClipDataset(val_dataset) if self.map_style else val_dataset
+
+    def get_video_manifest(self, split: str) -> VideoManifest:
+        csv_path = self.train_csv_path if split == "train" else self.test_csv_path
+        return manifest_from_annotation_index(load_annotation_index(str(csv_path), self.annotation_index_dir), self.fps)
 
     def get_id2label(self) -> Dict:
         return self.id2label
@@ -1,31 +1,37 @@
-from collections import defaultdict
 import torch
 
 import numpy as np
 
-def captioning_collate_fn(config):
+def pad_captions(captions, pad_to=None):
+    """Pad (1, length) input_ids / attention_mask to the longest caption of the batch
+    (or to `pad_to`) with the pad token, masked out."""
+    lengths = [caption['input_ids'].shape[-1] for caption in captions]
+    width = pad_to or max(1, max(lengths))
+    pad_token_id = captions[0].get('pad_token_id', 0)
+    input_ids = torch.full((len(captions), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(captions), width), dtype=torch.long)
+    for i, (caption, length) in enumerate(zip(captions, lengths)):
+        length = min(length, width)
+        input_ids[i, :length] = caption['input_ids'][0, :length]
+        attention_mask[i, :length] = caption['attention_mask'][0, :length]
+    return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+def captioning_collate_fn(config, pad_to=None):
+    """Captions are padded to the longest one of the batch, or to `pad_to` tokens."""
     def inner_collate_fn(examples):
         """The collation function to be used by `Trainer` to prepare data batches."""
-        # permute to (num_frames, num_channels, height, width)
+        # permute to (num_frames, num_channels, height, width), uint8 with DATA.UINT8_CLIPS
         pixel_values = torch.stack(
             [example["video"].permute(1, 0, 2, 3) for example in examples]
         )
-        labels = defaultdict(list)
-        for example in examples:
-            dict_data = example['label']
-            labels['input_ids'].append(dict_data['input_ids'])
-            labels['attention_mask'].append(dict_data['attention_mask'])
-            # print(dict_data['attention_mask'])
-
-        labels['input_ids'] = torch.cat(labels['input_ids'])
-        labels['attention_mask'] = torch.cat(labels['attention_mask'])
+        labels = pad_captions([example['label'] for example in examples], pad_to)
         return pixel_values, labels
     return inner_collate_fn
 
 def classification_collate_fn(config):
     def inner_collate_fn(examples):
         """The collation function to be used by `Trainer` to prepare data batches."""
-        # permute to (num_frames, num_channels, height, width)
+        # permute to (num_frames, num_channels, height, width), uint8 with DATA.UINT8_CLIPS
         pixel_values = torch.stack(
             [example["video"].permute(1, 0, 2, 3) for example in examples]
         )
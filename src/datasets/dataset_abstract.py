@@ -10,3 +10,8 @@ class DatasetAbstract(abc.ABC):
     @abc.abstractmethod
     def get_val_dataset(self) -> Dataset:
         return None
+
+    def get_video_manifest(self, split: str):
+        """The videos of a split with their labels, frame counts, fps and durations
+        (a `VideoManifest`), None if the dataset has none."""
+        return None
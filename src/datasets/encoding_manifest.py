@@ -0,0 +1,183 @@
+"""
+Bookkeeping for resumable encoding runs (see create_encoding.py).
+
+The manifest lives next to the feature store as `<root>/manifest.json` and records
+    - the encoder signature: encoder config, the data fields that change the features,
+      the sha1 of the pretrained weight file and the storage dtype,
+    - for every split, the videos whose clips are all in the store, each with a
+      fingerprint of its source files and labels.
+
+A rerun only encodes videos that are missing or whose fingerprint changed, and a
+store is never extended with features of a different encoder.
+
+Stores are placed at `<DATA.ENCODING_DIR>/<cache key>`, where the key is a hash of the
+encoder signature and the dataset, so changing any of them selects another store
+instead of silently reusing stale features. `encodings_complete` tells training
+scripts whether a store can be used as is.
+"""
+import os
+import json
+import hashlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fvcore.common.config import CfgNode
+
+MANIFEST_NAME = "manifest.json"
+# DATA fields that change what the encoder sees, hence the stored features
+FEATURE_DATA_FIELDS = ["IMG_SIZE", "NUM_SAMPLED_FRAMES", "NUM_SAMPLED_FRAMES_MULT", "MEAN", "STD",
+                       "FPS", "CLIP_DURATION"]
+# DATA fields that select the videos and labels, they only go into the cache key
+DATASET_FIELDS = ["DATASET", "ROOT_PATH", "TRAIN_CSV", "TEST_CSV"]
+DEFAULT_ENCODING_ROOT = "data/encodings"
+
+
+def file_sha1(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha1 of a file. Remembered in `<path>.sha1` together with the size and mtime, so
+    multi-GB weight files are only hashed again after they change."""
+    stat = os.stat(path)
+    stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    cache_path = path + ".sha1"
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if {k: cached.get(k) for k in stamp} == stamp:
+            return cached["sha1"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({**stamp, "sha1": sha1.hexdigest()}, f)
+    except OSError:
+        pass  # read-only checkpoint directory, hash again next time
+    return sha1.hexdigest()
+
+
+def encoder_signature(config: CfgNode, pretrained_path: str | None, storage_dtype: str = "float32") -> Dict[str, Any]:
+    """Everything that has to match for features to be stored side by side."""
+    if config.MODEL.TYPE == "captioning":  # the sampled frames are stored, the weights are never loaded
+        pretrained_path = None
+    signature = {
+        "encoder": config.MODEL.ENCODER,
+        "data": {field: config.DATA.get(field) for field in FEATURE_DATA_FIELDS},
+        "checkpoint_sha1": file_sha1(pretrained_path) if pretrained_path else None,
+    }
+    if storage_dtype != "float32":  # keeps the signature of existing float32 stores unchanged
+        signature["storage_dtype"] = storage_dtype
+    if config.DATA.get("UINT8_CLIPS", False):  # resized in uint8, the frames are rounded
+        signature["uint8_clips"] = True
+    # normalize CfgNodes and tuples the same way they come back from the json file
+    return json.loads(json.dumps(signature))
+
+
+def encoding_cache_key(config: CfgNode, signature: Dict[str, Any]) -> str:
+    """Short hash of everything the stored features depend on."""
+    content = {
+        "signature": signature,
+        "model_type": config.MODEL.TYPE,
+        "dataset": {field: config.DATA.get(field) for field in DATASET_FIELDS},
+    }
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_encoding_dir(config: CfgNode, signature: Dict[str, Any]) -> str:
+    """Store location for this config: `<DATA.ENCODING_DIR>/<cache key>`."""
+    root = config.DATA.get("ENCODING_DIR", None) or DEFAULT_ENCODING_ROOT
+    return os.path.join(root, encoding_cache_key(config, signature))
+
+
+def get_config_encoding_dir(config: CfgNode, pretrained_path: Optional[str] = None) -> str:
+    """Where create_encoding.py puts the store of `config` (storage dtype DATA.ENCODING_DTYPE).
+    `pretrained_path` only matters for classification, captioning stores hold frames."""
+    signature = encoder_signature(config, pretrained_path, config.DATA.get("ENCODING_DTYPE", "float32"))
+    return get_encoding_dir(config, signature)
+
+
+def encodings_complete(root: str, signature: Dict[str, Any], splits: List[str]) -> bool:
+    """Whether `root` holds features of `signature` for every video of `splits`."""
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        data = json.load(f)
+    return data["signature"] == signature and all(data.get("complete", {}).get(split, False) for split in splits)
+
+
+def get_video_sources(dataset) -> List[Tuple[str, str]]:
+    """(video key, fingerprint) for every video of a pytorchvideo dataset, in video_index order.
+
+    Supports the Charades datasets (videos are lists of frame paths) and
+    `LabeledVideoDataset` (UCF101, HMDB51).
+    """
+    sources = []
+    if hasattr(dataset, "_path_to_videos"):
+        for frame_paths, label in zip(dataset._path_to_videos, dataset._labels):
+            video_dir = os.path.dirname(frame_paths[0])
+            stat = os.stat(video_dir)
+            content = json.dumps([frame_paths, label, stat.st_mtime])
+            sources.append((os.path.basename(video_dir), hashlib.sha1(content.encode()).hexdigest()))
+    else:
+        for path, info in dataset._labeled_videos:
+            stat = os.stat(path)
+            content = json.dumps([path, info, stat.st_size, stat.st_mtime], sort_keys=True, default=str)
+            sources.append((str(path), hashlib.sha1(content.encode()).hexdigest()))
+    return sources
+
+
+def restrict_to_videos(dataset, video_indices: List[int]):
+    """Make a dataset yield the clips of `video_indices` only, through its own
+    `restrict_to_videos` (the Charades datasets, `RestrictableLabeledVideoDataset`)."""
+    if not hasattr(dataset, "restrict_to_videos"):
+        raise TypeError(f"{type(dataset).__name__} can't be restricted to a subset of its videos")
+    dataset.restrict_to_videos(video_indices)
+    return dataset
+
+
+class EncodingManifest:
+    def __init__(self, root: str, signature: Dict[str, Any]) -> None:
+        self.path = os.path.join(root, MANIFEST_NAME)
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+            if self.data["signature"] != signature:
+                raise ValueError(f"{root} holds features of a different encoder or data setup "
+                                 f"(stored: {self.data['signature']}, current: {signature}). "
+                                 "Use another DATA.ENCODING_DIR or remove the old one.")
+        else:
+            self.data = {"signature": signature, "splits": {}}
+
+    def _videos(self, split: str) -> Dict[str, Dict[str, Any]]:
+        return self.data["splits"].setdefault(split, {})
+
+    def up_to_date(self, split: str, sources: List[Tuple[str, str]]) -> Set[str]:
+        """Keys of the videos already encoded from exactly these sources."""
+        videos = self._videos(split)
+        return {key for key, fingerprint in sources
+                if key in videos and videos[key]["fingerprint"] == fingerprint}
+
+    def pending(self, split: str, sources: List[Tuple[str, str]]) -> List[int]:
+        """Indices (into `sources`) of the videos that still have to be encoded."""
+        done = self.up_to_date(split, sources)
+        return [i for i, (key, _) in enumerate(sources) if key not in done]
+
+    def retain(self, split: str, video_keys: Set[str]):
+        videos = self._videos(split)
+        for key in list(videos):
+            if key not in video_keys:
+                del videos[key]
+
+    def mark_done(self, split: str, video_key: str, fingerprint: str, num_clips: int):
+        self._videos(split)[video_key] = {"fingerprint": fingerprint, "num_clips": num_clips}
+
+    def set_complete(self, split: str, complete: bool):
+        """Record whether every video of the split is encoded, see `encodings_complete`."""
+        self.data.setdefault("complete", {})[split] = complete
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.data, f)
+        os.replace(self.path + ".tmp", self.path)
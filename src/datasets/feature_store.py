@@ -0,0 +1,421 @@
+"""
+On-disk layout of a feature store (one directory, see `encoding_manifest.get_encoding_dir`):
+
+    <root>/<split>_00000.bin      raw tensor bytes, samples appended back to back
+    <root>/<split>_00001.bin
+    ...
+    <root>/<split>_index.json     shard names, per-field dtypes and, for every sample,
+                                  the shard it lives in plus (offset, shape) of each field
+
+Float fields can be stored as float16, bfloat16 or int8 (symmetric, one float32 scale per
+channel kept in a companion `<field>_scale` field). The reader dequantizes on access, so
+datasets always get back the original dtype.
+
+Parallel encoding workers write tagged shards (`<split>_<tag>_00000.bin`) and their own
+index (`<split>_index.<tag>.json`), which are merged into the main index at the end.
+
+Shards are memory-mapped by the reader, so fetching a sample is a zero-copy slice
+of the page cache instead of opening and unpickling a `.pt` file.
+"""
+import os
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+INDEX_FORMAT_VERSION = 1
+STORAGE_DTYPES = ["float32", "float16", "bfloat16", "int8"]
+DEFAULT_SHARD_BYTES = 1 << 30  # start a new shard after ~1GB
+ALIGNMENT = 64  # every tensor starts at a multiple of this many bytes
+
+
+def index_path(root: str, split: str, tag: Optional[str] = None) -> str:
+    if tag is not None:
+        return os.path.join(root, f"{split}_index.{tag}.json")
+    return os.path.join(root, f"{split}_index.json")
+
+
+def dtype_to_str(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def str_to_dtype(name: str) -> torch.dtype:
+    return getattr(torch, name)
+
+
+def clip_key(video_key: str, clip_index: int) -> str:
+    """Key of one stored clip, used to find (and drop) all clips of a video."""
+    return f"{video_key}#{clip_index}"
+
+
+def video_of(key: str) -> str:
+    return key.rsplit("#", 1)[0]
+
+
+def quantize(tensor: torch.Tensor, dtype: str) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """Convert a float tensor to the storage dtype, returns the stored tensor and its scales.
+
+    float16 / bfloat16 are plain casts without scales. int8 is symmetric with one scale
+    per channel (the last dimension), or a single scale for 1-D tensors like cls tokens,
+    where per-channel scales would be as large as the data itself.
+    """
+    if dtype != "int8":
+        return tensor.to(str_to_dtype(dtype)), None
+    tensor = tensor.float()
+    if tensor.dim() >= 2:
+        absmax = tensor.abs().reshape(-1, tensor.shape[-1]).amax(dim=0)
+    else:
+        absmax = tensor.abs().amax().reshape(1)
+    scale = (absmax / 127).clamp(min=1e-12)
+    return torch.round(tensor / scale).clamp(-127, 127).to(torch.int8), scale
+
+
+def dequantize(tensor: torch.Tensor, scale: Optional[torch.Tensor], dtype: torch.dtype) -> torch.Tensor:
+    out = tensor.to(dtype)
+    if scale is not None:
+        out = out * scale.to(dtype)
+    return out
+
+
+def tensor_to_bytes(tensor: torch.Tensor) -> np.ndarray:
+    """View the raw bytes of a tensor as a flat uint8 numpy array (works for bf16 too)."""
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+class FeatureStoreWriter:
+    """Append per-sample tensors of a split into large contiguous shards.
+
+    Every call to `write` stores one sample, given as a dictionary of named tensors
+    (e.g. {'x': encoding, 'y': label}). All samples must provide the same fields with
+    the same dtypes, shapes may differ between samples.
+
+    With `append=True` an existing split is extended: its index is loaded and new
+    samples go to new shards, the existing shards are never rewritten. A `tag` gives a
+    writer its own shards and index, so several processes can write to the same root.
+    `quantize` maps field names to a storage dtype (see `STORAGE_DTYPES`), e.g. {'x': 'int8'}.
+    """
+    def __init__(self, root: str, split: str, shard_bytes: int = DEFAULT_SHARD_BYTES,
+                 append: bool = False, tag: Optional[str] = None,
+                 quantize: Optional[Dict[str, str]] = None) -> None:
+        self.root = root
+        self.split = split
+        self.shard_bytes = shard_bytes
+        self.tag = tag
+        self.quantize = {field: dtype for field, dtype in (quantize or {}).items() if dtype != "float32"}
+        os.makedirs(root, exist_ok=True)
+
+        self.shards: List[str] = []
+        self.fields: Dict[str, Dict[str, Any]] = {}
+        self.samples: List[Dict[str, Any]] = []
+        self.metadata: Dict[str, Any] = {}
+        self._file = None
+        self._offset = 0
+
+        if append and os.path.exists(index_path(root, split, tag)):
+            existing = FeatureStore(root, split, tag)
+            self.shards = existing.shards
+            self.fields = existing.fields
+            self.samples = existing.samples
+            self.metadata = existing.metadata
+
+    def _shard_name(self, shard_id: int) -> str:
+        if self.tag is not None:
+            return f"{self.split}_{self.tag}_{shard_id:05d}.bin"
+        return f"{self.split}_{shard_id:05d}.bin"
+
+    def _open_next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        name = self._shard_name(len(self.shards))
+        self.shards.append(name)
+        self._file = open(os.path.join(self.root, name), "wb")
+        self._offset = 0
+
+    def write(self, sample: Dict[str, torch.Tensor], key: Optional[str] = None):
+        self.write_prepared(self.prepare(sample), key)
+
+    def prepare(self, sample: Dict[str, torch.Tensor]) -> List[Tuple[str, torch.Tensor, Dict[str, Any]]]:
+        """The (field, tensor, field info) that `write_prepared` stores for `sample`, quantized.
+        Doesn't touch the writer's state, so several threads can quantize at once and only
+        the appending has to be serialized."""
+        tensors = []
+        for field, tensor in sample.items():
+            if field in self.quantize and tensor.is_floating_point():
+                stored, scale = quantize(tensor, self.quantize[field])
+                info = {"source_dtype": dtype_to_str(tensor.dtype)}
+                if scale is not None:
+                    info["scale_field"] = f"{field}_scale"
+                    tensors.append((f"{field}_scale", scale, {"scale_of": field}))
+                tensors.append((field, stored, info))
+            else:
+                tensors.append((field, tensor, {}))
+        return tensors
+
+    def write_prepared(self, tensors: List[Tuple[str, torch.Tensor, Dict[str, Any]]], key: Optional[str] = None):
+        if self._file is None or self._offset >= self.shard_bytes:
+            self._open_next_shard()
+
+        record = {"key": key, "shard": len(self.shards) - 1}
+        for field, tensor, info in tensors:
+            self._write_tensor(record, field, tensor, info)
+        self.samples.append(record)
+
+    def _write_tensor(self, record: Dict[str, Any], field: str, tensor: torch.Tensor, info: Dict[str, Any]):
+        dtype = dtype_to_str(tensor.dtype)
+        if field not in self.fields:
+            self.fields[field] = {"dtype": dtype, **info}
+        elif self.fields[field]["dtype"] != dtype:
+            raise ValueError(f"Field '{field}' was stored as {self.fields[field]['dtype']}, got {dtype}")
+
+        padding = -self._offset % ALIGNMENT
+        if padding:
+            self._file.write(b"\0" * padding)
+            self._offset += padding
+        data = tensor_to_bytes(tensor)
+        self._file.write(memoryview(data))
+        record[field] = [self._offset, list(tensor.shape)]
+        self._offset += data.nbytes
+
+    def extend(self, store: "FeatureStore", video_keys: Optional[Set[str]] = None):
+        """Take over the samples of another store in the same root (e.g. written by a
+        parallel worker), optionally only those of `video_keys`. No bytes are copied."""
+        for field, info in store.fields.items():
+            if field not in self.fields:
+                self.fields[field] = info
+            elif self.fields[field]["dtype"] != info["dtype"]:
+                raise ValueError(f"Field '{field}' was stored as {self.fields[field]['dtype']}, got {info['dtype']}")
+        for name, value in store.metadata.items():
+            self.metadata.setdefault(name, value)
+        # the next write starts a new shard, so the open one keeps its place in the list
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # a store merged before (a worker that is still running) lists its old shards again
+        positions = {name: shard_id for shard_id, name in enumerate(self.shards)}
+        self.shards = list(self.shards)
+        shard_ids = []
+        for name in store.shards:
+            if name not in positions:
+                positions[name] = len(self.shards)
+                self.shards.append(name)
+            shard_ids.append(positions[name])
+        for sample in store.samples:
+            if video_keys is None or video_of(sample["key"]) in video_keys:
+                self.samples.append({**sample, "shard": shard_ids[sample["shard"]]})
+
+    def retain_videos(self, video_keys: Set[str]):
+        """Drop the index entries of every clip whose video is not in `video_keys`.
+        Their bytes stay in the old shards but are no longer reachable. Stores written
+        without clip keys can't be matched to videos and are refused."""
+        keyless = sum(s["key"] is None for s in self.samples)
+        if keyless:
+            raise ValueError(f"{index_path(self.root, self.split, self.tag)} has {keyless} samples without a clip "
+                             "key (written before encoding runs were resumable), they can't be matched to "
+                             "their videos. Re-encode into an empty directory.")
+        self.samples = [s for s in self.samples if video_of(s["key"]) in video_keys]
+
+    def flush(self):
+        """Write the index for everything written so far. The index is replaced
+        atomically, so readers never see a half-written store."""
+        if self._file is not None:
+            self._file.flush()
+        index = {
+            "format": INDEX_FORMAT_VERSION,
+            "split": self.split,
+            "shards": self.shards,
+            "fields": self.fields,
+            "samples": self.samples,
+            "metadata": self.metadata,
+        }
+        path = index_path(self.root, self.split, self.tag)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FeatureStore:
+    """Read-only, memory-mapped view of one split written by `FeatureStoreWriter`.
+
+    Shards are mapped lazily (after DataLoader workers are forked) and in copy-on-write
+    mode, so the returned tensors share memory with the page cache and are never
+    written back to disk.
+    """
+    def __init__(self, root: str, split: str, tag: Optional[str] = None) -> None:
+        self.root = root
+        self.split = split
+        path = index_path(root, split, tag)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No feature store index found at {path}")
+        with open(path, "r") as f:
+            index = json.load(f)
+        if index["format"] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported feature store format {index['format']} in {path}")
+
+        self.shards: List[str] = index["shards"]
+        self.fields: Dict[str, Dict[str, Any]] = index["fields"]
+        self.samples: List[Dict[str, Any]] = index["samples"]
+        self.metadata: Dict[str, Any] = index["metadata"]
+
+        self._dtypes = {field: str_to_dtype(info["dtype"]) for field, info in self.fields.items()}
+        self._itemsizes = {field: torch.empty((), dtype=dtype).element_size() for field, dtype in self._dtypes.items()}
+        self._mmaps: Dict[int, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def _shard(self, shard_id: int) -> np.memmap:
+        if shard_id not in self._mmaps:
+            path = os.path.join(self.root, self.shards[shard_id])
+            self._mmaps[shard_id] = np.memmap(path, dtype=np.uint8, mode="c")
+        return self._mmaps[shard_id]
+
+    def get_raw_field(self, ind: int, field: str) -> torch.Tensor:
+        """The field as stored, a zero-copy view of the shard."""
+        record = self.samples[ind]
+        offset, shape = record[field]
+        nbytes = int(np.prod(shape, dtype=np.int64)) * self._itemsizes[field]
+        data = self._shard(record["shard"])[offset:offset + nbytes]
+        return torch.from_numpy(data).view(self._dtypes[field]).reshape(shape)
+
+    def get_field(self, ind: int, field: str) -> torch.Tensor:
+        """The field in the dtype it was written with, dequantized if needed."""
+        tensor = self.get_raw_field(ind, field)
+        info = self.fields[field]
+        if "source_dtype" in info:
+            scale = self.get_raw_field(ind, info["scale_field"]) if "scale_field" in info else None
+            tensor = dequantize(tensor, scale, str_to_dtype(info["source_dtype"]))
+        return tensor
+
+    def __getitem__(self, ind: int) -> Dict[str, torch.Tensor]:
+        return {field: self.get_field(ind, field) for field, info in self.fields.items() if "scale_of" not in info}
+
+    def stack_raw_field(self, field: str) -> torch.Tensor:
+        """The field of every sample as stored, copied into one (num_samples, ...) tensor.
+        All samples need the same shape. Samples are read in shard order, so every shard
+        is streamed through once."""
+        shapes = {tuple(record[field][1]) for record in self.samples}
+        if len(shapes) != 1:
+            raise ValueError(f"Field '{field}' has different shapes across samples: {sorted(shapes)[:3]}...")
+        out = torch.empty((len(self.samples), *shapes.pop()), dtype=self._dtypes[field])
+        order = sorted(range(len(self.samples)), key=lambda i: (self.samples[i]["shard"], self.samples[i][field][0]))
+        for i in order:
+            out[i] = self.get_raw_field(i, field)
+        return out
+
+    def keys(self) -> List[Optional[str]]:
+        return [record["key"] for record in self.samples]
+
+    def __getstate__(self):
+        # memmaps are re-opened in each DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state["_mmaps"] = {}
+        return state
+
+
+class FeatureStoreDataset(Dataset):
+    """Map-style dataset over a feature store, returning `(x, y)` per sample.
+
+    Args:
+        root: directory of the feature store
+        split: 'train' or 'val'
+        x_field: name of the field returned as input
+        y_fields: name of the label field, or a list of names to return the label as
+            a dictionary (e.g. ['input_ids', 'attention_mask'] for captioning)
+    """
+    def __init__(self, root: str, split: str, x_field: str = "x", y_fields: str | List[str] = "y") -> None:
+        super().__init__()
+        self.store = FeatureStore(root, split)
+        self.x_field = x_field
+        self.y_fields = y_fields
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, ind: int):
+        x = self.store.get_field(ind, self.x_field)
+        if isinstance(self.y_fields, str):
+            y = self.store.get_field(ind, self.y_fields)
+        else:
+            y = {field: self.store.get_field(ind, field) for field in self.y_fields}
+        return x, y
+
+
+class InMemoryFeatureBatches:
+    """All samples of a split in RAM (or on `device`), iterated as whole batches.
+
+    Every field is one tensor, a batch is a single fancy-index with a slice of a shuffled
+    permutation: no DataLoader workers, no per-sample reads, no collate function.
+    Quantized fields stay quantized in memory and are dequantized per batch.
+    Batches are `(x, y)` like `FeatureStoreDataset`; the number of batches is `len()`.
+    """
+    def __init__(self, root: str, split: str, batch_size: int, shuffle: bool = False, drop_last: bool = False,
+                 x_field: str = "x", y_fields: str | List[str] = "y", device: str = "cpu",
+                 seed: Optional[int] = None) -> None:
+        store = FeatureStore(root, split)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.x_field = x_field
+        self.y_fields = y_fields
+        self.metadata = store.metadata
+        self.num_samples = len(store)
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+
+        fields = [x_field] + ([y_fields] if isinstance(y_fields, str) else list(y_fields))
+        self.tensors: Dict[str, torch.Tensor] = {}
+        self.scales: Dict[str, torch.Tensor] = {}
+        self.source_dtypes: Dict[str, torch.dtype] = {}
+        for field in fields:
+            info = store.fields[field]
+            self.tensors[field] = store.stack_raw_field(field).to(device)
+            if "source_dtype" in info:
+                self.source_dtypes[field] = str_to_dtype(info["source_dtype"])
+                if "scale_field" in info:
+                    self.scales[field] = store.stack_raw_field(info["scale_field"]).to(device)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def _get(self, field: str, indices: torch.Tensor) -> torch.Tensor:
+        tensor = self.tensors[field][indices]
+        if field not in self.source_dtypes:
+            return tensor
+        scale = None
+        if field in self.scales:
+            scale = self.scales[field][indices]
+            # one scale per sample and channel, broadcast over the other dimensions
+            scale = scale.reshape(len(indices), *[1] * (tensor.dim() - 2), scale.shape[-1])
+        return dequantize(tensor, scale, self.source_dtypes[field])
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(self.num_samples, generator=self.generator)
+        else:
+            order = torch.arange(self.num_samples)
+        order = order.to(self.tensors[self.x_field].device)
+        for batch in range(len(self)):
+            indices = order[batch * self.batch_size:(batch + 1) * self.batch_size]
+            x = self._get(self.x_field, indices)
+            if isinstance(self.y_fields, str):
+                y = self._get(self.y_fields, indices)
+            else:
+                y = {field: self._get(field, indices) for field in self.y_fields}
+            yield x, y
@@ -0,0 +1,271 @@
+"""
+Packed frame archives: all frames of one video in a single file, written by
+`pack_frames.py` and read with `ArchiveFrameVideo` in place of `FrameVideo`.
+
+    <archive>  = magic (8 bytes) | header length (uint64, little endian) | json header | data
+
+The header holds the frame file names, the format and per-frame (offset, length) into
+the data section:
+    - 'jpeg': the original JPEG files back to back, decoded exactly like FrameVideo does
+    - 'raw':  decoded frames as one uint8 T x H x W x C array, memory-mapped
+
+Reading a clip is one open plus a seek per frame (jpeg) or a slice of the mmap (raw),
+instead of opening one file per frame.
+
+JPEG frames, archived or not (`ScaledFrameVideo`), can be decoded downscaled in the DCT
+domain (libjpeg scale 1/2, 1/4 or 1/8, through OpenCV's IMREAD_REDUCED modes) to the
+smallest size that still covers `min_size` x `min_size`, e.g. 480p frames at 1/2 for a
+224 crop. The transforms' `Resize` then starts from fewer pixels.
+"""
+import os
+import json
+import math
+import struct
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import torch
+from iopath.common.file_io import g_pathmgr
+from pytorchvideo.data.video import Video
+from pytorchvideo.data.frame_video import FrameVideo
+from pytorchvideo.data.utils import thwc_to_cthw
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MAGIC = b"FRMPACK1"
+ARCHIVE_FORMATS = ["jpeg", "raw"]
+ARCHIVE_SUFFIX = ".frames"
+ALIGNMENT = 64
+
+
+def archive_path(archive_dir: str, frame_paths: List[str]) -> str:
+    """Archive of the video whose frames are `frame_paths` (named after their directory)."""
+    video_name = os.path.basename(os.path.dirname(frame_paths[0]))
+    return os.path.join(archive_dir, video_name + ARCHIVE_SUFFIX)
+
+
+# libjpeg scale denominators and the OpenCV modes decoding at 1 / denominator
+REDUCED_MODES = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+# start of frame markers, they carry the image size
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data: bytes | np.ndarray) -> Optional[tuple]:
+    """(height, width) from the JPEG header, None if it can't be found."""
+    data = bytes(data[:65536]) if isinstance(data, np.ndarray) else data
+    position = 2  # after SOI
+    while position + 9 < len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:  # fill byte
+            position += 1
+            continue
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        if marker in SOF_MARKERS:
+            return struct.unpack(">HH", data[position + 5:position + 9])
+        position += 2 + length
+    return None
+
+
+def reduced_mode(data: bytes | np.ndarray, min_size: Optional[int]) -> int:
+    """The OpenCV mode decoding at the largest scale-down keeping both sides >= min_size."""
+    size = jpeg_size(data) if min_size else None
+    if size is not None:
+        for denominator, mode in REDUCED_MODES:
+            if -(-min(size) // denominator) >= min_size:
+                return mode
+    return cv2.IMREAD_COLOR
+
+
+def decode_jpeg(data: bytes | np.ndarray, min_size: Optional[int] = None) -> np.ndarray:
+    """RGB uint8 H x W x C, decoded like pytorchvideo's `_load_images_with_retries`, or
+    downscaled while decoding to no less than `min_size` on both sides."""
+    img_bgr = cv2.imdecode(np.frombuffer(data, np.uint8), flags=reduced_mode(data, min_size))
+    if img_bgr is None:
+        raise ValueError("Failed to decode JPEG data")
+    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+
+
+def pack_frames(frame_paths: List[str], out_path: str, archive_format: str = "jpeg"):
+    """Write the frames of one video into an archive. The file is replaced atomically."""
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {archive_format}")
+    blobs, shape = [], None
+    for path in frame_paths:
+        with g_pathmgr.open(path, "rb") as f:
+            data = f.read()
+        if archive_format == "raw":
+            frame = decode_jpeg(data)
+            if shape is not None and frame.shape != shape:
+                raise ValueError(f"{path} is {frame.shape}, the previous frames are {shape}")
+            shape = frame.shape
+            data = frame.tobytes()
+        blobs.append(data)
+    write_archive(out_path, archive_format, [os.path.basename(path) for path in frame_paths], blobs, shape)
+
+
+def write_archive(out_path: str, archive_format: str, frame_names: List[str], blobs: List[bytes],
+                  shape: Optional[List[int]] = None, **extra: Any):
+    """Write encoded ('jpeg') or H x W x C uint8 ('raw') frames as an archive, with `extra`
+    entries in the header. The file is replaced atomically."""
+    offsets, position = [], 0
+    for data in blobs:
+        offsets.append([position, len(data)])
+        position += len(data)
+    header = {
+        "format": archive_format,
+        "frame_names": frame_names,
+        "offsets": offsets,
+        "shape": list(shape) if shape is not None else None,
+        **extra,
+    }
+    header_bytes = json.dumps(header).encode()
+    prefix_size = len(ARCHIVE_MAGIC) + 8 + len(header_bytes)
+    header_bytes += b" " * (-prefix_size % ALIGNMENT)  # data starts aligned, for the mmap
+
+    tmp_path = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(ARCHIVE_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for data in blobs:
+            f.write(data)
+    os.replace(tmp_path, out_path)
+
+
+class FrameArchive:
+    """Random access to the frames of one archive."""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a frame archive")
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+        self.header = header
+        self.format: str = header["format"]
+        self.frame_names: List[str] = header["frame_names"]
+        self.offsets: List[List[int]] = header["offsets"]
+        self.shape: Optional[List[int]] = header["shape"]
+        self.data_offset = len(ARCHIVE_MAGIC) + 8 + header_size
+        self._mmap = None
+
+    def __len__(self) -> int:
+        return len(self.frame_names)
+
+    def map(self) -> "FrameArchive":
+        """Memory-map the frames of a raw archive now rather than on the first read. The
+        mapping stays valid if the file is removed afterwards."""
+        if self.format == "raw" and self._mmap is None:
+            self._mmap = np.memmap(self.path, dtype=np.uint8, mode="r", offset=self.data_offset,
+                                   shape=(len(self), *self.shape))
+        return self
+
+    def read_frames(self, indices: List[int], min_size: Optional[int] = None) -> torch.Tensor:
+        """uint8 T x H x W x C, JPEG frames decoded downscaled to `min_size` if given"""
+        if self.format == "raw":
+            return torch.from_numpy(np.ascontiguousarray(self.map()._mmap[indices]))
+        frames = {}  # short clips repeat frames, each is decoded once
+        with open(self.path, "rb") as f:
+            for i in sorted(set(indices)):
+                offset, length = self.offsets[i]
+                f.seek(self.data_offset + offset)
+                frames[i] = decode_jpeg(f.read(length), min_size)
+        return torch.as_tensor(np.stack([frames[i] for i in indices]))
+
+
+class ArchiveFrameVideo(Video):
+    """Drop-in replacement for `FrameVideo` that reads from a frame archive.
+    Clips are identical to those of `FrameVideo.from_frame_paths` on the packed frames."""
+    def __init__(self, archive: FrameArchive, fps: float = 30.0, min_size: Optional[int] = None) -> None:
+        self._archive = archive
+        self._fps = fps
+        self._min_size = min_size
+        self._duration = len(archive) / fps
+        self._name = os.path.basename(archive.path)[:-len(ARCHIVE_SUFFIX)]
+
+    @classmethod
+    def from_archive(cls, path: str, fps: float = 30.0, frame_paths: Optional[List[str]] = None,
+                     min_size: Optional[int] = None):
+        """Open an archive, checking that it holds exactly `frame_paths` if given."""
+        archive = FrameArchive(path)
+        if frame_paths is not None and archive.frame_names != [os.path.basename(p) for p in frame_paths]:
+            raise ValueError(f"{path} holds other frames than the annotation lists, re-run pack_frames.py")
+        return cls(archive, fps, min_size)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def duration(self) -> float:
+        return self._duration
+
+    def get_clip(self, start_sec: float, end_sec: float,
+                 frame_filter: Optional[Callable[[List[int]], List[int]]] = None) -> Optional[Dict[str, Any]]:
+        """Same frame selection and output as `FrameVideo.get_clip`."""
+        if start_sec < 0 or start_sec > self._duration:
+            logger.warning(f"No frames found within {start_sec} and {end_sec} seconds. Video starts"
+                           f"at time 0 and ends at {self._duration}.")
+            return None
+
+        frame_indices = clip_frame_indices(self._fps, self._duration, len(self._archive), start_sec, end_sec, frame_filter)
+        clip_frames = self._archive.read_frames(frame_indices, self._min_size)
+        clip_frames = thwc_to_cthw(clip_frames).to(torch.float32)
+        return {"video": clip_frames, "frame_indices": frame_indices, "audio": None}
+
+    def close(self):
+        self._archive._mmap = None
+
+
+def clip_frame_indices(fps: float, duration: float, num_frames: int, start_sec: float, end_sec: float,
+                       frame_filter: Optional[Callable[[List[int]], List[int]]] = None) -> List[int]:
+    """The frames `FrameVideo.get_clip` reads for [start_sec, end_sec)."""
+    end_sec = min(end_sec, duration)
+    start_frame_index = math.ceil(fps * start_sec)
+    end_frame_index = min(math.ceil(fps * end_sec), num_frames)
+    frame_indices = list(range(start_frame_index, end_frame_index))
+    if frame_filter:
+        frame_indices = frame_filter(frame_indices)
+    return frame_indices
+
+
+class ScaledFrameVideo(FrameVideo):
+    """`FrameVideo` of JPEG files decoded downscaled to at least `min_size` x `min_size`."""
+    def __init__(self, video_frame_paths: List[str], fps: float, min_size: int) -> None:
+        super().__init__(len(video_frame_paths) / fps, fps, video_frame_paths=video_frame_paths)
+        self._min_size = min_size
+
+    def get_clip(self, start_sec: float, end_sec: float,
+                 frame_filter: Optional[Callable[[List[int]], List[int]]] = None) -> Optional[Dict[str, Any]]:
+        """Same frame selection and output as `FrameVideo.get_clip`, at the reduced size."""
+        if start_sec < 0 or start_sec > self._duration:
+            logger.warning(f"No frames found within {start_sec} and {end_sec} seconds. Video starts"
+                           f"at time 0 and ends at {self._duration}.")
+            return None
+
+        frame_indices = clip_frame_indices(self._fps, self._duration, len(self._video_frame_paths),
+                                           start_sec, end_sec, frame_filter)
+        frames = {}  # short clips repeat frames, each is decoded once
+        for i in sorted(set(frame_indices)):
+            with g_pathmgr.open(self._video_frame_to_path(i), "rb") as f:
+                frames[i] = decode_jpeg(f.read(), self._min_size)
+        clip_frames = torch.as_tensor(np.stack([frames[i] for i in frame_indices]))
+        clip_frames = thwc_to_cthw(clip_frames).to(torch.float32)
+        return {"video": clip_frames, "frame_indices": frame_indices, "audio": None}
+
+
+def open_frame_video(frame_paths: List[str], fps: float, archive_dir: Optional[str] = None,
+                     min_size: Optional[int] = None) -> Video:
+    """`ArchiveFrameVideo` if `archive_dir` has an archive of the video, else `FrameVideo`.
+    With `min_size`, JPEG frames are decoded downscaled to no less than min_size x min_size."""
+    if archive_dir:
+        path = archive_path(archive_dir, frame_paths)
+        if os.path.exists(path):
+            return ArchiveFrameVideo.from_archive(path, fps=fps, frame_paths=frame_paths, min_size=min_size)
+    if min_size:
+        return ScaledFrameVideo(frame_paths, fps, min_size)
+    return FrameVideo.from_frame_paths(frame_paths, fps=fps)
@@ -0,0 +1,179 @@
+"""
+Decoded-frame pool shared by all DataLoader workers (and runs).
+
+Random clip sampling decodes the same videos again every epoch. With DATA.FRAME_POOL_GB
+set, a video is decoded once, resized to DATA.IMG_SIZE and kept as uint8 in shared memory
+(a directory on tmpfs, /dev/shm by default), one raw frame archive per video:
+
+    <root>/<sha1 of (video path, mtime, fps, size)>.frames
+
+Later epochs, and every worker, map the archive instead of decoding (`ArchiveFrameVideo`).
+Resizing before the transforms is what their `Resize` does, up to the rounding to uint8.
+When the pool outgrows its budget the least recently used videos are removed. Hit / miss
+counters are shared by the workers, `FramePool.stats()` reports them for sizing the budget.
+"""
+import os
+import hashlib
+import multiprocessing
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from fvcore.common.config import CfgNode
+from pytorchvideo.data.video import Video, VideoPathHandler
+
+from .frame_archive import ARCHIVE_SUFFIX, ArchiveFrameVideo, FrameArchive, write_archive
+
+DEFAULT_FRAME_POOL_DIR = "/dev/shm/video_frame_pool"
+HITS, MISSES, EVICTIONS, POOL_BYTES = range(4)
+
+
+def get_frame_pool(config: CfgNode) -> Optional["FramePool"]:
+    """The pool of DATA.FRAME_POOL_GB (None if unset or 0) in DATA.FRAME_POOL_DIR."""
+    budget_gb = config.DATA.get("FRAME_POOL_GB", 0)
+    if not budget_gb:
+        return None
+    return FramePool(config.DATA.get("FRAME_POOL_DIR", DEFAULT_FRAME_POOL_DIR),
+                     int(budget_gb * 2**30), config.DATA.IMG_SIZE)
+
+
+class FramePool:
+    """Least recently used decoded videos, up to `budget_bytes`.
+
+    Args:
+        root: directory of the pool, should be on tmpfs (/dev/shm) to be memory
+        budget_bytes: size limit of all archives of the pool
+        size: frames are stored resized to size x size
+    """
+    def __init__(self, root: str, budget_bytes: int, size: int) -> None:
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.size = size
+        os.makedirs(root, exist_ok=True)
+        # created before the workers start, so they are inherited by all of them
+        self._lock = multiprocessing.Lock()
+        self._counters = multiprocessing.RawArray("q", 4)
+        self._counters[POOL_BYTES] = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        with os.scandir(self.root) as entries:
+            return [entry for entry in entries if entry.name.endswith(ARCHIVE_SUFFIX)]
+
+    def entry_path(self, video_path: str, fps: Optional[float]) -> str:
+        """Archive of a video, `fps` None for the native frame rate of an encoded video."""
+        try:
+            mtime = os.stat(video_path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        key = repr((os.path.abspath(video_path), mtime, fps, self.size))
+        return os.path.join(self.root, hashlib.sha1(key.encode()).hexdigest() + ARCHIVE_SUFFIX)
+
+    def _count(self, counter: int, value: int = 1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def get(self, video_path: str, fps: Optional[float]) -> Optional[ArchiveFrameVideo]:
+        path = self.entry_path(video_path, fps)
+        try:
+            # mapped right away, so an eviction by another worker can't pull the file away
+            # before the first read
+            archive = FrameArchive(path).map()
+        except (OSError, ValueError):  # not pooled, or evicted meanwhile
+            self._count(MISSES)
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except OSError:  # evicted since, the mapping stays valid
+            pass
+        self._count(HITS)
+        return ArchiveFrameVideo(archive, fps=archive.header["fps"])
+
+    def put(self, video_path: str, fps: Optional[float], video: Video) -> ArchiveFrameVideo:
+        """Decode all frames of `video` into the pool, returns the pooled video.
+        `fps` None takes the native frame rate from the number of decoded frames."""
+        clip = video.get_clip(0, video.duration)
+        frames = TF.resize(clip["video"], [self.size, self.size])  # C x T x H x W, as the transforms do
+        frames = frames.round().clamp(0, 255).to(torch.uint8).permute(1, 2, 3, 0).contiguous().numpy()
+        frame_fps = fps if fps is not None else len(frames) / float(video.duration)
+
+        path = self.entry_path(video_path, fps)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        write_archive(tmp_path, "raw", [f"{i:06d}" for i in range(len(frames))],
+                      [frame.tobytes() for frame in frames], frames.shape[1:], fps=frame_fps)
+        nbytes = os.path.getsize(tmp_path)
+        with self._lock:
+            if nbytes > self.budget_bytes or os.path.exists(path):  # too large, or pooled meanwhile
+                os.remove(tmp_path)
+            else:
+                self._evict(self.budget_bytes - nbytes)
+                os.replace(tmp_path, path)
+                self._counters[POOL_BYTES] += nbytes
+        # the decoded frames are at hand, this worker doesn't read them back
+        return ArchiveFrameVideo(_InMemoryArchive(frames, path), fps=frame_fps)
+
+    def _evict(self, max_bytes: int):
+        """Remove the least recently used archives until the pool holds at most `max_bytes`.
+        Called with the lock held. Workers reading a removed archive keep their mapping."""
+        if self._counters[POOL_BYTES] <= max_bytes:
+            return
+        entries = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in self._entries()))
+        self._counters[POOL_BYTES] = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._counters[POOL_BYTES] <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._counters[POOL_BYTES] -= size
+            self._counters[EVICTIONS] += 1
+
+    def open_video(self, video_path: str, fps: Optional[float], open_fn: Callable[[], Video]) -> Video:
+        """The pooled video if present, else `open_fn()` decoded into the pool."""
+        video = self.get(video_path, fps)
+        if video is None:
+            source = open_fn()
+            video = self.put(video_path, fps, source)
+            source.close()
+        return video
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits, misses, evictions, pool_bytes = self._counters[:]
+        return {"hits": hits, "misses": misses, "hit_rate": hits / max(hits + misses, 1),
+                "evictions": evictions, "pool_gb": pool_bytes / 2**30,
+                "budget_gb": self.budget_bytes / 2**30}
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries():
+                os.remove(entry.path)
+            self._counters[:] = [0] * len(self._counters)
+
+
+class _InMemoryArchive:
+    """`FrameArchive` stand-in over frames already in memory."""
+    def __init__(self, frames: np.ndarray, path: str) -> None:
+        self.frames = frames
+        self.path = path
+        self._mmap = None
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def read_frames(self, indices, min_size=None) -> torch.Tensor:
+        return torch.from_numpy(self.frames[indices])
+
+
+class PooledVideoPathHandler(VideoPathHandler):
+    """`VideoPathHandler` of `LabeledVideoDataset` (UCF101, HMDB51) reading through a pool."""
+    def __init__(self, frame_pool: FramePool) -> None:
+        super().__init__()
+        self.frame_pool = frame_pool
+
+    def video_from_path(self, filepath, decode_audio=False, decoder="pyav", fps=30):
+        is_file = os.path.isfile(filepath)
+        return self.frame_pool.open_video(
+            filepath, None if is_file else fps,
+            lambda: super(PooledVideoPathHandler, self).video_from_path(filepath, decode_audio, decoder, fps))
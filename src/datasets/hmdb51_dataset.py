@@ -16,6 +16,10 @@ from pytorchvideo.data.clip_sampling import ClipSampler
 from pytorchvideo.data.labeled_video_dataset import LabeledVideoDataset
 
 from .dataset_abstract import DatasetAbstract
+from .labeled_videos import RestrictableLabeledVideoDataset
+from .frame_pool import PooledVideoPathHandler, get_frame_pool
+from .proxy_videos import ProxyMap, get_proxy_map
+from .video_manifest import ScanResult, VideoManifest, load_video_manifest, manifest_dir_for
 from .transformations import get_train_transforms, get_val_transforms
 
 logger = logging.getLogger(__name__)
@@ -92,15 +96,51 @@ class Hmdb51LabeledVideoPaths:
             return RuntimeError(
                 f"{split_id} not found in allowed split id's {cls._allowed_splits}."
             )
+        return cls.from_csvs(cls.split_files(data_path, split_id), split_type)
+
+    @staticmethod
+    def split_files(data_path: pathlib.Path, split_id: int = 1) -> List[pathlib.Path]:
+        """The class_x_test_split<split_id>.txt files of the splits/folds directory."""
         file_name_format = "_test_split" + str(int(split_id))
-        file_paths = sorted(
+        return sorted(
             (
                 f
-                for f in data_path.iterdir()
+                for f in pathlib.Path(data_path).iterdir()
                 if f.is_file() and f.suffix == ".txt" and file_name_format in f.stem
             )
         )
-        return cls.from_csvs(file_paths, split_type)
+
+    @classmethod
+    def scan(
+        cls, data_path: str, video_path_prefix: str = "", split_id: int = 1, split_type: str = "train"
+    ) -> ScanResult:
+        """
+        The videos of a fold for `load_video_manifest`: full video paths with their labels,
+        the label names and the split files that were read.
+        """
+        file_paths = cls.split_files(data_path, split_id)
+        labeled_video_paths = cls.from_csvs(file_paths, split_type)
+        videos = [(os.path.join(str(video_path_prefix), path), info["label"])
+                  for path, info in labeled_video_paths._paths_and_labels]
+        label_names = [ID2LABEL[i] for i in range(len(ID2LABEL))]
+        return videos, label_names, [str(data_path)] + [str(f) for f in file_paths]
+
+    @classmethod
+    def from_manifest(cls, manifest: VideoManifest, proxy_map: Optional[ProxyMap] = None) -> Hmdb51LabeledVideoPaths:
+        """
+        Factory function that creates Hmdb51LabeledVideoPaths object from a video manifest
+        of `scan`, without reading the split files. Videos with a proxy in `proxy_map`
+        are read from it.
+        """
+        video_paths_and_label = []
+        for path, label in manifest.paths_and_labels():
+            meta_tags = os.path.basename(path).split("_")[-6:-1]
+            if proxy_map is not None:
+                path = proxy_map.resolve(path)
+            video_paths_and_label.append(
+                (path, {"label": label, "label_str": ID2LABEL[label], "meta_tags": meta_tags})
+            )
+        return cls(video_paths_and_label)
 
     @classmethod
     def from_csvs(
@@ -190,6 +230,8 @@ def Hmdb51(
     split_type: str = "train",
     decode_audio=True,
     decoder: str = "pyav",
+    manifest_dir: Optional[str] = None,
+    proxy_map: Optional[ProxyMap] = None,
 ) -> LabeledVideoDataset:
     """
     A helper function to create ``LabeledVideoDataset`` object for HMDB51 dataset
@@ -225,15 +267,28 @@ def Hmdb51(
             "unused")
 
         decoder (str): Defines which backend should be used to decode videos.
+
+        manifest_dir (str): Where the video manifest of the fold is kept (see
+            video_manifest.py). The split files are only parsed when it is missing or stale.
+
+        proxy_map (ProxyMap): Low-resolution proxies read instead of the videos (see
+            proxy_videos.py), needs `manifest_dir`.
     """
 
     torch._C._log_api_usage_once("PYTORCHVIDEO.dataset.Hmdb51")
 
-    labeled_video_paths = Hmdb51LabeledVideoPaths.from_dir(
-        data_path, split_id=split_id, split_type=split_type
-    )
-    labeled_video_paths.path_prefix = video_path_prefix
-    dataset = LabeledVideoDataset(
+    if manifest_dir is not None:
+        manifest = load_video_manifest(
+            manifest_dir,
+            lambda: Hmdb51LabeledVideoPaths.scan(data_path, video_path_prefix, split_id, split_type),
+        )
+        labeled_video_paths = Hmdb51LabeledVideoPaths.from_manifest(manifest, proxy_map)
+    else:
+        labeled_video_paths = Hmdb51LabeledVideoPaths.from_dir(
+            data_path, split_id=split_id, split_type=split_type
+        )
+        labeled_video_paths.path_prefix = video_path_prefix
+    dataset = RestrictableLabeledVideoDataset(
         labeled_video_paths,
         clip_sampler,
         video_sampler,
@@ -252,10 +307,13 @@ class HMDB51Dataset(DatasetAbstract):
         self.fold_split_paths = self.dataset_root_path / "testTrainMulti_7030_splits"
         self.videos_path = self.dataset_root_path / "HMDB51_videos"
         self.fold = config.DATA.FOLD
+        self.manifest_root = config.DATA.get("MANIFEST_DIR", None)
         self.label2id = LABEL2ID
         self.id2label = ID2LABEL
 
         self.clip_duration = config.DATA.CLIP_DURATION
+        self.frame_pool = get_frame_pool(config)
+        self.proxy_map = get_proxy_map(config)
 
         self.train_transforms = get_train_transforms(config)
         self.val_transforms = get_val_transforms(config)
@@ -270,8 +328,12 @@ class HMDB51Dataset(DatasetAbstract):
             split_type="train",
             decode_audio=False,
             transform=self.train_transforms,
-            decoder='decord'
+            decoder='decord',
+            manifest_dir=self.get_manifest_dir("train"),
+            proxy_map=self.proxy_map,
         )
+        if self.frame_pool is not None:
+            train_dataset.video_path_handler = PooledVideoPathHandler(self.frame_pool)
         return train_dataset
 
     def get_val_dataset(self) -> Dataset:
@@ -283,9 +345,22 @@ class HMDB51Dataset(DatasetAbstract):
             split_type="test",
             decode_audio=False,
             transform=self.val_transforms,
-            decoder='decord'
+            decoder='decord',
+            manifest_dir=self.get_manifest_dir("test"),
+            proxy_map=self.proxy_map,
         )   
+        if self.frame_pool is not None:
+            val_dataset.video_path_handler = PooledVideoPathHandler(self.frame_pool)
         return val_dataset
 
+    def get_manifest_dir(self, split_type: str) -> str:
+        return manifest_dir_for(self.dataset_root_path, f"hmdb51_fold{self.fold}_{split_type}", self.manifest_root)
+
+    def get_video_manifest(self, split_type: str) -> VideoManifest:
+        return load_video_manifest(
+            self.get_manifest_dir(split_type),
+            lambda: Hmdb51LabeledVideoPaths.scan(self.fold_split_paths, self.videos_path, self.fold, split_type),
+        )
+
     def get_id2label(self) -> Dict:
         return self.id2label
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Label statistics of a classification feature store, accumulated while it is written.
+
+`create_encoding.py` updates a `LabelStats` with the labels of every stored clip and keeps
+it in the store metadata under 'label_stats', so class weights never need another pass
+over the data:
+
+    counts        positives per class
+    cooccurrence  clips where both class i and class j are positive
+    num_samples   clips seen
+"""
+from typing import Any, Dict, Optional, Set
+
+import torch
+
+from .feature_store import FeatureStore, video_of
+
+METADATA_KEY = "label_stats"
+
+
+class LabelStats:
+    def __init__(self, num_classes: int) -> None:
+        self.num_classes = num_classes
+        self.num_samples = 0
+        self.counts = torch.zeros(num_classes, dtype=torch.float64)
+        self.cooccurrence = torch.zeros(num_classes, num_classes, dtype=torch.float64)
+
+    def update(self, labels: torch.Tensor, weight: int = 1):
+        """Add a batch of labels, (batch, num_classes) multi-hot or (batch,) class indices.
+        `weight=-1` removes clips that were dropped from the store again."""
+        if labels.dim() == 1:
+            labels = torch.nn.functional.one_hot(labels.long(), self.num_classes)
+        labels = labels.to(torch.float64)
+        self.num_samples += weight * labels.shape[0]
+        self.counts += weight * labels.sum(dim=0)
+        self.cooccurrence += weight * (labels.T @ labels)
+
+    def merge(self, other: "LabelStats"):
+        self.num_samples += other.num_samples
+        self.counts += other.counts
+        self.cooccurrence += other.cooccurrence
+
+    def frequencies(self) -> torch.Tensor:
+        """Fraction of clips in which each class is positive."""
+        return self.counts / max(self.num_samples, 1)
+
+    def pos_weight(self) -> torch.Tensor:
+        """negatives / positives per class, the `pos_weight` of `BCEWithLogitsLoss`.
+        Classes without positives get 1."""
+        negatives = self.num_samples - self.counts
+        weight = torch.where(self.counts > 0, negatives / self.counts.clamp(min=1), torch.ones_like(self.counts))
+        return weight.float()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "num_classes": self.num_classes,
+            "num_samples": self.num_samples,
+            "counts": self.counts.long().tolist(),
+            "cooccurrence": self.cooccurrence.long().tolist(),
+            "frequencies": self.frequencies().tolist(),
+            "pos_weight": self.pos_weight().tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LabelStats":
+        stats = cls(data["num_classes"])
+        stats.num_samples = data["num_samples"]
+        stats.counts = torch.tensor(data["counts"], dtype=torch.float64)
+        stats.cooccurrence = torch.tensor(data["cooccurrence"], dtype=torch.float64)
+        return stats
+
+    @classmethod
+    def from_metadata(cls, metadata: Dict[str, Any], num_classes: int) -> "LabelStats":
+        """The stats kept in a store's metadata, empty ones if there are none yet."""
+        if METADATA_KEY in metadata:
+            return cls.from_dict(metadata[METADATA_KEY])
+        return cls(num_classes)
+
+
+def read_label_stats(root: str, split: str = "train") -> Optional[LabelStats]:
+    """Label stats of a stored split, None if the store has none."""
+    metadata = FeatureStore(root, split).metadata
+    return LabelStats.from_dict(metadata[METADATA_KEY]) if METADATA_KEY in metadata else None
+
+
+def retain_label_stats(store: FeatureStore, video_keys: Set[str], num_classes: int) -> LabelStats:
+    """Label stats of the clips of `video_keys` in `store`. Starts from the stored stats and
+    only reads the labels of the clips that are dropped; stores without stats are counted once."""
+    kept = {i for i, record in enumerate(store.samples)
+            if record["key"] is not None and video_of(record["key"]) in video_keys}
+    if METADATA_KEY in store.metadata:
+        stats, indices, weight = LabelStats.from_dict(store.metadata[METADATA_KEY]), set(range(len(store))) - kept, -1
+    else:
+        stats, indices, weight = LabelStats(num_classes), kept, 1
+    if indices:
+        stats.update(torch.stack([store.get_field(i, "y") for i in sorted(indices)]), weight)
+    return stats
@@ -0,0 +1,14 @@
+from pytorchvideo.data.labeled_video_dataset import LabeledVideoDataset
+
+
+class RestrictableLabeledVideoDataset(LabeledVideoDataset):
+    """`LabeledVideoDataset` (UCF101, HMDB51) that can be limited to some of its videos,
+    e.g. the work unit `create_encoding.py` is encoding."""
+    def restrict_to_videos(self, video_indices) -> None:
+        """Yield only the clips of these videos, in this order. The videos are still
+        split across DataLoader workers by `MultiProcessSampler`."""
+        self._video_sampler = list(video_indices)
+        self._video_sampler_iter = None
+        self._loaded_video_label = None
+        self._loaded_clip = None
+        self._next_clip_start_time = 0.0
@@ -0,0 +1,70 @@
+"""
+Low-resolution proxies of encoded videos, written by `make_proxies.py`:
+
+    <proxy_dir>/proxy_manifest.json     short side, fps and {source path: {"proxy", "mtime_ns"}}
+    <proxy_dir>/<source path relative to the sources' common root>.mp4
+
+The transforms resize every frame to DATA.IMG_SIZE anyway, decoding a short-side-256
+proxy at the training FPS costs a fraction of the original. With DATA.PROXY_DIR set,
+`ProxyMap.resolve` swaps a video path for its proxy; videos without one, or changed
+since they were transcoded (mtime), are read from the original.
+"""
+import os
+import json
+from typing import Dict, Optional
+
+from fvcore.common.config import CfgNode
+
+PROXY_MANIFEST_NAME = "proxy_manifest.json"
+
+
+def get_proxy_map(config: CfgNode) -> Optional["ProxyMap"]:
+    """The proxies of DATA.PROXY_DIR, None if unset."""
+    proxy_dir = config.DATA.get("PROXY_DIR", None)
+    return ProxyMap(proxy_dir) if proxy_dir else None
+
+
+def proxy_key(path: str) -> str:
+    """Manifest key of a source video, its absolute path."""
+    return os.path.abspath(path)
+
+
+def read_proxy_manifest(proxy_dir: str) -> Dict:
+    try:
+        with open(os.path.join(proxy_dir, PROXY_MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"short_side": None, "fps": None, "videos": {}}
+
+
+def write_proxy_manifest(proxy_dir: str, manifest: Dict):
+    path = os.path.join(proxy_dir, PROXY_MANIFEST_NAME)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+class ProxyMap:
+    """Source video path -> proxy path, for the proxies of `proxy_dir`."""
+    def __init__(self, proxy_dir: str) -> None:
+        self.proxy_dir = proxy_dir
+        manifest = read_proxy_manifest(proxy_dir)
+        self.short_side: Optional[int] = manifest["short_side"]
+        self.fps: Optional[float] = manifest["fps"]
+        self.videos: Dict[str, Dict] = manifest["videos"]
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def resolve(self, path: str) -> str:
+        """The proxy of `path` if it has an up-to-date one, else `path`."""
+        entry = self.videos.get(proxy_key(path))
+        if entry is None:
+            return path
+        try:
+            if os.stat(path).st_mtime_ns != entry["mtime_ns"]:
+                return path
+        except OSError:  # only the proxy is left
+            pass
+        return os.path.join(self.proxy_dir, entry["proxy"])
@@ -0,0 +1,194 @@
+"""
+Decode only the frames that `UniformTemporalSubsample` keeps.
+
+The transforms subsample every clip to a fixed number of frames with
+`linspace(0, t - 1, n)`. Knowing t before decoding, the same indices can be picked
+first and only those frames read:
+    - frame directories / archives: `uniform_frame_filter` as the `frame_filter` of
+      `FrameVideo.get_clip`, so only the kept JPEGs are opened and decoded,
+    - mp4: `SampledEncodedVideo`, a stand-in for `EncodedVideo` that counts the frames
+      of a clip from the packet timestamps (no decoding) and only converts the kept
+      frames to RGB.
+
+UniformTemporalSubsample(n) on the resulting n-frame clip is the identity, so the
+transformed clips are the same as before.
+
+For evaluation over overlapping windows, `sliding_window_clips` decodes the video once
+from the first to the last window (`SampledEncodedVideo.iter_clips`) instead of once per
+window, keeping only the kept frames of the windows still open in a buffer.
+"""
+import math
+import bisect
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import av
+import numpy as np
+import torch
+from pytorchvideo.data.utils import thwc_to_cthw, secs_to_pts, pts_to_secs
+
+
+def uniform_indices(num_frames: int, num_samples: int) -> List[int]:
+    """The positions `pytorchvideo.transforms.UniformTemporalSubsample` keeps."""
+    indices = torch.linspace(0, num_frames - 1, num_samples)
+    return torch.clamp(indices, 0, num_frames - 1).long().tolist()
+
+
+def uniform_frame_filter(num_samples: int) -> Optional[Callable[[List[int]], List[int]]]:
+    """`frame_filter` for `FrameVideo.get_clip` keeping the frames the transforms would keep.
+    None for a single frame: the first and last frame index of a clip must stay, the
+    Charades datasets derive the clip labels from them."""
+    if num_samples < 2:
+        return None
+    def frame_filter(frame_indices: List[int]) -> List[int]:
+        return [frame_indices[i] for i in uniform_indices(len(frame_indices), num_samples)]
+    return frame_filter
+
+
+class SampledEncodedVideo:
+    """The video stream of an mp4 with `EncodedVideo`'s `duration` and `get_clip`, but clips
+    come back with `num_samples` frames, uniformly sampled like the transforms do.
+
+    Clip boundaries follow `EncodedVideoPyAV`: frames with start <= pts < end, with
+    both bounds rounded up to the stream time base.
+    """
+    def __init__(self, path: str, num_samples: int) -> None:
+        self.path = path
+        self.num_samples = num_samples
+        self._container = av.open(path)
+        stream = self._container.streams.video[0]
+        self._time_base = stream.time_base
+        self._start_pts = stream.start_time if stream.start_time is not None else 0
+        duration = stream.duration
+        if duration is None:
+            duration = max(self._packet_pts(0, math.inf), default=self._start_pts)
+        self._duration = pts_to_secs(duration, self._time_base, self._start_pts)
+
+    @classmethod
+    def from_path(cls, path: str, num_samples: int):
+        return cls(path, num_samples)
+
+    @property
+    def duration(self) -> float:
+        return self._duration
+
+    def _seek(self, pts: int):
+        stream = self._container.streams.video[0]
+        self._container.seek(int(max(pts, 0)), any_frame=False, backward=True, stream=stream)
+
+    def _packet_pts(self, start_pts: int, end_pts: float) -> List[int]:
+        """Presentation timestamps of the frames in [start_pts, end_pts), from the packets only."""
+        stream = self._container.streams.video[0]
+        self._seek(start_pts)
+        pts = []
+        for packet in self._container.demux(stream):
+            if packet.dts is not None and packet.dts >= end_pts:
+                break  # dts <= pts, nothing later can fall into the clip
+            if packet.pts is not None and start_pts <= packet.pts < end_pts:
+                pts.append(packet.pts)
+        return sorted(pts)
+
+    def get_clip(self, start_sec: float, end_sec: float) -> Dict[str, Any]:
+        start_pts = secs_to_pts(start_sec, self._time_base, self._start_pts, round_mode="ceil")
+        end_pts = secs_to_pts(end_sec, self._time_base, self._start_pts, round_mode="ceil")
+        clip_pts = self._packet_pts(start_pts, end_pts)
+        if not clip_pts:
+            return {"video": None, "audio": None}
+        keep = [clip_pts[i] for i in uniform_indices(len(clip_pts), self.num_samples)]
+
+        # decoding can't skip frames (they reference each other), the RGB conversion can
+        wanted, frames = set(keep), {}
+        self._seek(start_pts)
+        for frame in self._container.decode(video=0):
+            if frame.pts is None:
+                continue
+            if frame.pts >= end_pts:  # frames come out in presentation order
+                break
+            if frame.pts in wanted:
+                frames[frame.pts] = torch.from_numpy(frame.to_rgb().to_ndarray())
+                if len(frames) == len(wanted):
+                    break
+        if len(frames) != len(wanted):
+            raise RuntimeError(f"{self.path}: could not decode {len(wanted) - len(frames)} frames "
+                               f"between {start_sec}s and {end_sec}s")
+        video = torch.stack([frames[pts] for pts in keep])
+        return {"video": thwc_to_cthw(video).to(torch.float32), "audio": None}
+
+    def iter_clips(self, windows: Sequence[Tuple[float, float]]) -> Iterator[Dict[str, Any]]:
+        """`get_clip` of every (start_sec, end_sec) window, in order, from one decoding pass.
+        Windows must come by increasing start and end, they may overlap."""
+        if not windows:
+            return
+        bounds = [(secs_to_pts(start, self._time_base, self._start_pts, round_mode="ceil"),
+                   secs_to_pts(end, self._time_base, self._start_pts, round_mode="ceil"))
+                  for start, end in windows]
+        video_pts = self._packet_pts(bounds[0][0], bounds[-1][1])
+        keeps = []  # the pts every window keeps, None for windows without frames
+        for start_pts, end_pts in bounds:
+            clip_pts = video_pts[bisect.bisect_left(video_pts, start_pts):bisect.bisect_left(video_pts, end_pts)]
+            keeps.append([clip_pts[i] for i in uniform_indices(len(clip_pts), self.num_samples)]
+                         if clip_pts else None)
+        wanted = set(pts for keep in keeps if keep for pts in keep)
+
+        frames = {}  # kept frames of the open windows, in presentation order
+        next_window = 0
+
+        def finished_windows(decoded_pts: float):
+            nonlocal next_window
+            while next_window < len(keeps) and (keeps[next_window] is None or keeps[next_window][-1] <= decoded_pts):
+                keep = keeps[next_window]
+                next_window += 1
+                if keep is None:
+                    yield {"video": None, "audio": None}
+                    continue
+                video = torch.stack([frames[pts] for pts in keep])
+                yield {"video": thwc_to_cthw(video).to(torch.float32), "audio": None}
+                # windows start later and later, frames before the next one are done
+                first_open = next((k[0] for k in keeps[next_window:] if k), math.inf)
+                for pts in [pts for pts in frames if pts < first_open]:
+                    del frames[pts]
+
+        self._seek(bounds[0][0])
+        for frame in self._container.decode(video=0):
+            if frame.pts is None:
+                continue
+            if frame.pts in wanted:
+                frames[frame.pts] = torch.from_numpy(frame.to_rgb().to_ndarray())
+            yield from finished_windows(frame.pts)
+            if next_window == len(keeps) or frame.pts >= bounds[-1][1]:
+                break
+        missing = [pts for keep in keeps[next_window:] if keep for pts in keep if pts not in frames]
+        if missing:
+            raise RuntimeError(f"{self.path}: could not decode {len(missing)} frames "
+                               f"between {windows[next_window][0]}s and {windows[-1][1]}s")
+        # pts beyond the last decoded frame don't exist, only frameless windows can be left
+        yield from finished_windows(math.inf)
+
+    def close(self):
+        self._container.close()
+
+
+def sliding_windows(duration: float, clip_duration: float, stride: Optional[float] = None) -> List[Tuple[float, float]]:
+    """(start_sec, end_sec) of clips of `clip_duration` every `stride` seconds (clip_duration if None),
+    the last ones cut at the end of the video."""
+    stride = stride if stride is not None else clip_duration
+    return [(start, min(start + clip_duration, duration)) for start in np.arange(0, duration, stride)]
+
+
+def sliding_window_clips(video, clip_duration: float, stride: Optional[float] = None,
+                         transform: Optional[Callable[[dict], dict]] = None) -> torch.Tensor:
+    """All `sliding_windows` clips of a video, transformed, as one (B, C, T, H, W) tensor.
+    Windows without frames are skipped. A `SampledEncodedVideo` is decoded once for all
+    windows, other videos clip by clip."""
+    windows = sliding_windows(float(video.duration), clip_duration, stride)
+    if isinstance(video, SampledEncodedVideo):
+        clips = video.iter_clips(windows)
+    else:
+        clips = (video.get_clip(start_sec=start, end_sec=end) for start, end in windows)
+    clip_tensors = []
+    for clip_data in clips:
+        if clip_data["video"] is None:
+            continue
+        if transform is not None:
+            clip_data = transform(clip_data)
+        clip_tensors.append(clip_data["video"])  # (C, T, H, W)
+    return torch.stack(clip_tensors)
@@ -1,5 +1,7 @@
 import os
 
+import torch
+from torch import nn
 from fvcore.common.config import CfgNode
 
 from pytorchvideo.transforms import (
@@ -19,7 +21,65 @@ from torchvision.transforms import (
     Resize,
 )
 
+def get_num_sampled_frames(config: CfgNode) -> int:
+    """Frames per clip after UniformTemporalSubsample."""
+    if config.MODEL.TYPE == "captioning":
+        return config.DATA.NUM_SAMPLED_FRAMES_MULT * config.DATA.NUM_SAMPLED_FRAMES
+    return config.DATA.NUM_SAMPLED_FRAMES
+
+def uses_uint8_clips(config: CfgNode) -> bool:
+    """DATA.UINT8_CLIPS: workers only subsample and resize, clips stay uint8 until
+    `BatchTransform` normalizes (and flips) whole batches on the device."""
+    return bool(config.DATA.get("UINT8_CLIPS", False))
+
+def get_decode_size(config: CfgNode):
+    """DATA.SCALED_DECODING: JPEG frames are decoded downscaled (in the DCT domain) to no
+    less than IMG_SIZE on both sides, the size `Resize` needs. None decodes at full size."""
+    return config.DATA.IMG_SIZE if config.DATA.get("SCALED_DECODING", False) else None
+
+def get_uint8_transforms(config: CfgNode):
+    """Worker side of the uint8 pipeline, the same for train and val (the flip moved to
+    `BatchTransform`). Normalization is affine and commutes with the bilinear resize and
+    the flip, so the clips only differ by the rounding of the resized frames to uint8."""
+    return Compose(
+        [
+            ApplyTransformToKey(
+                key="video",
+                transform=Compose(
+                    [
+                        UniformTemporalSubsample(get_num_sampled_frames(config)),
+                        Lambda(lambda x: x.to(torch.uint8)),
+                        Resize((config.DATA.IMG_SIZE, config.DATA.IMG_SIZE)),
+                    ]
+                ),
+            ),
+        ]
+    )
+
+class BatchTransform(nn.Module):
+    """Device side of the uint8 pipeline: uint8 (batch, ..., channels, h, w) clips to
+    normalized floats, with a random horizontal flip per clip when training (what
+    `RandomHorizontalFlip(p=0.5)` did per clip in the workers)."""
+    def __init__(self, mean, std, flip_p: float = 0.5) -> None:
+        super().__init__()
+        # not persistent: checkpoints stay loadable with and without the transform
+        self.register_buffer("scale", 1.0 / (255.0 * torch.tensor(std).view(-1, 1, 1)), persistent=False)
+        self.register_buffer("shift", (torch.tensor(mean) / torch.tensor(std)).view(-1, 1, 1), persistent=False)
+        self.flip_p = flip_p
+
+    def forward(self, X: torch.Tensor, flip: bool = False) -> torch.Tensor:
+        X = X.float() * self.scale - self.shift  # (x / 255 - mean) / std
+        if flip and self.flip_p > 0:
+            flipped = torch.rand(X.shape[0], device=X.device) < self.flip_p
+            X = torch.where(flipped.view(-1, *[1] * (X.dim() - 1)), X.flip(-1), X)
+        return X
+
+def get_batch_transform(config: CfgNode) -> BatchTransform:
+    return BatchTransform(config.DATA.MEAN, config.DATA.STD)
+
 def get_train_transforms(config: CfgNode):
+    if uses_uint8_clips(config):
+        return get_uint8_transforms(config)
     mean = config.DATA.MEAN
     std = config.DATA.STD
     resize_to = (config.DATA.IMG_SIZE, config.DATA.IMG_SIZE)
@@ -61,6 +121,8 @@ def get_train_transforms(config: CfgNode):
 
 
 def get_val_transforms(config: CfgNode):
+    if uses_uint8_clips(config):
+        return get_uint8_transforms(config)
     resize_to = (config.DATA.IMG_SIZE, config.DATA.IMG_SIZE)
     mean = config.DATA.MEAN
     std = config.DATA.STD
@@ -2,11 +2,17 @@ import os
 import pathlib
 from typing import Dict
 
+import torch
 from torch.utils.data import Dataset
 from fvcore.common.config import CfgNode
 import pytorchvideo.data
+from pytorchvideo.data.labeled_video_dataset import LabeledVideoDataset
+from pytorchvideo.data.labeled_video_paths import LabeledVideoPaths
 
 from .dataset_abstract import DatasetAbstract
+from .labeled_videos import RestrictableLabeledVideoDataset
+from .video_manifest import VideoManifest, load_video_manifest, manifest_dir_for, scan_class_directories
+from .proxy_videos import get_proxy_map
 from .transformations import get_train_transforms, get_val_transforms
 
 class UFC101Dataset(DatasetAbstract):
@@ -14,8 +20,12 @@ class UFC101Dataset(DatasetAbstract):
         super().__init__()
         self.config = config
         self.dataset_root_path = pathlib.Path(config.DATA.ROOT_PATH)
+        self.manifest_root = config.DATA.get("MANIFEST_DIR", None)
+        self.proxy_map = get_proxy_map(config)
+        # one manifest per split, scanned once (see video_manifest.py)
+        self.manifests = {split: self.get_video_manifest(split) for split in ["train", "val", "test"]}
         self.all_video_file_paths = self.get_all_vid_paths(self.dataset_root_path)
-        self.class_labels = sorted({str(path).split("/")[-2] for path in self.all_video_file_paths})
+        self.class_labels = sorted({name for manifest in self.manifests.values() for name in manifest.label_names})
         # print(str(self.all_video_file_paths[0]).split("/"))
         self.label2id = {label: i for i, label in enumerate(self.class_labels)}
         self.id2label = {i: label for label, i in self.label2id.items()}
@@ -27,36 +37,43 @@ class UFC101Dataset(DatasetAbstract):
         self.val_transforms = get_val_transforms(config)
 
 
+    def get_video_manifest(self, split: str) -> VideoManifest:
+        """The videos of <root>/<split>/<class>/*.avi, scanned again only when a directory changes."""
+        split_path = os.path.join(self.dataset_root_path, split)
+        return load_video_manifest(manifest_dir_for(self.dataset_root_path, f"ucf101_{split}", self.manifest_root),
+                                   lambda: scan_class_directories(split_path))
+
     def get_all_vid_paths(self, dataset_root_path: pathlib.Path):
-        dataset_root_path = pathlib.Path(dataset_root_path)
-        video_count_train = len(list(dataset_root_path.glob("train/*/*.avi")))
-        video_count_val = len(list(dataset_root_path.glob("val/*/*.avi")))
-        video_count_test = len(list(dataset_root_path.glob("test/*/*.avi")))
-        video_total = video_count_train + video_count_val + video_count_test
-        print(f"Total videos (train, val, test): {video_total}")
+        video_counts = {split: len(manifest) for split, manifest in self.manifests.items()}
+        print(f"Total videos (train, val, test): {sum(video_counts.values())}")
+        return [pathlib.Path(path) for manifest in self.manifests.values() for path in manifest.video_paths()]
 
-        all_video_file_paths = (
-            list(dataset_root_path.glob("train/*/*.avi"))
-            + list(dataset_root_path.glob("val/*/*.avi"))
-            + list(dataset_root_path.glob("test/*/*.avi"))
+    def _labeled_video_dataset(self, split: str, clip_sampler, transform) -> LabeledVideoDataset:
+        """`pytorchvideo.data.Ucf101` of the split, with the paths and labels of its manifest
+        (the proxies of DATA.PROXY_DIR where there are)."""
+        paths_and_labels = self.manifests[split].paths_and_labels()
+        if self.proxy_map is not None:
+            paths_and_labels = [(self.proxy_map.resolve(path), label) for path, label in paths_and_labels]
+        return RestrictableLabeledVideoDataset(
+            LabeledVideoPaths(paths_and_labels),
+            clip_sampler,
+            torch.utils.data.RandomSampler,
+            transform,
+            decode_audio=False,
         )
 
-        return all_video_file_paths
-
     def get_train_dataset(self) -> Dataset:
-        train_dataset = pytorchvideo.data.Ucf101(
-            data_path=os.path.join(self.dataset_root_path, "train"),
+        train_dataset = self._labeled_video_dataset(
+            "train",
             clip_sampler=pytorchvideo.data.make_clip_sampler("random", self.clip_duration),
-            decode_audio=False,
             transform=self.train_transforms,
         )
         return train_dataset
 
     def get_val_dataset(self) -> Dataset:
-        val_dataset = pytorchvideo.data.Ucf101(
-            data_path=os.path.join(self.dataset_root_path, "val"),
+        val_dataset = self._labeled_video_dataset(
+            "val",
             clip_sampler=pytorchvideo.data.make_clip_sampler("uniform", self.clip_duration),
-            decode_audio=False,
             transform=self.val_transforms,
         )   
         return val_dataset
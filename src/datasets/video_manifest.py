@@ -0,0 +1,188 @@
+"""
+Video manifests: the videos of a dataset split with their label, frame count, fps and
+duration, scanned once instead of on every dataset construction.
+
+A scan function walks the dataset (globbing class directories, parsing split files, ...)
+and returns its videos plus the `sources` it read: the files and directories whose
+mtimes decide whether the scan is still valid. `load_video_manifest` keeps the result
+in a directory of .npy arrays,
+
+    meta.json        version, label names, sources with their mtime_ns
+    path_blob        utf-8 video paths, back to back          path_offsets (videos + 1,)
+    label            (videos,) int32
+    num_frames       (videos,) int64, -1 if the container doesn't tell
+    fps, duration    (videos,) float64, duration in seconds
+
+and on later runs only stats the sources before memory-mapping the arrays. Adding or
+removing videos changes the mtime of their directory and triggers a new scan.
+Encoded videos are probed from their container headers, nothing is decoded.
+"""
+import os
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import av
+import numpy as np
+
+from .annotation_index import CharadesAnnotationIndex, _pack_strings, _swap_in_directory
+
+MANIFEST_VERSION = 1
+MANIFEST_ARRAYS = ["path_blob", "path_offsets", "label", "num_frames", "fps", "duration"]
+VIDEO_EXTENSIONS = (".mp4", ".avi")
+PROBE_THREADS = 16
+
+# videos as (path, label), label names, sources
+ScanResult = Tuple[List[Tuple[str, int]], List[str], List[str]]
+
+
+def probe_video(path: str) -> Tuple[int, float, float]:
+    """(frames, fps, duration) of an encoded video from its headers, (-1, 0, 0) if unreadable."""
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            fps = float(stream.average_rate or stream.guessed_rate or 0)
+            if stream.duration is not None:
+                duration = float(stream.duration * stream.time_base)
+            else:
+                duration = (container.duration or 0) / av.time_base
+            num_frames = stream.frames or (round(duration * fps) if fps else -1)
+            return int(num_frames), fps, duration
+    except (av.error.FFmpegError, IndexError, OSError):
+        return -1, 0.0, 0.0
+
+
+def scan_class_directories(dir_path: str) -> ScanResult:
+    """dir_path/<class>/<video>.{mp4,avi}, classes labeled alphabetically and videos
+    ordered like `LabeledVideoPaths.from_directory` does."""
+    dir_path = str(dir_path)
+    if not os.path.isdir(dir_path):  # rescanned once it exists
+        return [], [], [dir_path]
+    classes = sorted(entry.name for entry in os.scandir(dir_path) if entry.is_dir())
+    videos, sources = [], [dir_path]
+    for label, class_name in enumerate(classes):
+        for root, dirs, files in sorted(os.walk(os.path.join(dir_path, class_name), followlinks=True)):
+            sources.append(root)
+            videos.extend((os.path.join(root, name), label) for name in sorted(files)
+                          if name.lower().endswith(VIDEO_EXTENSIONS))
+    return videos, classes, sources
+
+
+def build_manifest_arrays(videos: Sequence[Tuple[str, int]], label_names: List[str], sources: List[str],
+                          probe: Optional[Callable[[str], Tuple[int, float, float]]] = probe_video,
+                          num_threads: int = PROBE_THREADS) -> Dict[str, Any]:
+    """Arrays (and 'meta') of a manifest. `probe` gives (frames, fps, duration) of a path,
+    None leaves them unknown."""
+    paths = [path for path, _ in videos]
+    if probe is not None:
+        with ThreadPoolExecutor(num_threads) as pool:
+            probed = list(pool.map(probe, paths))
+    else:
+        probed = [(-1, 0.0, 0.0)] * len(paths)
+    arrays = {}
+    arrays["path_blob"], arrays["path_offsets"] = _pack_strings(paths)
+    arrays["label"] = np.array([label for _, label in videos], dtype=np.int32)
+    arrays["num_frames"] = np.array([p[0] for p in probed], dtype=np.int64)
+    arrays["fps"] = np.array([p[1] for p in probed], dtype=np.float64)
+    arrays["duration"] = np.array([p[2] for p in probed], dtype=np.float64)
+    arrays["meta"] = {
+        "version": MANIFEST_VERSION,
+        "label_names": list(label_names),
+        "sources": {source: _mtime(source) for source in sources},
+    }
+    return arrays
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _is_current(manifest_dir: str) -> bool:
+    try:
+        with open(os.path.join(manifest_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("version") == MANIFEST_VERSION and all(
+        _mtime(source) == mtime for source, mtime in meta["sources"].items())
+
+
+class VideoManifest:
+    """Read access to a manifest, memory-mapped (`path`) or in memory (`arrays`)."""
+    def __init__(self, path: Optional[str] = None, arrays: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        if arrays is None:
+            with open(os.path.join(path, "meta.json"), "r") as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in MANIFEST_ARRAYS}
+            arrays["meta"] = meta
+        self._arrays = arrays
+        self.meta: Dict[str, Any] = arrays["meta"]
+        self.label_names: List[str] = self.meta["label_names"]
+        for name in MANIFEST_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __getstate__(self):
+        return {"path": self.path, "arrays": None if self.path else self._arrays}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self) -> int:
+        return len(self.label)
+
+    def video_path(self, video_index: int) -> str:
+        start, end = self.path_offsets[video_index], self.path_offsets[video_index + 1]
+        return bytes(self.path_blob[start:end]).decode()
+
+    def video_paths(self) -> List[str]:
+        blob = bytes(self.path_blob)
+        ends = self.path_offsets.tolist()
+        return [blob[ends[i]:ends[i + 1]].decode() for i in range(len(self))]
+
+    def paths_and_labels(self) -> List[Tuple[str, int]]:
+        return list(zip(self.video_paths(), self.label.tolist()))
+
+
+def load_video_manifest(manifest_dir: str, scan: Callable[[], ScanResult],
+                        probe: Optional[Callable[[str], Tuple[int, float, float]]] = probe_video) -> VideoManifest:
+    """The manifest in `manifest_dir`, (re)built with `scan` if missing or if one of its
+    sources changed. Kept in memory only if `manifest_dir` is not writable."""
+    if _is_current(manifest_dir):
+        return VideoManifest(manifest_dir)
+    arrays = build_manifest_arrays(*scan(), probe=probe)
+    tmp_dir = f"{manifest_dir}.tmp{os.getpid()}"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in MANIFEST_ARRAYS:
+            np.save(os.path.join(tmp_dir, name + ".npy"), arrays[name])
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(arrays["meta"], f)
+        _swap_in_directory(tmp_dir, manifest_dir)
+    except OSError:  # read-only dataset root
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return VideoManifest(arrays=arrays)
+    return VideoManifest(manifest_dir)
+
+
+def manifest_from_annotation_index(index: CharadesAnnotationIndex, fps: float) -> VideoManifest:
+    """The frame directories of a Charades annotation index as an in-memory manifest
+    (label -1, the labels are per frame). The index is already compiled once and
+    recompiled when its CSV changes, so nothing is scanned."""
+    videos = []
+    for video_index in range(len(index)):
+        frame_paths = index.frame_paths(video_index)
+        videos.append((os.path.dirname(frame_paths[0]) if frame_paths else "", -1))
+    num_frames = np.array([index.num_frames(v) for v in range(len(index))], dtype=np.int64)
+    arrays = build_manifest_arrays(videos, [], [], probe=None)
+    arrays.update(num_frames=num_frames, fps=np.full(len(index), fps), duration=num_frames / fps)
+    return VideoManifest(arrays=arrays)
+
+
+def manifest_dir_for(dataset_root: str, name: str, manifest_root: Optional[str] = None) -> str:
+    """`<manifest_root>/<name>`, by default in a .video_manifests directory of the dataset root."""
+    return os.path.join(manifest_root or os.path.join(str(dataset_root), ".video_manifests"), name)
@@ -27,16 +27,24 @@ class VideoCaptioningModel(ModelAbstract):
             Returns:
                 logits: the output logits of the model
         '''
-        enc_hidden = self.encoder(X)
+        enc_hidden = self.encoder(self.prepare_input(X))
         output = self.head(enc_hidden, y)
         return output.logits
 
+    def training_step(self, batch) -> torch.Tensor:
+        # share of the caption tokens that are padding, what bucketing / dynamic padding cut
+        attention_mask = batch[1]['attention_mask']
+        self.log("train_padding_ratio", 1 - attention_mask.sum() / attention_mask.numel(),
+                 on_step=True, on_epoch=True, logger=True)
+        return super().training_step(batch)
+
     def create_loss_function(self) -> nn.Module:
         return nn.CrossEntropyLoss()
 
     def compute_loss(self, y_pred:torch.Tensor, y:torch.Tensor) -> torch.Tensor:
-        # Shift so that tokens < n predict n
-        labels = y['input_ids']
+        # Shift so that tokens < n predict n. Padding is no target (-100 is ignored by the
+        # loss), every caption ends in its own EOS token
+        labels = y['input_ids'].masked_fill(y['attention_mask'] == 0, -100)
         shift_logits = y_pred[..., :-1, :].contiguous()
         shift_labels = labels[..., 1:].contiguous()
         # Flatten the tokens
@@ -47,7 +55,7 @@ class VideoCaptioningModel(ModelAbstract):
         return dict()
 
     def generate(self, X: torch.Tensor, max_len: int = 64, beam_size: int = 1) -> str:
-        enc_hidden = self.encoder(X)
+        enc_hidden = self.encoder(self.prepare_input(X))
         return self.head.beam_search(enc_hidden, max_len, beam_size)
 
 class VideoCaptioningModel_VM(VideoCaptioningModel):
@@ -56,12 +64,12 @@ class VideoCaptioningModel_VM(VideoCaptioningModel):
         self.mapper = nn.Linear(576, 768)
     
     def forward(self, X: torch.Tensor , y: Dict[str, torch.Tensor]) -> torch.Tensor:
-        enc_hidden = self.encoder(X)
+        enc_hidden = self.encoder(self.prepare_input(X))
         enc_hidden = self.mapper(enc_hidden)
         output = self.head(enc_hidden, y)
         return output.logits
 
     def generate(self, X: torch.Tensor, max_len: int = 64, beam_size: int = 1) -> str:
-        enc_hidden = self.encoder(X)
+        enc_hidden = self.encoder(self.prepare_input(X))
         enc_hidden = self.mapper(enc_hidden)
         return self.head.beam_search(enc_hidden, max_len, beam_size)
@@ -38,8 +38,9 @@ class VideoCaptioningModelLinear(ModelAbstract):
         return nn.CrossEntropyLoss()
 
     def compute_loss(self, y_pred:torch.Tensor, y:torch.Tensor) -> torch.Tensor:
-        # Shift so that tokens < n predict n
-        labels = y['input_ids']
+        # Shift so that tokens < n predict n. Padding is no target (-100 is ignored by the
+        # loss), every caption ends in its own EOS token
+        labels = y['input_ids'].masked_fill(y['attention_mask'] == 0, -100)
         shift_logits = y_pred[..., :-1, :].contiguous()
         shift_labels = labels[..., 1:].contiguous()
         # Flatten the tokens
@@ -50,7 +51,7 @@ class VideoCaptioningModelLinear(ModelAbstract):
         return dict()
 
     def generate(self, X: torch.Tensor, max_len: int = 64, beam_size: int = 1) -> str:
-        enc_hidden = self.encoder(X)
+        enc_hidden = self.encoder(self.prepare_input(X))
         mapped = self.visual_mapper(enc_hidden)
         return self.head.beam_search(mapped, max_len, beam_size)
         
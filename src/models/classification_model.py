@@ -1,3 +1,4 @@
+import os
 from typing import Dict, List
 
 import torch
@@ -9,11 +10,8 @@ from .model_abstract import ModelAbstract
 from .encoders import create_encoder, EncoderAbstract
 from .heads import create_head, HeadAbstract
 from ..utils.metrics import compute_multilabel_mAP
-from .compute_cls_weights import cls_weights_all_hidden, cls_weights
-
-# CLASS_WEIGHTS = torch.tensor(cls_weights)
-CLASS_WEIGHTS = torch.ones(157)*2
-# print(f"{CLASS_WEIGHTS=}")
+from ..datasets.feature_store import index_path
+from ..datasets.label_stats import read_label_stats
 
 class VideoClassificationModel(ModelAbstract):
     def __init__(self, config: CfgNode) -> None:
@@ -26,12 +24,24 @@ class VideoClassificationModel(ModelAbstract):
     def create_head(self) -> HeadAbstract:
         return create_head(self.config)
 
+    def get_pos_weight(self) -> torch.Tensor:
+        """negatives / positives per class, from the label stats create_encoding.py stored
+        with the train features (DATA.ENCODING_STORE, set by train_cls_head.py)."""
+        store_dir = self.config.DATA.get('ENCODING_STORE', None)
+        if store_dir and os.path.exists(index_path(store_dir, "train")):
+            stats = read_label_stats(store_dir, "train")
+            if stats is not None:
+                return stats.pos_weight()
+        # e.g. loading a trained model without its features: the weights come from the checkpoint
+        print("No label stats found, pos_weight starts at 1")
+        return torch.ones(self.config.MODEL.HEAD.NUM_CLASSES)
+
     def create_loss_function(self) -> nn.Module:
         loss = self.config.MODEL.LOSS
         if loss == 'BCEWithLogitsLoss':
             class_weights = None
             if self.config.MODEL.get('USE_CLASS_WEIGHTS', False):
-                class_weights = CLASS_WEIGHTS
+                class_weights = self.get_pos_weight()
             return nn.BCEWithLogitsLoss(pos_weight=class_weights)
         return nn.CrossEntropyLoss()
             
@@ -1,3 +1,4 @@
 from .video_transformer import VideoTransformerEncoder
-from ._encoder_factory import create_encoder
-from .encoder_abstract import EncoderAbstract
\ No newline at end of file
+from ._encoder_factory import create_encoder, get_pretrained_path
+from .encoder_abstract import EncoderAbstract
+from .token_pooling import TokenPooling, get_num_visual_tokens, get_token_pooling_recipe
\ No newline at end of file
@@ -1,7 +1,10 @@
+from typing import Optional
+
 from fvcore.common.config import CfgNode
 
 from .video_transformer import VideoTransformerEncoder
 from .video_mamba import VideoMambaEncoder
+from .videomamba.videomamba import _MODELS as VIDEOMAMBA_WEIGHTS
 
 def create_encoder(config: CfgNode):
     encoder_type = config.MODEL.ENCODER.TYPE
@@ -9,4 +12,16 @@ def create_encoder(config: CfgNode):
         return VideoTransformerEncoder(config)
     if encoder_type == 'VideoMamba':
         return VideoMambaEncoder(config)
-    raise ModuleNotFoundError(f'No encoder called:{encoder_type}')
\ No newline at end of file
+    raise ModuleNotFoundError(f'No encoder called:{encoder_type}')
+
+def get_pretrained_path(config: CfgNode) -> Optional[str]:
+    """Path of the weight file the encoder is initialised from, None if it starts from scratch."""
+    encoder_type = config.MODEL.ENCODER.TYPE
+    if encoder_type == 'VideoTransformer':
+        return config.MODEL.ENCODER.PRETRAINED
+    if encoder_type == 'VideoMamba':
+        if not config.MODEL.ENCODER.PRETRAINED:
+            return None
+        size = config.MODEL.ENCODER.MODEL_SIZE
+        return VIDEOMAMBA_WEIGHTS[f"videomamba_{size[0]}16_k400"]
+    raise ModuleNotFoundError(f'No encoder called:{encoder_type}')
@@ -0,0 +1,110 @@
+"""
+Reduce the token sequence returned by the encoders with RETURN_ALL_HIDDEN before it is
+stored or given to a head. Configured with an optional node
+
+    MODEL:
+      ENCODER:
+        TOKEN_POOLING:
+          TYPE: grid      # none, frame_mean, grid, topk
+          GRID_SIZE: 2    # grid: pool every frame's patch grid to GRID_SIZE x GRID_SIZE
+          TOP_K: 64       # topk: keep the TOP_K patch tokens the CLS token attends to most
+
+The CLS token always stays in front, so heads that read token 0 keep working.
+    - frame_mean: 1 + T tokens, the spatial mean of every frame
+    - grid:       1 + T * GRID_SIZE^2 tokens
+    - topk:       1 + TOP_K tokens, kept in their original order
+"""
+from typing import Any, Dict, Tuple
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+from fvcore.common.config import CfgNode
+
+TOKEN_POOLING_TYPES = ["none", "frame_mean", "grid", "topk"]
+PATCH_SIZE = 16
+
+
+def get_token_layout(config: CfgNode) -> Tuple[int, int, bool]:
+    """(frames, patches per frame side, time major) of the patch tokens after the CLS token.
+
+    VideoTransformer (TimeSformer) orders them space major, `(h w t)`,
+    VideoMamba time major, `(t h w)`.
+    """
+    encoder_type = config.MODEL.ENCODER.TYPE
+    if encoder_type not in ['VideoTransformer', 'VideoMamba']:
+        raise ModuleNotFoundError(f'No encoder called:{encoder_type}')
+    return config.DATA.NUM_SAMPLED_FRAMES, config.DATA.IMG_SIZE // PATCH_SIZE, encoder_type == 'VideoMamba'
+
+
+def get_token_pooling(config: CfgNode) -> Dict[str, Any]:
+    pooling = config.MODEL.ENCODER.get("TOKEN_POOLING", None)
+    pooling_type = pooling.get("TYPE", "none") if pooling else "none"
+    if pooling_type not in TOKEN_POOLING_TYPES:
+        raise ValueError(f"Unknown token pooling type: {pooling_type}")
+    recipe = {"type": pooling_type}
+    if pooling_type == "grid":
+        recipe["grid_size"] = pooling.GRID_SIZE
+    elif pooling_type == "topk":
+        recipe["top_k"] = pooling.TOP_K
+    return recipe
+
+
+def get_num_visual_tokens(config: CfgNode) -> int:
+    """Number of tokens per clip the encoder returns with RETURN_ALL_HIDDEN, after pooling."""
+    recipe = get_token_pooling(config)
+    if recipe["type"] == "none":
+        if config.MODEL.ENCODER.get("NUM_VISUAL_TOKENS", None):
+            return config.MODEL.ENCODER.NUM_VISUAL_TOKENS
+        num_frames, side, _ = get_token_layout(config)
+        return 1 + num_frames * side * side
+    num_frames, _, _ = get_token_layout(config)
+    if recipe["type"] == "frame_mean":
+        return 1 + num_frames
+    if recipe["type"] == "grid":
+        return 1 + num_frames * recipe["grid_size"] ** 2
+    return 1 + recipe["top_k"]
+
+
+def get_token_pooling_recipe(config: CfgNode) -> Dict[str, Any]:
+    """What a feature store records about the pooling of its features."""
+    recipe = get_token_pooling(config)
+    recipe["num_tokens"] = get_num_visual_tokens(config) if config.MODEL.ENCODER.RETURN_ALL_HIDDEN else 1
+    return recipe
+
+
+class TokenPooling(nn.Module):
+    def __init__(self, config: CfgNode) -> None:
+        super().__init__()
+        self.recipe = get_token_pooling(config)
+        self.enabled = config.MODEL.ENCODER.RETURN_ALL_HIDDEN and self.recipe["type"] != "none"
+        if self.enabled:
+            self.num_frames, self.side, self.time_major = get_token_layout(config)
+
+    def _frames(self, patches: torch.Tensor) -> torch.Tensor:
+        """B, T*H*W, C patch tokens in encoder order -> B, T, H, W, C"""
+        B, _, C = patches.shape
+        T, S = self.num_frames, self.side
+        if self.time_major:
+            return patches.reshape(B, T, S, S, C)
+        return patches.reshape(B, S, S, T, C).permute(0, 3, 1, 2, 4)
+
+    def forward(self, X: torch.Tensor) -> torch.Tensor:
+        if not self.enabled:
+            return X
+        cls_token, patches = X[:, :1], X[:, 1:]
+        if self.recipe["type"] == "frame_mean":
+            pooled = self._frames(patches).mean(dim=(2, 3))
+        elif self.recipe["type"] == "grid":
+            frames = self._frames(patches)
+            B, T, S, _, C = frames.shape
+            grid = self.recipe["grid_size"]
+            pooled = F.adaptive_avg_pool2d(frames.reshape(B * T, S, S, C).permute(0, 3, 1, 2), grid)
+            pooled = pooled.permute(0, 2, 3, 1).reshape(B, T * grid * grid, C)
+        else:
+            # attention of the (final) CLS query over the patch keys; the encoders don't
+            # expose their attention maps (VideoMamba has none), so the output states stand in
+            scores = (patches @ cls_token.transpose(1, 2)).squeeze(-1) / patches.shape[-1] ** 0.5
+            indices = scores.topk(self.recipe["top_k"], dim=1).indices.sort(dim=1).values
+            pooled = patches.gather(1, indices.unsqueeze(-1).expand(-1, -1, patches.shape[-1]))
+        return torch.cat((cls_token, pooled), dim=1)
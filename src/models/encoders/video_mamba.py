@@ -13,6 +13,7 @@ from fvcore.common.config import CfgNode
 
 from .encoder_abstract import EncoderAbstract
 from .videomamba import videomamba_tiny, videomamba_small, videomamba_middle
+from .token_pooling import TokenPooling
 
 class VideoMambaEncoder(EncoderAbstract):
     def __init__(self, config: CfgNode) -> None:
@@ -45,9 +46,10 @@ class VideoMambaEncoder(EncoderAbstract):
             # embed_dim = config.MODEL.ENCODER.HIDDEN_SIZE = 576
         else:
             raise ValueError(f"Invalid VideoMamba model size: {config.MODEL.ENCODER.MODEL_SIZE}")
+        self.token_pooling = TokenPooling(config)
 
     def forward(self, X: torch.Tensor) -> torch.Tensor:
-        return self.model.forward(X, return_all_hiddens=self.config.MODEL.ENCODER.RETURN_ALL_HIDDEN)
+        return self.token_pooling(self.model.forward(X, return_all_hiddens=self.config.MODEL.ENCODER.RETURN_ALL_HIDDEN))
 
 """
     Check the README.md in the videomamba folder for installing cuda & C++ libraries
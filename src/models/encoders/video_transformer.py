@@ -3,6 +3,7 @@ from fvcore.common.config import CfgNode
 
 from .encoder_abstract import EncoderAbstract
 from .timesformer import get_vit_base_patch16_224
+from .token_pooling import TokenPooling
 
 class VideoTransformerEncoder(EncoderAbstract):
     def __init__(self, config: CfgNode) -> None:
@@ -13,7 +14,8 @@ class VideoTransformerEncoder(EncoderAbstract):
         renamed_checkpoint = {x[len("backbone."):]: y for x, y in ckpt.items() if x.startswith("backbone.")}
         msg = self.vit.load_state_dict(renamed_checkpoint, strict=False)
         print(f"Loaded pretrained video transformer: {msg}")
+        self.token_pooling = TokenPooling(config)
 
     def forward(self, X) -> torch.Tensor:
         X = X.permute(0, 2, 1, 3, 4) # to B, n_channels, n_frames, h, w
-        return self.vit.forward_features(X, get_all=self.config.MODEL.ENCODER.RETURN_ALL_HIDDEN)
\ No newline at end of file
+        return self.token_pooling(self.vit.forward_features(X, get_all=self.config.MODEL.ENCODER.RETURN_ALL_HIDDEN))
\ No newline at end of file
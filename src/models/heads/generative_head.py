@@ -1,4 +1,5 @@
-from typing import Dict, List, Tuple, Optional
+import functools
+from typing import Dict, Tuple
 
 import torch
 from torch import nn
@@ -8,6 +9,52 @@ from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
 
 from .head_abstract import HeadAbstract
 
+
+def _cached_cross_attention(layer: nn.Module, key: torch.Tensor, value: torch.Tensor, hidden_states: torch.Tensor,
+                            layer_past=None, attention_mask=None, head_mask=None, encoder_hidden_states=None,
+                            encoder_attention_mask=None, use_cache=False, output_attentions=False) -> Tuple:
+    """`GPT2Attention.forward` of a cross-attention layer with the keys / values of a single
+    video (1 x heads x tokens x head_dim). The queries of all batch rows (beams) are folded
+    into one row, so they attend to the same keys / values without copying them per beam."""
+    query = layer._split_heads(layer.q_attn(hidden_states), layer.num_heads, layer.head_dim)
+    batch_size, num_heads, query_len, head_dim = query.shape
+    query = query.transpose(0, 1).reshape(1, num_heads, batch_size * query_len, head_dim)
+    if layer.reorder_and_upcast_attn:
+        attn_output, attn_weights = layer._upcast_and_reordered_attn(query, key, value, encoder_attention_mask, head_mask)
+    else:
+        attn_output, attn_weights = layer._attn(query, key, value, encoder_attention_mask, head_mask)
+    attn_output = attn_output.reshape(num_heads, batch_size, query_len, head_dim).transpose(0, 1)
+    attn_output = layer.c_proj(layer._merge_heads(attn_output, layer.num_heads, layer.head_dim))
+    outputs = (layer.resid_dropout(attn_output), None)
+    if output_attentions:
+        outputs += (attn_weights.reshape(num_heads, batch_size, query_len, -1).transpose(0, 1),)
+    return outputs
+
+
+class CrossAttentionCache:
+    """Keys / values of the cross-attention layers of a GPT-2 language model for the encoder
+    states of one video, projected once. Inside the `with` block the cross-attention layers
+    read them instead of projecting `encoder_hidden_states` again at every step, and every
+    beam (batch row) shares them."""
+    def __init__(self, language_model: nn.Module, encoder_hidden_states: torch.Tensor) -> None:
+        if encoder_hidden_states.size(0) != 1:
+            raise ValueError(f"Expected the encoder states of one video, got a batch of {encoder_hidden_states.size(0)}")
+        self.layers = [block.crossattention for block in language_model.transformer.h]
+        self.keys_values = []
+        for layer in self.layers:
+            key, value = layer.c_attn(encoder_hidden_states).split(layer.split_size, dim=2)
+            self.keys_values.append((layer._split_heads(key, layer.num_heads, layer.head_dim),
+                                     layer._split_heads(value, layer.num_heads, layer.head_dim)))
+
+    def __enter__(self) -> "CrossAttentionCache":
+        for layer, (key, value) in zip(self.layers, self.keys_values):
+            layer.forward = functools.partial(_cached_cross_attention, layer, key, value)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for layer in self.layers:
+            del layer.forward
+
 class GenerativeHead(HeadAbstract):
     def __init__(self, config: CfgNode) -> None:
         super().__init__()
@@ -34,71 +81,65 @@ class GenerativeHead(HeadAbstract):
         After each step, we keep only the 'beam_size' output sequences with the highest
         end-to-end confidence score. Repeat this process until at most 'max_len' tokens
         have been generated.
+
+        All live beams run through the language model as one batch, and only with their
+        last token: the keys / values of the previous tokens come from 'past_key_values',
+        reordered after each step to follow the kept beams. A beam that predicted the
+        "stop" token is finished, it stays a candidate with its log-probability but isn't
+        run anymore. Candidates are ranked in the same order as beam by beam, so the
+        search keeps the same beams. The cross-attention keys / values of the video are
+        projected once for all steps and beams (`CrossAttentionCache`).
         """
-        # encoder_hidden_states = encoder_hidden_states.reshape(1, 1, -1).to(self.device)
+        eos_token_id = self.tokenizer.eos_token_id
         # Since we haven't performed any beam search steps yet, we just have one
-        # set of input IDs (with a single "start" token). We use 'None' for the log
-        # probability of this sequence, since it's not being predicted by the model.
-        input_ids = [torch.tensor([self.tokenizer.bos_token_id], device=self.device)]
-        beam_logprobs: Optional[List[float]] = None
-
-        def _get_beam_outputs(_input_ids: torch.Tensor) -> Tuple[List[torch.Tensor], torch.Tensor]:
-            """Performs inference on the 'input_ids' Tensor, and collects the top
-            'beam_size' results by score. Returns a list of output Tensors, and
-            their respective log-probabilities.
-            """
-            outputs = self.language_model(input_ids=_input_ids.unsqueeze(0), 
-                                          encoder_hidden_states=encoder_hidden_states)
-            # print(outputs.logits)
-            logits: torch.Tensor = outputs.logits[0, -1]
-            logprobs = F.log_softmax(logits, dim=-1)
-
-            topk_logprobs = logprobs.topk(k=beam_size)
-            indices = topk_logprobs.indices
-            logprobs = topk_logprobs.values
-            output_ids = [
-                torch.cat([_input_ids, idx.reshape(-1)], dim=0) for idx in indices
-            ]
-
-            return output_ids, logprobs
+        # beam (with a single "start" token) and a log probability of 0.
+        input_ids = torch.tensor([[self.tokenizer.bos_token_id]], device=self.device)
+        beam_logprobs = torch.zeros(1, device=self.device)
+        beams_done = torch.zeros(1, dtype=torch.bool, device=self.device)
+        past_key_values = None
+        cross_attention_cache = CrossAttentionCache(self.language_model, encoder_hidden_states)
 
         for _ in range(max_len - 1):
-            output_ids: List[torch.Tensor] = []
-            logprobs: List[float] = []
-            beams_done: List[bool] = []
-
-            # Collect the top 'beam_size' results from each beam individually.
-            for beam_idx, ids in enumerate(input_ids):
-                # If 'beam_logprobs' is already defined, then we've predicted at least
-                # one token already. And if the last token is equal to the "stop" token,
-                # we don't need to perform inference with this beam anymore.
-                if beam_logprobs and ids[-1].item() == self.tokenizer.eos_token_id:
-                    output_ids.append(ids)
-                    logprobs.append(beam_logprobs[beam_idx])
-                    beams_done.append(True)
-                    continue
-
-                _output_ids, _logprobs = _get_beam_outputs(ids)
-                if beam_logprobs is not None:
-                    # Sum the log-probabilities of the existing beam and our predicted
-                    # token to get the total log-probability.
-                    _logprobs += beam_logprobs[beam_idx]
-
-                # Append the results from this beam to the aggregate lists.
-                output_ids += _output_ids
-                logprobs += _logprobs.tolist()
-                beams_done.append(False)
-
-            if all(beams_done):
+            if beams_done.all():
                 # All search beams are done generating text.
                 break
+            live = ~beams_done
+            with cross_attention_cache:
+                outputs = self.language_model(input_ids=input_ids[live, -1:],
+                                              encoder_hidden_states=encoder_hidden_states,
+                                              past_key_values=past_key_values,
+                                              use_cache=True)
+            logprobs = F.log_softmax(outputs.logits[:, -1], dim=-1)
+            topk_logprobs = logprobs.topk(k=beam_size, dim=-1)
+
+            # 'beam_size' candidates per live beam, finished beams are their only candidate.
+            # Sum the log-probabilities of the existing beam and our predicted token to get
+            # the total log-probability.
+            num_beams = len(input_ids)
+            candidate_logprobs = torch.full((num_beams, beam_size), float("-inf"), device=self.device)
+            candidate_ids = torch.full((num_beams, beam_size), eos_token_id, device=self.device)
+            candidate_valid = torch.zeros((num_beams, beam_size), dtype=torch.bool, device=self.device)
+            candidate_logprobs[live] = topk_logprobs.values + beam_logprobs[live, None]
+            candidate_ids[live] = topk_logprobs.indices
+            candidate_valid[live] = True
+            candidate_logprobs[beams_done, 0] = beam_logprobs[beams_done]
+            candidate_valid[beams_done, 0] = True
 
             # Keep only the top 'beam_size' beams by total log-probability.
-            indices = torch.tensor(logprobs).topk(k=beam_size).indices
-            input_ids = [output_ids[idx] for idx in indices]
-            beam_logprobs = [logprobs[idx] for idx in indices]
+            candidates = candidate_valid.flatten().nonzero().squeeze(1)
+            indices = candidates[candidate_logprobs.flatten()[candidates].topk(k=beam_size).indices]
+            parents, slots = indices // beam_size, indices % beam_size
+            next_ids = candidate_ids[parents, slots]
+            input_ids = torch.cat([input_ids[parents], next_ids.unsqueeze(1)], dim=1)
+            beam_logprobs = candidate_logprobs[parents, slots]
+            beams_done = next_ids == eos_token_id  # finished beams only extend with "stop" tokens
+
+            # the cache has a row per live beam, keep the rows of the beams still running
+            live_rows = live.cumsum(0) - 1
+            past_key_values = self.language_model._reorder_cache(outputs.past_key_values,
+                                                                 live_rows[parents[~beams_done]])
 
         # Find the predicted beam with highest overall log-probability.
-        best_beam_idx: int = torch.tensor(beam_logprobs).argmax().item()  # type: ignore
+        best_beam_idx: int = beam_logprobs.argmax().item()  # type: ignore
         # Decode the predicted token IDs into a text string.
         return self.tokenizer.decode(input_ids[best_beam_idx], skip_special_tokens=True)
@@ -3,6 +3,7 @@ from torch import nn
 from fvcore.common.config import CfgNode
 
 from .head_abstract import HeadAbstract
+from ..encoders.token_pooling import get_num_visual_tokens
 
 class Dense(nn.Module):
     def __init__(self, inp_size: int, out_size: int, dropout: float = 0.0, layer_norm: bool = False):
@@ -51,7 +52,7 @@ class MLPHead(HeadAbstract):
         dropout = self.config.MODEL.HEAD.DROPOUT if hasattr(self.config.MODEL.HEAD, 'DROPOUT') else 0.0
         layer_norm = self.config.MODEL.HEAD.LAYER_NORM if hasattr(self.config.MODEL.HEAD, 'LAYER_NORM') else False
         self.return_all_hiddens = self.config.MODEL.ENCODER.RETURN_ALL_HIDDEN
-        num_visual_tokens = self.config.MODEL.ENCODER.NUM_VISUAL_TOKENS
+        num_visual_tokens = get_num_visual_tokens(self.config) if self.return_all_hiddens else 1
         self.reducer_type = self.config.MODEL.HEAD.REDUCER_TYPE
         in_size = num_visual_tokens
 
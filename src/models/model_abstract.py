@@ -12,6 +12,7 @@ from .encoders.encoder_abstract import EncoderAbstract
 from .heads.head_abstract import HeadAbstract
 
 from ..utils.general import freeze_subnet, to_cpu
+from ..datasets.transformations import get_batch_transform
 
 class ModelAbstract(abc.ABC, LightningModule):
     """Define common methods and abstract methods for the all sub-class models"""
@@ -22,6 +23,7 @@ class ModelAbstract(abc.ABC, LightningModule):
         if self.config.TRAIN.FREEZE_ENCODER:
             freeze_subnet(self.encoder)
         self.head = self.create_head()
+        self.batch_transform = get_batch_transform(config)
         # save hyper-parameters to self.hparamsm auto-logged by wandb
         self.save_hyperparameters()
         self.loss_func = self.create_loss_function()
@@ -40,6 +42,17 @@ class ModelAbstract(abc.ABC, LightningModule):
     def create_loss_function(self) -> nn.Module:
         pass
 
+    def prepare_input(self, X: torch.Tensor) -> torch.Tensor:
+        '''Normalizes uint8 clips (DATA.UINT8_CLIPS) on their device, flipped at random when training.
+        Float inputs (normalized clips or stored features) are returned unchanged.'''
+        if X.dtype == torch.uint8:
+            X = self.batch_transform(X, flip=self.training)
+        return X
+
+    def on_after_batch_transfer(self, batch: Tuple, dataloader_idx: int) -> Tuple:
+        X, y = batch
+        return self.prepare_input(X), y
+
     def forward(self, X: torch.Tensor, y: torch.Tensor | Dict[str, torch.Tensor] = None) -> torch.Tensor:
         '''
             Args:
@@ -48,7 +61,7 @@ class ModelAbstract(abc.ABC, LightningModule):
             Returns:
                 logits: the output logits of the model
         '''
-        features = self.encoder(X)
+        features = self.encoder(self.prepare_input(X))
         y_pred = self.head(features, y)
         return y_pred
 
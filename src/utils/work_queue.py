@@ -0,0 +1,86 @@
+"""
+A lock-free work queue on a (shared) filesystem.
+
+    <root>/todo/<unit>.json                 units nobody has started
+    <root>/claimed/<unit>.json@<worker>     units being processed by <worker>
+    <root>/done/<unit>.json                 finished units, with the worker's result
+
+A worker claims a unit by renaming it from todo/ to claimed/. `os.rename` is atomic on
+POSIX filesystems and NFS, so exactly one of several competing workers (on one host
+or many) succeeds and the others move on to the next file.
+"""
+import os
+import json
+import random
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+def _write_json_atomic(path: str, payload: Dict[str, Any]):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+class FileWorkQueue:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.todo_dir = os.path.join(root, "todo")
+        self.claimed_dir = os.path.join(root, "claimed")
+        self.done_dir = os.path.join(root, "done")
+        for d in [self.todo_dir, self.claimed_dir, self.done_dir]:
+            os.makedirs(d, exist_ok=True)
+
+    def put(self, name: str, payload: Dict[str, Any]):
+        _write_json_atomic(os.path.join(self.todo_dir, f"{name}.json"), payload)
+
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Take one unit out of todo/. Returns (name, payload), or None once todo/ is empty."""
+        while True:
+            names = [f for f in os.listdir(self.todo_dir) if f.endswith(".json")]
+            if not names:
+                return None
+            # random order so that workers starting together don't all fight for the same file
+            random.shuffle(names)
+            for name in names:
+                claimed_path = os.path.join(self.claimed_dir, f"{name}@{worker}")
+                try:
+                    os.rename(os.path.join(self.todo_dir, name), claimed_path)
+                except FileNotFoundError:
+                    continue  # another worker was faster
+                with open(claimed_path, "r") as f:
+                    return name[:-len(".json")], json.load(f)
+
+    def complete(self, name: str, worker: str, result: Dict[str, Any]):
+        """Record the result of a claimed unit and release the claim."""
+        claimed_path = os.path.join(self.claimed_dir, f"{name}.json@{worker}")
+        with open(claimed_path, "r") as f:
+            payload = json.load(f)
+        _write_json_atomic(os.path.join(self.done_dir, f"{name}.json"),
+                           {"unit": payload, "worker": worker, "result": result})
+        os.remove(claimed_path)
+
+    def drop_claimed(self) -> int:
+        """Forget the units of crashed workers. Only call while no worker is running."""
+        names = os.listdir(self.claimed_dir)
+        for name in names:
+            os.remove(os.path.join(self.claimed_dir, name))
+        return len(names)
+
+    def claimed_workers(self) -> Set[str]:
+        """Workers holding a claimed unit, i.e. still running (or crashed)."""
+        return {name.split("@", 1)[1] for name in os.listdir(self.claimed_dir) if "@" in name}
+
+    def num_todo(self) -> int:
+        return len([f for f in os.listdir(self.todo_dir) if f.endswith(".json")])
+
+    def num_claimed(self) -> int:
+        return len(os.listdir(self.claimed_dir))
+
+    def done(self) -> List[Dict[str, Any]]:
+        results = []
+        for name in sorted(os.listdir(self.done_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.done_dir, name), "r") as f:
+                    results.append(json.load(f))
+        return results
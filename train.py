@@ -65,8 +65,10 @@ def train(args):
     batch_size = config.TRAIN.BATCH_SIZE
     num_workers = config.DATA.NUM_WORKERS
     collate_fn = get_collate_fn(config)
+    # map-style datasets (DATA.MAP_STYLE) are shuffled clip by clip, iterable ones shuffle videos themselves
     train_loader = DataLoader(train_dataset,batch_size=batch_size,
                                               pin_memory=True,drop_last=True,num_workers=num_workers,
+                                               shuffle=not isinstance(train_dataset, torch.utils.data.IterableDataset),
                                                collate_fn=collate_fn)
     valid_loader = DataLoader(val_dataset,batch_size=batch_size,
                                 num_workers=num_workers,
@@ -99,6 +101,8 @@ def train(args):
 
     # training
     trainer.fit(model=lit_module, train_dataloaders=train_loader, val_dataloaders=valid_loader)
+    if getattr(dataset, "frame_pool", None) is not None:
+        print("Frame pool:", dataset.frame_pool.stats())
    
 
 if __name__ == '__main__':
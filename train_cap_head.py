@@ -1,6 +1,5 @@
 import os
 import argparse
-from glob import glob
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -11,10 +10,11 @@ from lightning.pytorch.loggers import WandbLogger
 from lightning.pytorch.callbacks import LearningRateMonitor, ModelCheckpoint
 import wandb
 
-from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn
+from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn, FeatureStoreDataset
+from src.datasets.bucketing import BucketBatchSampler, caption_lengths, get_bucket_boundaries, trim_caption_collate_fn
 from src.utils.general import set_deterministic
 from src.models.captioning_model import VideoCaptioningModel
-from src.models.encoders import EncoderAbstract
+from src.models.encoders import EncoderAbstract, get_num_visual_tokens
 
 
 
@@ -25,9 +25,9 @@ parser.add_argument("-c", "--config", help="The config file",
 args = parser.parse_args()
 
 class Encoder(nn.Module):
-    def __init__(self):
+    def __init__(self, num_tokens: int = 1569):
         super().__init__()
-        self.lin1 = nn.Linear(1569, 1)
+        self.lin1 = nn.Linear(num_tokens, 1)
         self.lin2 = nn.Linear(768, 768)
         self.norm = nn.LayerNorm(768)
     
@@ -43,7 +43,7 @@ class VideoCaptioningModelHead(VideoCaptioningModel):
         # return nn.Identity()
         # return nn.Sequential(nn.Linear(576, 768))
         # return nn.Sequential(nn.Linear(self.config.DATA.NUM_SAMPLED_FRAMES_MULT*self.config.MODEL.ENCODER.HIDDEN_SIZE, 768))
-        return Encoder()
+        return Encoder(get_num_visual_tokens(self.config))
 
 def get_collate_fn(config: CfgNode):
     if config.MODEL.TYPE == 'classification':
@@ -53,21 +53,10 @@ def get_collate_fn(config: CfgNode):
     else:
         raise ValueError("Invalid model type")
 
-class CaptioningDataset(Dataset):
+class CaptioningDataset(FeatureStoreDataset):
     def __init__(self, train: bool):
-        super().__init__()
-        if train:
-            self.x = sorted(glob("data/encodings_svt_8x4_all/train_x_*.pt"))
-            self.y = sorted(glob("data/encodings_svt_8x4_all/train_y_*.pt"))
-        else:
-            self.x = sorted(glob("data/encodings_svt_8x4_all/val_x_*.pt"))
-            self.y = sorted(glob("data/encodings_svt_8x4_all/val_y_*.pt"))
-        
-    def __len__(self):
-        return len(self.x)
-
-    def __getitem__(self, ind):
-        return torch.load(self.x[ind]), torch.load(self.y[ind])
+        super().__init__("data/encodings_svt_8x4_all", "train" if train else "val",
+                         y_fields=["input_ids", "attention_mask"])
 
 def train():
     """Train a new model"""
@@ -93,14 +82,20 @@ def train():
     # create dataloaders
     batch_size = config.TRAIN.BATCH_SIZE
     num_workers = config.DATA.NUM_WORKERS
-    # collate_fn = get_collate_fn(config)
-    train_loader = DataLoader(train_dataset,batch_size=batch_size, shuffle=True,
-                                              pin_memory=True,drop_last=False,num_workers=num_workers,
-                                               )
-    valid_loader = DataLoader(val_dataset,batch_size=batch_size, shuffle=False,
+    # batches of similar caption lengths, padded to their longest caption
+    collate_fn = trim_caption_collate_fn()
+    train_sampler = BucketBatchSampler(caption_lengths(train_dataset.store), batch_size,
+                                       get_bucket_boundaries(config), shuffle=True, seed=config.SEED)
+    val_sampler = BucketBatchSampler(caption_lengths(val_dataset.store), batch_size,
+                                     get_bucket_boundaries(config), shuffle=False)
+    print(f"Padding ratio: train {train_sampler.padding_ratio():.3f}, val {val_sampler.padding_ratio():.3f}")
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler,
+                                              pin_memory=True,num_workers=num_workers,
+                                               collate_fn=collate_fn)
+    valid_loader = DataLoader(val_dataset, batch_sampler=val_sampler,
                                 num_workers=num_workers,
-                                pin_memory=True,drop_last=False,
-                                )
+                                pin_memory=True,
+                                collate_fn=collate_fn)
     # crete model
     lit_module = VideoCaptioningModelHead(config)
 
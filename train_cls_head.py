@@ -1,6 +1,7 @@
 import os
+import sys
 import argparse
-from glob import glob
+import subprocess
 import torch
 from torch import nn
 from torch.utils.data import Dataset, DataLoader
@@ -10,12 +11,13 @@ from lightning.pytorch.loggers import WandbLogger
 from lightning.pytorch.callbacks import LearningRateMonitor, ModelCheckpoint
 import wandb
 
-from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn
+from src.datasets import create_dataset, classification_collate_fn, captioning_collate_fn, FeatureStoreDataset, InMemoryFeatureBatches
 from src.utils.general import set_deterministic
 from src.models.captioning_model import VideoCaptioningModel
 from src.models.classification_model import VideoClassificationModel
 
-from src.models.encoders import EncoderAbstract
+from src.models.encoders import EncoderAbstract, get_pretrained_path, get_token_pooling_recipe
+from src.datasets.encoding_manifest import encoder_signature, encodings_complete, get_encoding_dir
 
 
 def create_parser():
@@ -29,6 +31,10 @@ def create_parser():
     parser.add_argument("-ln", "--layer_norm", action="store_true", default=False)
     parser.add_argument("-cw", "--use_class_weights", action="store_true", default=False)
     parser.add_argument("-lrm", "--lr_milestones", nargs="+", type=int, default=[])
+    parser.add_argument("-m", "--in_memory", action="store_true", default=False,
+                            help="Hold all features in RAM and index whole batches, without DataLoader workers")
+    parser.add_argument("--no_shuffle", action="store_true", default=False,
+                            help="With --in_memory, train batches in store order like the DataLoader path")
 
     args = parser.parse_args()
     return args
@@ -71,28 +77,47 @@ class VideoClassificationingModelHead(VideoClassificationModel):
 def get_collate_fn(config: CfgNode):
     def inner_collate_fn(examples):
         """The collation function to be used by `Trainer` to prepare data batches."""
-        X = torch.cat([item[0] for item in examples])
-        y = torch.cat([item[1] for item in examples])
+        X = torch.stack([item[0] for item in examples])
+        y = torch.stack([item[1] for item in examples])
         return X, y
     return inner_collate_fn
 
 
 
-class ClassificationDataset(Dataset):
-    def __init__(self, encoding_folder, is_trainset: bool):
-        super().__init__()
-        if is_trainset:
-            self.x = sorted(glob(f"{encoding_folder}/train_x_*.pt"))
-            self.y = sorted(glob(f"{encoding_folder}/train_y_*.pt"))
-        else:
-            self.x = sorted(glob(f"{encoding_folder}/val_x_*.pt"))
-            self.y = sorted(glob(f"{encoding_folder}/val_y_*.pt"))
-        
-    def __len__(self):
-        return len(self.x)
-
-    def __getitem__(self, ind):
-        return torch.load(self.x[ind]), torch.load(self.y[ind])
+def check_token_pooling(metadata, encoding_folder, config: CfgNode):
+    stored = metadata.get("token_pooling")
+    expected = get_token_pooling_recipe(config)
+    if stored is not None and stored != expected:
+        raise ValueError(f"{encoding_folder} holds features pooled as {stored}, the config expects {expected}")
+
+class ClassificationDataset(FeatureStoreDataset):
+    """Per-clip encodings and multi-hot labels read from the feature store written by create_encoding.py"""
+    def __init__(self, encoding_folder, is_trainset: bool, config: CfgNode):
+        super().__init__(encoding_folder, "train" if is_trainset else "val")
+        check_token_pooling(self.store.metadata, encoding_folder, config)
+
+def prepare_encodings(config_path: str, config: CfgNode) -> str:
+    """The feature store matching the encoder, transforms and weights of `config`.
+    Runs create_encoding.py first if it doesn't exist or is incomplete."""
+    signature = encoder_signature(config, get_pretrained_path(config), config.DATA.get("ENCODING_DTYPE", "float32"))
+    encoding_dir = get_encoding_dir(config, signature)
+    if not encodings_complete(encoding_dir, signature, ["train", "val"]):
+        print(f"No complete encodings for this config at {encoding_dir}, creating them")
+        subprocess.run([sys.executable, "create_encoding.py", "-c", config_path], check=True)
+    print(f"Using encodings at {encoding_dir}")
+    return encoding_dir
+
+def create_in_memory_loaders(encoding_dir: str, config: CfgNode, shuffle: bool = True):
+    """Train / val batches straight from RAM, the train split is reshuffled every epoch
+    unless `shuffle` is False (store order, the batches of the DataLoader path)."""
+    loaders = []
+    for split in ["train", "val"]:
+        batches = InMemoryFeatureBatches(encoding_dir, split, config.TRAIN.BATCH_SIZE,
+                                         shuffle=shuffle and split == "train", drop_last=split == "train",
+                                         seed=config.SEED)
+        check_token_pooling(batches.metadata, encoding_dir, config)
+        loaders.append(batches)
+    return loaders
 
 def train(args):
     """Train a new model"""
@@ -113,26 +138,31 @@ def train(args):
                 name=config.EXPERIMENT,
                 group=config.MODEL.TYPE)
 
-    # create dataset
-    # dataset = create_dataset(config)
-    train_dataset = ClassificationDataset(encoding_folder=config.DATA.ENCODING_DIR, 
-                                        is_trainset=True) # dataset.get_train_dataset()
-    val_dataset = ClassificationDataset(encoding_folder=config.DATA.ENCODING_DIR, 
-                                        is_trainset=False) # dataset.get_val_dataset()
-
-    # create dataloaders
-    batch_size = config.TRAIN.BATCH_SIZE
-    num_workers = config.DATA.NUM_WORKERS
-    collate_fn = get_collate_fn(config)
-    train_loader = DataLoader(train_dataset,batch_size=batch_size,
-                                              pin_memory=True,drop_last=True,num_workers=num_workers,
-                                              collate_fn=get_collate_fn(config)
-                                               )
-    valid_loader = DataLoader(val_dataset,batch_size=batch_size,
-                                num_workers=num_workers,
-                                pin_memory=True,drop_last=False,
-                                collate_fn=get_collate_fn(config)
-                                )
+    encoding_dir = prepare_encodings(args.config, config)
+    config.DATA.ENCODING_STORE = encoding_dir  # class weights come from the store's label stats
+    if args.in_memory:
+        train_loader, valid_loader = create_in_memory_loaders(encoding_dir, config, shuffle=not args.no_shuffle)
+    else:
+        # create dataset
+        # dataset = create_dataset(config)
+        train_dataset = ClassificationDataset(encoding_folder=encoding_dir, 
+                                            is_trainset=True, config=config) # dataset.get_train_dataset()
+        val_dataset = ClassificationDataset(encoding_folder=encoding_dir, 
+                                            is_trainset=False, config=config) # dataset.get_val_dataset()
+
+        # create dataloaders
+        batch_size = config.TRAIN.BATCH_SIZE
+        num_workers = config.DATA.NUM_WORKERS
+        collate_fn = get_collate_fn(config)
+        train_loader = DataLoader(train_dataset,batch_size=batch_size,
+                                                  pin_memory=True,drop_last=True,num_workers=num_workers,
+                                                  collate_fn=get_collate_fn(config)
+                                                   )
+        valid_loader = DataLoader(val_dataset,batch_size=batch_size,
+                                    num_workers=num_workers,
+                                    pin_memory=True,drop_last=False,
+                                    collate_fn=get_collate_fn(config)
+                                    )
     # crete model
     lit_module = VideoClassificationingModelHead(config)
 
@@ -1,7 +1,6 @@
 from typing import Dict
 import os
 import argparse
-from glob import glob
 import torch
 from torch import nn
 from torch.utils.data import Dataset,DataLoader
@@ -13,6 +12,9 @@ from lightning.pytorch.callbacks import LearningRateMonitor, ModelCheckpoint
 
 from src.models.captioning_model import VideoCaptioningModel
 # from src.datasets import create_dataset
+from src.datasets import FeatureStoreDataset
+from src.datasets.encoding_manifest import get_config_encoding_dir
+from src.datasets.bucketing import BucketBatchSampler, caption_lengths, get_bucket_boundaries, trim_caption_collate_fn
 from src.utils.general import set_deterministic
 
 parser = argparse.ArgumentParser(description="Train a video model")
@@ -22,23 +24,23 @@ parser.add_argument("-c", "--config", help="The config file",
 args = parser.parse_args()
 
 class CaptioningDataset(Dataset):
-    def __init__(self, train: bool, mean: torch.tensor, std: torch.tensor, frame_skip: int = 8):
+    def __init__(self, encoding_dir: str, train: bool, mean: torch.tensor, std: torch.tensor, frame_skip: int = 8):
         super().__init__()
         self.mean = torch.tensor(mean)
         self.std = torch.tensor(std)
         self.frame_skip = frame_skip
-        if train:
-            self.x = sorted(glob("data/encodings/inp_64_int/train_x_*.pt"))
-            self.y = sorted(glob("data/encodings/inp_64_int/train_y_*.pt"))
-        else:
-            self.x = sorted(glob("data/encodings/inp_64_int/val_x_*.pt"))
-            self.y = sorted(glob("data/encodings/inp_64_int/val_y_*.pt"))
+        self.data = FeatureStoreDataset(encoding_dir, "train" if train else "val",
+                                        y_fields=["input_ids", "attention_mask"])
         
     def __len__(self):
-        return len(self.x)
+        return len(self.data)
+
+    def caption_lengths(self):
+        return caption_lengths(self.data.store)
 
     def __getitem__(self, ind):
-        return ((torch.load(self.x[ind])[::self.frame_skip].permute(0,2,3,1)/255 - self.mean)/self.std).permute(0,3,1,2), torch.load(self.y[ind])
+        x, y = self.data[ind]
+        return ((x[::self.frame_skip].permute(0,2,3,1)/255 - self.mean)/self.std).permute(0,3,1,2), y
 
 
 class VideoCaptioningModel_(VideoCaptioningModel):
@@ -80,18 +82,27 @@ def train():
     #             name=config.EXPERIMENT,
     #             group=config.MODEL.TYPE)
 
-    # create dataset
-    train_dataset = CaptioningDataset(True, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
-    val_dataset = CaptioningDataset(False, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
+    # create dataset, from the frames create_encoding.py stored for this config
+    encoding_dir = get_config_encoding_dir(config)
+    print(f"Using encodings at {encoding_dir}")
+    train_dataset = CaptioningDataset(encoding_dir, True, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
+    val_dataset = CaptioningDataset(encoding_dir, False, config.DATA.MEAN, config.DATA.STD, config.DATA.FRAME_SKIP)
 
     # create dataloaders
     batch_size = config.TRAIN.BATCH_SIZE
     num_workers = config.DATA.NUM_WORKERS
-    train_loader = DataLoader(train_dataset,batch_size=batch_size,
-                                              pin_memory=True,drop_last=True,num_workers=num_workers,)
-    valid_loader = DataLoader(val_dataset,batch_size=batch_size,
+    # batches of similar caption lengths, padded to their longest caption
+    collate_fn = trim_caption_collate_fn()
+    train_sampler = BucketBatchSampler(train_dataset.caption_lengths(), batch_size, get_bucket_boundaries(config),
+                                       shuffle=True, drop_last=True, seed=config.SEED)
+    val_sampler = BucketBatchSampler(val_dataset.caption_lengths(), batch_size, get_bucket_boundaries(config),
+                                     shuffle=False)
+    print(f"Padding ratio: train {train_sampler.padding_ratio():.3f}, val {val_sampler.padding_ratio():.3f}")
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler,
+                                              pin_memory=True,num_workers=num_workers,collate_fn=collate_fn)
+    valid_loader = DataLoader(val_dataset, batch_sampler=val_sampler,
                                 num_workers=num_workers,
-                                pin_memory=True,drop_last=False,)
+                                pin_memory=True,collate_fn=collate_fn)
     # crete model
     lit_module = VideoCaptioningModel(config)
     lit_module.encoder.vit.time_embed = torch.nn.Parameter(torch.concat([lit_module.encoder.vit.time_embed.data]*4, axis=1))